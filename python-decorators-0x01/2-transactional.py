@@ -1,44 +1,47 @@
-import sqlite3
 import functools
 
+from cache_invalidation import flush_writes, track_writes
+from connection_pool import get_pool
+
 def with_db_connection(func):
     """
     Decorator that automatically handles opening and closing database connections.
-    Opens a SQLite connection, passes it to the decorated function, and ensures
-    the connection is closed afterward, even if an exception occurs.
+    Takes a SQLite connection from the shared pool (see connection_pool.py),
+    passes it to the decorated function, and ensures it goes back to the pool
+    afterward, even if an exception occurs.
     """
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        # Open a connection to the database
-        conn = sqlite3.connect('users.db')
-        try:
+        # Borrow a connection from the shared pool instead of opening one,
+        # invalidating cached results of the tables written through it
+        with get_pool('users.db').connection() as conn, track_writes(conn):
             # Add the connection as the first argument
-            result = func(conn, *args, **kwargs)
-            return result
-        finally:
-            # Ensure the connection is closed, even if an exception occurs
-            conn.close()
+            return func(conn, *args, **kwargs)
     return wrapper
 
 def transactional(func):
     """
     Decorator that wraps a database operation inside a transaction.
     Automatically commits changes if the function executes successfully,
-    or rolls back if an error occurs.
+    or rolls back if an error occurs. Cached query results of the tables
+    written are invalidated on commit, not on rollback.
     """
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
-        try:
-            # Execute the function
-            result = func(conn, *args, **kwargs)
-            # If successful, commit the transaction
-            conn.commit()
-            return result
-        except Exception as e:
-            # If an error occurs, roll back the transaction
-            conn.rollback()
-            # Re-raise the exception to maintain the error information
-            raise e
+        with track_writes(conn):
+            try:
+                # Execute the function
+                result = func(conn, *args, **kwargs)
+                # If successful, commit the transaction
+                conn.commit()
+                # Only now can readers see the new rows: drop the cached ones
+                flush_writes(conn)
+                return result
+            except Exception as e:
+                # If an error occurs, roll back the transaction
+                conn.rollback()
+                # Re-raise the exception to maintain the error information
+                raise e
     return wrapper
 
 @with_db_connection
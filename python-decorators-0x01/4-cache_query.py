@@ -1,62 +1,108 @@
 import time
-import sqlite3 
 import functools
 
-# Cache dictionary to store query results
-query_cache = {}
+from cache_engine import QueryCache, SingleFlight, MISSING
+from cache_invalidation import (cache_key, is_read_only, register_cache, shared_cache_from_env,
+                                tables_read, track_writes, unregister_cache)
+from connection_pool import get_pool
+from shared_cache import TieredCache
+
+# Bounded cache of query results: least recently used entries are evicted
+# past 1024 entries or ~64 MB, and entries expire after 5 minutes.
+# Entries are tagged with the tables they read and dropped as soon as a
+# write to one of them is committed (see cache_invalidation.py).
+# query_cache.stats() returns the hit/miss/eviction counters.
+query_cache = QueryCache(max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=300)
+
+# Optional second tier shared by the processes of this host (e.g. gunicorn
+# workers), stored in a local SQLite file: set QUERY_CACHE_PATH to its path.
+# Results found there skip the query even in a freshly started process.
+# Writes made by processes that don't import this module still invalidate
+# it, as long as they see the same QUERY_CACHE_PATH (see track_writes).
+shared_cache = shared_cache_from_env()
+if shared_cache is not None:
+    # Invalidated through the tiered cache from now on
+    unregister_cache(shared_cache)
+    query_cache = TieredCache(query_cache, shared_cache)
+register_cache(query_cache)
+
+# Concurrent misses on the same query run it once: the other callers wait
+# up to 30 seconds for that result. query_flights.stats()['coalesced']
+# counts the executions saved.
+query_flights = SingleFlight(timeout=30.0)
 
 def with_db_connection(func):
     """
     Decorator that automatically handles opening and closing database connections.
-    Opens a SQLite connection, passes it to the decorated function, and ensures
-    the connection is closed afterward, even if an exception occurs.
+    Takes a SQLite connection from the shared pool (see connection_pool.py),
+    passes it to the decorated function, and ensures it goes back to the pool
+    afterward, even if an exception occurs.
     """
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        # Open a connection to the database
-        conn = sqlite3.connect('users.db')
-        try:
+        # Borrow a connection from the shared pool instead of opening one,
+        # invalidating cached results of the tables written through it
+        with get_pool('users.db').connection() as conn, track_writes(conn):
             # Add the connection as the first argument
-            result = func(conn, *args, **kwargs)
-            return result
-        finally:
-            # Ensure the connection is closed, even if an exception occurs
-            conn.close()
+            return func(conn, *args, **kwargs)
     return wrapper
 
 def cache_query(func):
     """
-    Decorator that caches query results based on the SQL query string.
-    Subsequent calls with the same query string will return the cached result
-    instead of executing the query again.
+    Decorator that caches query results based on the SQL query and its parameters.
+    Subsequent calls with the same query (up to whitespace and case) and the
+    same parameters will return the cached result instead of executing the
+    query again, until a write to one of the tables it reads is committed.
+    Statements other than SELECT are never cached. When several threads miss
+    on the same query at once, only the first one executes it and the others
+    get its result (or its exception).
     """
     @functools.wraps(func)
     def wrapper(conn, *args, **kwargs):
-        # Extract the query string
+        # Extract the query string and its parameters
         query = kwargs.get('query') if kwargs.get('query') else args[0] if args else None
+        params = kwargs.get('params') if 'params' in kwargs else args[1] if len(args) > 1 else None
         
-        if not query:
-            # If no query is provided, just call the original function
+        if not query or not is_read_only(query):
+            # If no query is provided or it writes, just call the original function
             return func(conn, *args, **kwargs)
         
-        # Check if this query is in the cache
-        if query in query_cache:
+        # Check if this query is in the cache (and has not expired)
+        key = cache_key(query, params)
+        result = query_cache.get(key)
+        if result is not MISSING:
             print(f"Using cached result for query: {query}")
-            return query_cache[query]
+            return result
+        
+        def execute():
+            # A flight that ended just before this one started may have
+            # cached the result already (the miss is already counted)
+            result = query_cache.peek(key)
+            if result is not MISSING:
+                print(f"Using cached result for query: {query}")
+                return result
+            # Execute the function and cache the result, unless one of its
+            # tables was written meanwhile (the result may be stale)
+            print(f"Executing and caching query: {query}")
+            tags = sorted(tables_read(query))
+            generation = query_cache.generation(tags)
+            result = func(conn, *args, **kwargs)
+            query_cache.set(key, result, tags=tags, generation=generation)
+            return result
         
-        # Otherwise, execute the function and cache the result
-        print(f"Executing and caching query: {query}")
-        result = func(conn, *args, **kwargs)
-        query_cache[query] = result
+        # Otherwise, execute it, or wait for a thread already executing it
+        result, shared = query_flights.do(key, execute)
+        if shared:
+            print(f"Using coalesced result for query: {query}")
         return result
     
     return wrapper
 
 @with_db_connection
 @cache_query
-def fetch_users_with_cache(conn, query):
+def fetch_users_with_cache(conn, query, params=()):
     cursor = conn.cursor()
-    cursor.execute(query)
+    cursor.execute(query, params)
     return cursor.fetchall()
 
 # First call will cache the result
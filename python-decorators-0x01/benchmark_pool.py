@@ -0,0 +1,93 @@
+import argparse
+import sqlite3
+import threading
+import time
+
+from connection_pool import ConnectionPool, sqlite_factory
+
+
+def setup_database(database, rows=1000):
+    """Creates a small users table to query, if it does not exist yet."""
+    conn = sqlite3.connect(database)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            email TEXT NOT NULL
+        )
+    """)
+    if conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 0:
+        conn.executemany("INSERT INTO users (id, name, email) VALUES (?, ?, ?)",
+                         [(i, f"User {i}", f"user{i}@example.com") for i in range(1, rows + 1)])
+        conn.commit()
+    conn.close()
+
+
+def short_query(conn, user_id):
+    """The kind of short query that dominates request handling."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM users WHERE id = ?", (user_id,))
+    return cursor.fetchone()
+
+
+def connect_per_call(database):
+    """Current behavior: open and close a connection on every call."""
+    def call(user_id):
+        conn = sqlite3.connect(database)
+        try:
+            return short_query(conn, user_id)
+        finally:
+            conn.close()
+    return call
+
+
+def pooled(pool):
+    """Pooled behavior: borrow a connection for the duration of the call."""
+    def call(user_id):
+        with pool.connection() as conn:
+            return short_query(conn, user_id)
+    return call
+
+
+def run(call, calls, threads):
+    """Runs calls in total spread over threads; returns calls per second."""
+    per_thread = calls // threads
+
+    def work(offset):
+        for i in range(per_thread):
+            call((offset + i) % 1000 + 1)
+
+    workers = [threading.Thread(target=work, args=(n * per_thread,)) for n in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Connection pool vs connect-per-call")
+    parser.add_argument('--database', default='benchmark_users.db')
+    parser.add_argument('--calls', type=int, default=20000)
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--pool-size', type=int, default=8)
+    args = parser.parse_args()
+
+    setup_database(args.database)
+    print(f"{'threads':>7}  {'connect/call':>14}  {'pool':>14}  {'per_thread':>14}  speedup")
+    for threads in args.threads:
+        baseline = run(connect_per_call(args.database), args.calls, threads)
+        results = []
+        for per_thread in (False, True):
+            pool = ConnectionPool(sqlite_factory(args.database), max_size=max(args.pool_size, threads)
+                                  if per_thread else args.pool_size, per_thread=per_thread)
+            results.append(run(pooled(pool), args.calls, threads))
+            pool.close()
+        print(f"{threads:>7}  {baseline:>10.0f}/s  {results[0]:>10.0f}/s  "
+              f"{results[1]:>10.0f}/s  {results[0] / baseline:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,399 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+# Returned by QueryCache.get() on a miss, so that None can be cached
+MISSING = object()
+
+
+def approximate_size(value, _depth=0):
+    """
+    Approximate memory footprint of a query result, in bytes.
+    Follows lists, tuples, sets and dicts (a few levels deep) and adds up
+    sys.getsizeof() of everything found.
+    """
+    size = sys.getsizeof(value)
+    if _depth >= 3:
+        return size
+    if isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, _depth + 1) for item in value)
+    elif isinstance(value, dict):
+        size += sum(approximate_size(k, _depth + 1) + approximate_size(v, _depth + 1)
+                    for k, v in value.items())
+    return size
+
+
+class _Stripe:
+    """One independently locked part of the cache, with its own LRU order."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # key -> (value, size, expires, tags), least recently used first
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.rejected = 0
+
+
+class QueryCache:
+    """
+    Bounded, thread-safe LRU cache with per-entry expiry.
+
+    Keys are spread over `stripes` independently locked stripes, so threads
+    working on different keys rarely wait for each other. Each stripe keeps
+    its own least-recently-used order and gets an equal share of the entry
+    limit; when a stripe is over it, its least recently used entries are
+    evicted. The byte limit applies to the whole cache: when it is exceeded,
+    the least recently used entry of each stripe in turn is evicted until
+    the cache fits again. Entries older than their TTL are never returned
+    and are dropped when found. A value larger than max_bytes is not
+    cached at all.
+
+    Entries can be tagged (e.g. with the tables a query read), and
+    invalidate_tags() drops every entry with one of the given tags. Each tag
+    has a generation counter bumped on invalidation: a value computed while
+    its tags were invalidated is refused by set(), so a result read before
+    a concurrent write never gets cached after it.
+
+    Args:
+        max_entries: Maximum number of cached entries
+        max_bytes: Maximum approximate size of the cached values, in bytes
+        ttl: Default time to live of an entry in seconds (None: no expiry)
+        stripes: Number of independently locked stripes
+        sizeof: Function estimating the size of a value in bytes
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=64 * 1024 * 1024, ttl=300.0,
+                 stripes=16, sizeof=approximate_size, clock=time.monotonic):
+        if max_entries <= 0 or max_bytes <= 0 or stripes <= 0:
+            raise ValueError("Cache limits and stripe count must be positive")
+        stripes = min(stripes, max_entries)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.clock = clock
+        self._stripes = [_Stripe() for _ in range(stripes)]
+        self._stripe_entries = max(max_entries // stripes, 1)
+        # Total size of the cached values, across all stripes
+        self._bytes = 0
+        self._bytes_lock = threading.Lock()
+        # Next stripe to evict from when the cache is over max_bytes
+        self._victim = 0
+        # Lock order: a stripe's lock, then _tag_lock
+        self._tag_lock = threading.Lock()
+        self._tag_keys = {}
+        self._tag_generations = {}
+        self._generation = 0
+        self._invalidations = 0
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    def get(self, key, default=MISSING):
+        """Returns the cached value of key, or default if it is missing or expired."""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is not None:
+                value, _, expires, _ = entry
+                if expires is None or self.clock() < expires:
+                    stripe.entries.move_to_end(key)
+                    stripe.hits += 1
+                    return value
+                # Expired: drop it
+                self._remove(stripe, key)
+                stripe.expirations += 1
+            stripe.misses += 1
+            return default
+
+    def peek(self, key, default=MISSING):
+        """
+        Like get(), but leaves the hit/miss counters and the LRU order
+        alone: for a second look at a key whose miss was already counted.
+        """
+        stripe = self._stripe(key)
+        with stripe.lock:
+            entry = stripe.entries.get(key)
+            if entry is None or (entry[2] is not None and self.clock() >= entry[2]):
+                return default
+            return entry[0]
+
+    def generation(self, tags=()):
+        """
+        Snapshot of the generation of tags, to pass to set() along with a
+        value computed after taking it.
+        """
+        with self._tag_lock:
+            return (self._generation,) + tuple(self._tag_generations.get(tag, 0)
+                                               for tag in tags)
+
+    def set(self, key, value, ttl=None, tags=(), generation=None):
+        """
+        Caches value under key for ttl seconds (the cache's default TTL if
+        None), tagged with tags. With generation (from generation(tags)),
+        the value is refused if one of its tags was invalidated since.
+        Returns False if the value was not cached (too large or stale).
+        """
+        size = self.sizeof(value)
+        ttl = self.ttl if ttl is None else ttl
+        tags = tuple(tags)
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if key in stripe.entries:
+                self._remove(stripe, key)
+            if size > self.max_bytes:
+                stripe.rejected += 1
+                return False
+            with self._tag_lock:
+                if generation is not None and generation != (self._generation,) + tuple(
+                        self._tag_generations.get(tag, 0) for tag in tags):
+                    stripe.rejected += 1
+                    return False
+                for tag in tags:
+                    self._tag_keys.setdefault(tag, set()).add(key)
+            expires = None if ttl is None else self.clock() + ttl
+            stripe.entries[key] = (value, size, expires, tags)
+            stripe.bytes += size
+            with self._bytes_lock:
+                self._bytes += size
+            self._shrink(stripe)
+        if self._bytes > self.max_bytes:
+            self._evict_bytes(key)
+        return True
+
+    def _remove(self, stripe, key):
+        """Drops an entry and its tags (called with the stripe's lock held)."""
+        _, size, _, tags = stripe.entries.pop(key)
+        stripe.bytes -= size
+        with self._bytes_lock:
+            self._bytes -= size
+        if tags:
+            with self._tag_lock:
+                for tag in tags:
+                    keys = self._tag_keys.get(tag)
+                    if keys is not None:
+                        keys.discard(key)
+                        if not keys:
+                            del self._tag_keys[tag]
+
+    def _shrink(self, stripe):
+        """Evicts least recently used entries until the stripe fits its entry limit."""
+        entries = stripe.entries
+        while len(entries) > self._stripe_entries:
+            self._remove(stripe, next(iter(entries)))
+            stripe.evictions += 1
+
+    def _evict_bytes(self, keep):
+        """
+        Evicts the least recently used entry of one stripe after the other
+        until the cache fits max_bytes, sparing the entry just set (keep)
+        while anything else can go. Takes one stripe lock at a time.
+        """
+        stripes = self._stripes
+        # Stripes in a row found with nothing to evict
+        empty = 0
+        while self._bytes > self.max_bytes and empty < len(stripes):
+            self._victim = (self._victim + 1) % len(stripes)
+            stripe = stripes[self._victim]
+            with stripe.lock:
+                victim = next((key for key in stripe.entries if key != keep), MISSING)
+                if victim is MISSING:
+                    empty += 1
+                    continue
+                self._remove(stripe, victim)
+                stripe.evictions += 1
+                empty = 0
+
+    def delete(self, key):
+        """Removes key from the cache; returns whether it was cached."""
+        stripe = self._stripe(key)
+        with stripe.lock:
+            if key not in stripe.entries:
+                return False
+            self._remove(stripe, key)
+            return True
+
+    def invalidate_tags(self, tags):
+        """
+        Drops every entry tagged with one of tags, and refuses values
+        computed before now for them. Returns how many entries were dropped.
+        """
+        keys = set()
+        with self._tag_lock:
+            for tag in tags:
+                self._tag_generations[tag] = self._tag_generations.get(tag, 0) + 1
+                keys.update(self._tag_keys.pop(tag, ()))
+            self._invalidations += len(keys)
+        dropped = 0
+        for key in keys:
+            dropped += self.delete(key)
+        return dropped
+
+    def purge_expired(self):
+        """Drops every expired entry now; returns how many were dropped."""
+        dropped = 0
+        now = self.clock()
+        for stripe in self._stripes:
+            with stripe.lock:
+                expired = [key for key, (_, _, expires, _) in stripe.entries.items()
+                           if expires is not None and expires <= now]
+                for key in expired:
+                    self._remove(stripe, key)
+                stripe.expirations += len(expired)
+                dropped += len(expired)
+        return dropped
+
+    def clear(self):
+        """Empties the cache (counters are kept)."""
+        with self._tag_lock:
+            # Values computed before the clear are refused by set()
+            self._generation += 1
+            self._tag_keys.clear()
+        for stripe in self._stripes:
+            with stripe.lock:
+                stripe.entries.clear()
+                with self._bytes_lock:
+                    self._bytes -= stripe.bytes
+                stripe.bytes = 0
+
+    def stats(self):
+        """Returns the hit/miss/eviction counters and current size."""
+        totals = dict.fromkeys(('hits', 'misses', 'evictions', 'expirations',
+                                'rejected', 'entries', 'bytes'), 0)
+        for stripe in self._stripes:
+            with stripe.lock:
+                totals['hits'] += stripe.hits
+                totals['misses'] += stripe.misses
+                totals['evictions'] += stripe.evictions
+                totals['expirations'] += stripe.expirations
+                totals['rejected'] += stripe.rejected
+                totals['entries'] += len(stripe.entries)
+                totals['bytes'] += stripe.bytes
+        with self._tag_lock:
+            totals['invalidations'] = self._invalidations
+        lookups = totals['hits'] + totals['misses']
+        totals['hit_rate'] = totals['hits'] / lookups if lookups else 0.0
+        return totals
+
+    def __len__(self):
+        return sum(len(stripe.entries) for stripe in self._stripes)
+
+    def __contains__(self, key):
+        return self.get(key) is not MISSING
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is MISSING:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __delitem__(self, key):
+        if not self.delete(key):
+            raise KeyError(key)
+
+
+class _Call:
+    """A computation in flight in a SingleFlight, and its outcome."""
+
+    __slots__ = ('owner', 'done', 'result', 'error')
+
+    def __init__(self):
+        self.owner = threading.get_ident()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent computations of the same key: the first caller
+    runs it, and callers arriving while it runs wait for its result (or
+    its exception) instead of running it again. Once it is over, the next
+    caller starts a new one.
+
+    Args:
+        timeout: Default seconds a caller waits for a computation in
+            flight (None waits forever)
+    """
+
+    def __init__(self, timeout=None):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._leaders = 0
+        self._coalesced = 0
+        self._timeouts = 0
+
+    def do(self, key, func, timeout=None):
+        """
+        Runs func() unless a call for key is already in flight, in which
+        case waits for that call and shares its outcome.
+
+        Args:
+            key: What identifies the computation
+            func: Callable computing the value
+            timeout: Seconds to wait for a call in flight, overriding the
+                default timeout
+
+        Returns:
+            (result, shared): the value, and whether it came from another
+            caller's computation
+
+        Raises:
+            TimeoutError: If the call in flight did not finish in time
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = self._calls[key] = _Call()
+                leader = True
+                self._leaders += 1
+            elif call.owner == threading.get_ident():
+                # The computation needs its own key: waiting would never end
+                call = None
+                self._leaders += 1
+            else:
+                leader = False
+                self._coalesced += 1
+
+        if call is None:
+            return func(), False
+        if leader:
+            try:
+                call.result = func()
+            except BaseException as error:
+                call.error = error
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result, False
+
+        timeout = self.timeout if timeout is None else timeout
+        if not call.done.wait(timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise TimeoutError(f"Computation of {key!r} still running after {timeout} seconds")
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def in_flight(self):
+        """Number of computations running now."""
+        with self._lock:
+            return len(self._calls)
+
+    def stats(self):
+        """Returns how many calls ran, how many were coalesced and how many timed out."""
+        with self._lock:
+            return {'leaders': self._leaders, 'coalesced': self._coalesced,
+                    'timeouts': self._timeouts, 'in_flight': len(self._calls)}
@@ -0,0 +1,253 @@
+import os
+import re
+import threading
+import weakref
+
+from shared_cache import SharedCache
+
+# Quoted strings and identifiers, kept as they are by normalize_sql()
+_QUOTED = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACES = re.compile(r'\s+')
+
+_SOURCE = re.compile(r'\b(from|join)\s+')
+# What ends the list of tables after FROM (or the table after JOIN)
+_SOURCE_END = re.compile(r'\b(?:where|group|order|limit|on|using|union|except|intersect|having'
+                         r'|window|join|inner|left|right|full|cross|natural)\b|[()]')
+_WRITE_TABLE = re.compile(
+    r'^(?:(?:insert|replace)(?:\s+or\s+\w+)?\s+into|update(?:\s+or\s+\w+)?|delete\s+from'
+    r'|drop\s+table(?:\s+if\s+exists)?|alter\s+table)\s+([\w".]+)')
+
+# Caches invalidated by invalidate_tables()
+_caches = weakref.WeakSet()
+
+# Environment variable naming the file of the cache shared by the
+# processes of this host, and the SharedCache opened for each path
+SHARED_CACHE_ENV = 'QUERY_CACHE_PATH'
+_shared_caches = {}
+_shared_lock = threading.Lock()
+
+# Connections whose writes are being tracked: id(conn) -> _WriteTracker
+_trackers = {}
+_trackers_lock = threading.Lock()
+
+
+def normalize_sql(query):
+    """
+    Normalizes a SQL statement so that equivalent spellings share a cache
+    key: whitespace is collapsed, keywords and names are lowercased and a
+    trailing semicolon is dropped. Quoted strings are left untouched,
+    spaces and punctuation inside them included.
+    """
+    parts = []
+    position = 0
+    for match in _QUOTED.finditer(query):
+        parts.append(_normalize_code(query[position:match.start()]))
+        parts.append(match.group())
+        position = match.end()
+    parts.append(_normalize_code(query[position:]).rstrip('; '))
+    return ''.join(parts).strip()
+
+
+def _normalize_code(sql):
+    """
+    normalize_sql() of a part of a statement outside quotes. Whitespace
+    next to the quoted parts is collapsed but kept, so "main"."users"
+    stays one name.
+    """
+    sql = _SPACES.sub(' ', sql.lower())
+    return sql.replace(' ,', ',').replace('( ', '(').replace(' )', ')')
+
+
+def _freeze(params):
+    """Turns query parameters into a hashable value."""
+    if params is None:
+        return ()
+    if isinstance(params, dict):
+        return tuple(sorted(params.items()))
+    if isinstance(params, (list, tuple)):
+        return tuple(params)
+    return (params,)
+
+
+def cache_key(query, params=None):
+    """Cache key of a query: its normalized SQL and its bind parameters."""
+    return normalize_sql(query), _freeze(params)
+
+
+def _name(identifier):
+    """Table name of an identifier, without quotes or schema (main.users: users)"""
+    return identifier.split('.')[-1].strip('"').lower()
+
+
+def tables_read(query):
+    """
+    Tables a SELECT statement reads (those after FROM and JOIN, including
+    in subqueries). Simple parsing: table names only, no views.
+    """
+    # String literals could contain anything, including "from"
+    sql = _STRING.sub("''", normalize_sql(query))
+    tables = set()
+    for match in _SOURCE.finditer(sql):
+        rest = sql[match.end():]
+        if rest.startswith('('):
+            # Subquery: its own FROM is found by the loop
+            continue
+        end = _SOURCE_END.search(rest)
+        items = rest[:end.start() if end else len(rest)]
+        if match.group(1) == 'join':
+            items = items.split(',')[0]
+        for item in items.split(','):
+            words = item.split()
+            if words:
+                tables.add(_name(words[0]))
+    return tables
+
+
+def tables_written(statement):
+    """Table an INSERT/UPDATE/DELETE (or DROP/ALTER TABLE) writes, or None."""
+    sql = normalize_sql(statement)
+    if sql.startswith('with '):
+        # WITH ... INSERT/UPDATE/DELETE: look at the statement after the CTEs
+        match = re.search(r'\)\s*((?:insert|replace|update|delete)\b.*)$', sql)
+        sql = match.group(1) if match else sql
+    match = _WRITE_TABLE.match(sql)
+    return _name(match.group(1)) if match else None
+
+
+def is_read_only(query):
+    """Tells whether a statement only reads (SELECT, or WITH ... SELECT)."""
+    sql = normalize_sql(query)
+    return (sql.startswith('select') or sql.startswith('with')) and tables_written(sql) is None
+
+
+def register_cache(cache):
+    """Makes invalidate_tables() invalidate cache (a cache_engine.QueryCache)."""
+    _caches.add(cache)
+    return cache
+
+
+def unregister_cache(cache):
+    """Stops invalidate_tables() from invalidating cache."""
+    _caches.discard(cache)
+
+
+def shared_cache_from_env():
+    """
+    Returns the SharedCache stored at $QUERY_CACHE_PATH, or None if the
+    variable is not set. It is opened and registered on the first call, so
+    that a process which only writes (and never reads through cache_query)
+    still invalidates the results cached by the other processes.
+    invalidate_tables() calls it before every invalidation.
+    """
+    path = os.environ.get(SHARED_CACHE_ENV)
+    if not path:
+        return None
+    with _shared_lock:
+        cache = _shared_caches.get(path)
+        if cache is None:
+            cache = _shared_caches[path] = register_cache(SharedCache(path, ttl=300))
+    return cache
+
+
+def invalidate_tables(tables):
+    """Drops the cached results that read any of tables from every registered cache."""
+    tables = {_name(table) for table in tables}
+    if not tables:
+        return 0
+    shared_cache_from_env()
+    return sum(cache.invalidate_tags(tables) for cache in list(_caches))
+
+
+class _WriteTracker:
+    """
+    Watches the statements run on a sqlite3 connection (through its trace
+    callback) and collects the tables written, once they are committed.
+
+    The trace callback runs when a statement starts, so a COMMIT seen there
+    is not over yet: a reader could still get the old rows. The committed
+    tables are only invalidated by flush(), called once commit() returned.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.depth = 0
+        # Written in the current transaction
+        self.pending = set()
+        # Written and committed, not invalidated yet
+        self.committed = set()
+
+    def trace(self, statement):
+        sql = statement.lstrip()[:16].lower()
+        if sql.startswith('commit') or sql.startswith('end'):
+            self.committed |= self.pending
+            self.pending = set()
+        elif sql.startswith('rollback'):
+            self.pending.clear()
+        else:
+            table = tables_written(statement)
+            if table is not None:
+                self.pending.add(table)
+
+    def flush(self):
+        if not self.conn.in_transaction:
+            # Autocommit mode: the writes are already committed
+            self.committed |= self.pending
+            self.pending = set()
+        if self.committed:
+            # Cleared only once done: a failed invalidation is retried by
+            # the next flush (and raised to the caller meanwhile)
+            invalidate_tables(self.committed)
+            self.committed = set()
+
+
+def flush_writes(conn):
+    """
+    Invalidates the tables whose writes on conn were committed, if conn is
+    tracked by track_writes. Call it after commit() returns to invalidate
+    before the tracked block ends.
+    """
+    with _trackers_lock:
+        tracker = _trackers.get(id(conn))
+    if tracker is not None:
+        tracker.flush()
+
+
+class track_writes:
+    """
+    Context manager invalidating the cached results of the tables written
+    on a sqlite3 connection, once the writes are committed. Committed
+    writes are invalidated when the block ends (or by flush_writes());
+    writes still uncommitted then are not. Nested blocks on the same
+    connection share one tracker. With QUERY_CACHE_PATH set, the cache
+    shared with the other processes is invalidated too.
+
+    Uses the connection's trace callback. Tables modified indirectly (by
+    triggers or foreign key actions) are not seen.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.tracker = None
+
+    def __enter__(self):
+        with _trackers_lock:
+            tracker = _trackers.get(id(self.conn))
+            if tracker is None:
+                tracker = _trackers[id(self.conn)] = _WriteTracker(self.conn)
+                self.conn.set_trace_callback(tracker.trace)
+            tracker.depth += 1
+        self.tracker = tracker
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        tracker = self.tracker
+        with _trackers_lock:
+            tracker.depth -= 1
+            outermost = tracker.depth == 0
+            if outermost:
+                del _trackers[id(self.conn)]
+        if outermost:
+            self.conn.set_trace_callback(None)
+        tracker.flush()
+        return False
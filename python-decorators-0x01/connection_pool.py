@@ -0,0 +1,379 @@
+import os
+import sqlite3
+import threading
+import time
+import weakref
+
+
+def sqlite_factory(database):
+    """
+    Returns a factory opening SQLite connections to a database file.
+    Connections may be used by any thread, one thread at a time, which is
+    what the pool guarantees.
+    """
+    def factory():
+        return sqlite3.connect(database, check_same_thread=False)
+    return factory
+
+
+def ping(conn):
+    """
+    Default health check: runs a trivial query on the connection.
+    Raises if the connection is no longer usable.
+    """
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT 1")
+        cursor.fetchall()
+    finally:
+        cursor.close()
+
+
+class _Entry:
+    """A pooled connection and its bookkeeping."""
+
+    __slots__ = ('conn', 'last_used', 'depth')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.last_used = time.monotonic()
+        self.depth = 0
+
+
+class _Pin:
+    """
+    Thread-local holder of a per-thread connection. The thread's locals
+    are freed when it ends, which gives the connection back to the pool.
+    """
+
+    __slots__ = ('entry', 'finalizer', '__weakref__')
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections.
+
+    Connections are created on demand by a pluggable factory, up to
+    max_size open at once. In checkout mode a connection belongs to one
+    caller between acquire() and release(); when every connection is out,
+    acquire() waits up to timeout seconds for one to come back. In
+    per_thread mode each thread keeps the connection it first acquired
+    (nested acquires return the same one) until the thread ends, when it
+    goes back to the pool.
+
+    Idle connections are closed after idle_timeout seconds. A connection
+    that has been idle for more than check_after seconds is health checked
+    before it is handed out, and replaced if the check fails. Uncommitted
+    work is rolled back when a connection is released, like closing it
+    would. After os.fork() the child process never reuses the parent's
+    connections: it starts with an empty pool.
+
+    Args:
+        factory: Callable returning a new DB-API connection
+        max_size: Maximum number of open connections
+        timeout: Seconds acquire() waits for a free connection
+            (None waits forever)
+        idle_timeout: Seconds after which an idle connection is closed
+            (None keeps them open)
+        health_check: Callable raising if a connection is broken, or None
+        check_after: Seconds of idleness after which a connection is
+            health checked on checkout (0 checks every checkout)
+        per_thread: Pin connections to threads instead of checking them out
+    """
+
+    def __init__(self, factory, max_size=8, timeout=30.0, idle_timeout=300.0,
+                 health_check=ping, check_after=1.0, per_thread=False):
+        if max_size <= 0:
+            raise ValueError("Pool size must be a positive integer")
+        self.factory = factory
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.health_check = health_check
+        self.check_after = check_after
+        self.per_thread = per_thread
+        self._reset()
+        self._closed = False
+
+        # Drop inherited connections in a forked child right away
+        if hasattr(os, 'register_at_fork'):
+            pool = weakref.ref(self)
+            os.register_at_fork(after_in_child=lambda: pool() and pool()._reset())
+
+    def _reset(self):
+        """Starts over with no connection (used at creation and after fork)"""
+        self._pid = os.getpid()
+        # A forked child starts with counters of its own
+        self.stats = {'created': 0, 'reused': 0, 'evicted': 0, 'failed_checks': 0, 'waits': 0}
+        self._cond = threading.Condition()
+        self._idle = []
+        self._out = {}
+        self._size = 0
+        self._local = threading.local()
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Connections opened by the parent process must not be shared
+            # with it, nor closed here: forget them
+            self._reset()
+
+    def _discard(self, entry):
+        try:
+            entry.conn.close()
+        except Exception:
+            pass
+
+    def _evict_idle(self, now):
+        """Closes the connections idle for too long (called with the lock held)"""
+        if self.idle_timeout is None:
+            return []
+        expired = [e for e in self._idle if now - e.last_used > self.idle_timeout]
+        if expired:
+            self._idle = [e for e in self._idle if now - e.last_used <= self.idle_timeout]
+            self._size -= len(expired)
+            self.stats['evicted'] += len(expired)
+            self._cond.notify(len(expired))
+        return expired
+
+    def _healthy(self, entry, now):
+        if self.health_check is None or now - entry.last_used <= self.check_after:
+            return True
+        try:
+            self.health_check(entry.conn)
+            return True
+        except Exception:
+            with self._cond:
+                self.stats['failed_checks'] += 1
+            return False
+
+    def _checkout(self, timeout):
+        """Takes an idle connection or opens a new one, waiting if needed"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        waited = False
+        while True:
+            entry = None
+            create = False
+            with self._cond:
+                if self._closed:
+                    raise RuntimeError("Connection pool is closed")
+                now = time.monotonic()
+                expired = self._evict_idle(now)
+                if self._idle:
+                    # Most recently used first: its server side state is warm
+                    entry = self._idle.pop()
+                elif self._size < self.max_size:
+                    self._size += 1
+                    create = True
+                else:
+                    remaining = None if deadline is None else deadline - now
+                    if remaining is not None and remaining <= 0:
+                        raise TimeoutError(f"No free connection after {timeout} seconds "
+                                           f"({self.max_size} in use)")
+                    if not waited:
+                        self.stats['waits'] += 1
+                        waited = True
+                    self._cond.wait(remaining)
+            for old in expired:
+                self._discard(old)
+
+            if create:
+                try:
+                    entry = _Entry(self.factory())
+                except Exception:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+                with self._cond:
+                    self.stats['created'] += 1
+                return entry
+            if entry is not None:
+                if self._healthy(entry, time.monotonic()):
+                    with self._cond:
+                        self.stats['reused'] += 1
+                    return entry
+                # Broken connection: drop it and try again
+                self._discard(entry)
+                with self._cond:
+                    self._size -= 1
+                    self._cond.notify()
+
+    def acquire(self, timeout=None):
+        """
+        Returns a connection from the pool.
+
+        Args:
+            timeout: Seconds to wait for a free connection, overriding the
+                pool's timeout
+
+        Raises:
+            TimeoutError: If no connection became free in time
+        """
+        self._check_fork()
+        if self.per_thread:
+            pin = getattr(self._local, 'pin', None)
+            if pin is not None:
+                entry = pin.entry
+                if entry.depth == 0 and not self._healthy(entry, time.monotonic()):
+                    self._unpin_current()
+                    self._give_back(entry, discard=True)
+                else:
+                    entry.depth += 1
+                    return entry.conn
+
+        entry = self._checkout(self.timeout if timeout is None else timeout)
+        entry.depth = 1
+        with self._cond:
+            self._out[id(entry.conn)] = entry
+        if self.per_thread:
+            pin = _Pin()
+            pin.entry = entry
+            # Give the connection back when the thread ends
+            pin.finalizer = weakref.finalize(pin, self._unpin, entry, self._pid)
+            self._local.pin = pin
+        return entry.conn
+
+    def _unpin(self, entry, pid):
+        if pid == self._pid:
+            entry.depth = 0
+            self._give_back(entry, discard=False)
+
+    def _unpin_current(self):
+        """Forgets the current thread's connection without giving it back"""
+        pin = self._local.pin
+        pin.finalizer.detach()
+        self._local.pin = None
+
+    def _give_back(self, entry, discard):
+        with self._cond:
+            if self._out.pop(id(entry.conn), None) is None:
+                return
+        if not discard:
+            try:
+                # Leave no transaction open for the next user
+                if getattr(entry.conn, 'in_transaction', True):
+                    entry.conn.rollback()
+            except Exception:
+                discard = True
+        with self._cond:
+            if discard or self._closed:
+                self._size -= 1
+            else:
+                entry.last_used = time.monotonic()
+                self._idle.append(entry)
+            self._cond.notify()
+        if discard or self._closed:
+            self._discard(entry)
+
+    def release(self, conn, discard=False):
+        """
+        Gives a connection back to the pool.
+
+        Args:
+            conn: A connection returned by acquire()
+            discard: Close it instead of keeping it, e.g. after an error
+                that may have broken it
+        """
+        if self._pid != os.getpid():
+            return
+        with self._cond:
+            entry = self._out.get(id(conn))
+            if entry is None:
+                return
+            entry.depth -= 1
+        if self.per_thread:
+            entry.last_used = time.monotonic()
+            if not discard:
+                # The thread keeps its connection
+                return
+            self._unpin_current()
+        elif entry.depth > 0:
+            return
+        self._give_back(entry, discard)
+
+    def connection(self, timeout=None):
+        """Context manager acquiring a connection and releasing it afterwards"""
+        return _Borrowed(self, timeout)
+
+    def close(self):
+        """Closes the idle connections; busy ones are closed when released"""
+        with self._cond:
+            self._closed = True
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for entry in idle:
+            self._discard(entry)
+
+    def status(self):
+        """Returns the pool counters and current sizes"""
+        with self._cond:
+            return dict(self.stats, size=self._size, idle=len(self._idle),
+                        in_use=len(self._out))
+
+
+class _Borrowed:
+    """Context manager returned by ConnectionPool.connection()"""
+
+    def __init__(self, pool, timeout):
+        self.pool = pool
+        self.timeout = timeout
+        self.conn = None
+
+    def __enter__(self):
+        self.conn = self.pool.acquire(self.timeout)
+        return self.conn
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.pool.release(self.conn, discard=_is_broken(exc_type))
+        return False
+
+
+def _is_broken(exc_type):
+    """
+    Tells whether an error may have left the connection unusable.
+    Query errors (bad SQL, constraint violations, locked database) do not.
+    """
+    if exc_type is None or not issubclass(exc_type, sqlite3.Error):
+        return False
+    return not issubclass(exc_type, (sqlite3.OperationalError, sqlite3.IntegrityError,
+                                     sqlite3.ProgrammingError))
+
+
+# Shared pools, one per database, used by with_db_connection
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(database='users.db', **options):
+    """
+    Returns the shared pool of a database, creating it on first use.
+
+    Args:
+        database: SQLite database file
+        **options: ConnectionPool options used when the pool is created
+            (factory defaults to sqlite_factory(database))
+    """
+    pool = _pools.get(database)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(database)
+            if pool is None:
+                options.setdefault('factory', sqlite_factory(database))
+                pool = _pools[database] = ConnectionPool(**options)
+    return pool
+
+
+def configure_pool(database='users.db', **options):
+    """
+    Replaces the shared pool of a database, e.g. to plug in another
+    connection factory or change its size. Returns the new pool.
+    """
+    options.setdefault('factory', sqlite_factory(database))
+    pool = ConnectionPool(**options)
+    with _pools_lock:
+        old = _pools.get(database)
+        _pools[database] = pool
+    if old is not None:
+        old.close()
+    return pool
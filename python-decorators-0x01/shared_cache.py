@@ -0,0 +1,521 @@
+import logging
+import mmap
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+
+from cache_engine import MISSING
+
+logger = logging.getLogger(__name__)
+
+# Layout of the invalidation counter file: one little-endian unsigned 64-bit int
+_COUNTER = struct.Struct('<Q')
+
+
+def _pack(value):
+    """
+    Pickles value with protocol 5. Buffers exposed out-of-band (PickleBuffer,
+    NumPy arrays and the like) are kept apart from the pickle stream instead
+    of being copied into it: returns (payload, buffers), buffers being their
+    lengths followed by their bytes, or None if there are none.
+    """
+    buffers = []
+    payload = pickle.dumps(value, protocol=5, buffer_callback=buffers.append)
+    if not buffers:
+        return payload, None
+    views = [buffer.raw() for buffer in buffers]
+    header = struct.pack(f'<I{len(views)}Q', len(views), *(view.nbytes for view in views))
+    return payload, b''.join([header] + views)
+
+
+def _unpack(payload, buffers):
+    """Reverses _pack(); the out-of-band buffers are sliced, not copied."""
+    if buffers is None:
+        return pickle.loads(payload)
+    view = memoryview(buffers)
+    count, = struct.unpack_from('<I', view)
+    lengths = struct.unpack_from(f'<{count}Q', view, 4)
+    position = 4 + 8 * count
+    parts = []
+    for length in lengths:
+        parts.append(view[position:position + length])
+        position += length
+    return pickle.loads(payload, buffers=parts)
+
+
+def _key(key):
+    """
+    Stored form of a cache key. pickle.dumps() of two equal keys can
+    differ (e.g. when a string is referenced twice), so the key's repr is
+    used: it is the same in every process for keys made of strings,
+    numbers, bytes, None and tuples, like those of cache_key().
+    """
+    return repr(key)
+
+
+class SharedCache:
+    """
+    Query result cache stored in a local SQLite file, shared by every
+    process on the host that opens the same path (e.g. the workers of a
+    gunicorn server). No server is involved: processes coordinate through
+    SQLite's file locks, in WAL mode so readers never wait for a writer.
+
+    Values are pickled with protocol 5 and their out-of-band buffers
+    stored next to the pickle. Entries expire after their TTL (wall clock
+    time, which all processes agree on); past max_entries the oldest ones
+    are dropped. Entries are tagged like in QueryCache, and each tag has a
+    generation counter stored in the file: invalidate_tags() bumps it in
+    every process at once, and set() refuses a value computed before.
+
+    Every invalidation also increments a counter kept in a small memory
+    mapped file next to the database (path + '-generation'), so that a
+    process can tell whether anything was invalidated by reading 8 bytes.
+
+    An invalidation that fails (e.g. the file stays locked past timeout)
+    is logged and retried by the next set() or invalidate_tags(); until
+    then, this process neither reads nor stores entries with those tags.
+    Keys must be made of built-in values (see _key()).
+
+    Args:
+        path: SQLite file of the cache (created if missing)
+        ttl: Default time to live of an entry in seconds (None: no expiry)
+        max_entries: Maximum number of entries kept in the file
+        max_value_bytes: Largest pickled value stored, in bytes
+        timeout: Seconds to wait for another process's write to finish
+    """
+
+    # How many set() calls between two checks of max_entries
+    TRIM_EVERY = 64
+
+    def __init__(self, path='query_cache.db', ttl=300.0, max_entries=100000,
+                 max_value_bytes=8 * 1024 * 1024, timeout=5.0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_value_bytes = max_value_bytes
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('hits', 'misses', 'stores', 'rejected', 'invalidations'), 0)
+        self._sets = 0
+        # Tags whose invalidation failed, to retry
+        self._owed = set()
+        self._pid = None
+        self._connect()
+
+    def _connect(self):
+        """Opens the database and the counter file (again, after a fork)"""
+        self._pid = os.getpid()
+        conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None,
+                               check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Read pages through a memory mapping rather than read() calls
+        conn.execute("PRAGMA mmap_size=268435456")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key BLOB PRIMARY KEY,
+                payload BLOB NOT NULL,
+                buffers BLOB,
+                tags TEXT NOT NULL,
+                expires REAL,
+                stored REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_stored ON entries (stored);
+            CREATE TABLE IF NOT EXISTS entry_tags (
+                tag TEXT NOT NULL,
+                key BLOB NOT NULL,
+                PRIMARY KEY (tag, key)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS tag_generations (
+                tag TEXT PRIMARY KEY,
+                generation INTEGER NOT NULL,
+                changed INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS counters (
+                name TEXT PRIMARY KEY,
+                value INTEGER NOT NULL
+            ) WITHOUT ROWID;
+            INSERT OR IGNORE INTO counters (name, value) VALUES ('version', 0), ('cleared', 0);
+        """)
+        self._conn = conn
+
+        fd = os.open(self.path + '-generation', os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < _COUNTER.size:
+                os.ftruncate(fd, _COUNTER.size)
+            self._counter = mmap.mmap(fd, _COUNTER.size)
+        finally:
+            os.close(fd)
+        # The database is the reference, e.g. if the counter file was removed
+        _COUNTER.pack_into(self._counter, 0, self._counter_value('version'))
+
+    def _check_fork(self):
+        if self._pid != os.getpid():
+            # Never use a SQLite connection opened by the parent process
+            self._connect()
+
+    def _counter_value(self, name):
+        return self._conn.execute("SELECT value FROM counters WHERE name = ?",
+                                  (name,)).fetchone()[0]
+
+    def version(self):
+        """
+        Shared invalidation counter: changes whenever any process
+        invalidates tags or clears the cache. Cheap to call.
+        """
+        return _COUNTER.unpack_from(self._counter, 0)[0]
+
+    def _generation(self, tags):
+        conn = self._conn
+        generations = [self._counter_value('cleared')]
+        for tag in tags:
+            row = conn.execute("SELECT generation FROM tag_generations WHERE tag = ?",
+                               (tag,)).fetchone()
+            generations.append(row[0] if row else 0)
+        return tuple(generations)
+
+    def generation(self, tags=()):
+        """
+        Snapshot of the shared generation of tags, to pass to set() along
+        with a value computed after taking it.
+        """
+        with self._lock:
+            self._check_fork()
+            return self._generation(tags)
+
+    def get(self, key, default=MISSING):
+        """Returns (value, tags, expires) for key, or default if missing or expired"""
+        blob = _key(key)
+        with self._lock:
+            self._check_fork()
+            row = self._conn.execute(
+                "SELECT payload, buffers, tags, expires FROM entries WHERE key = ?",
+                (blob,)).fetchone()
+            tags = tuple(row[2].split('\x1f')) if row and row[2] else ()
+            if (row is None or (row[3] is not None and row[3] <= time.time())
+                    or self._owed.intersection(tags)):
+                self._stats['misses'] += 1
+                return default
+            self._stats['hits'] += 1
+        payload, buffers, _, expires = row
+        return _unpack(payload, buffers), tags, expires
+
+    def set(self, key, value, ttl=None, tags=(), generation=None):
+        """
+        Stores value under key for ttl seconds, tagged with tags. With
+        generation (from generation(tags)), the value is refused if one of
+        its tags was invalidated since, by any process. Returns False if
+        the value was not stored (too large or stale).
+        """
+        tags = tuple(tags)
+        payload, buffers = _pack(value)
+        if len(payload) + len(buffers or b'') > self.max_value_bytes:
+            with self._lock:
+                self._stats['rejected'] += 1
+            return False
+        blob = _key(key)
+        ttl = self.ttl if ttl is None else ttl
+        now = time.time()
+        with self._lock:
+            self._check_fork()
+            if self._owed:
+                self._invalidate(set())
+                if self._owed.intersection(tags):
+                    self._stats['rejected'] += 1
+                    return False
+            conn = self._conn
+            # Take the write lock first, so no invalidation can slip in
+            # between the generation check and the insert
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                if generation is not None and tuple(generation) != self._generation(tags):
+                    conn.execute("ROLLBACK")
+                    self._stats['rejected'] += 1
+                    return False
+                conn.execute("DELETE FROM entry_tags WHERE key = ?", (blob,))
+                conn.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                             (blob, payload, buffers, '\x1f'.join(tags),
+                              None if ttl is None else now + ttl, now))
+                conn.executemany("INSERT INTO entry_tags (tag, key) VALUES (?, ?)",
+                                 [(tag, blob) for tag in set(tags)])
+                self._sets += 1
+                if self._sets % self.TRIM_EVERY == 0:
+                    self._trim(now)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._stats['stores'] += 1
+            return True
+
+    def _trim(self, now):
+        """Drops expired entries, then the oldest ones past max_entries (in a transaction)"""
+        conn = self._conn
+        conn.execute("DELETE FROM entry_tags WHERE key IN "
+                     "(SELECT key FROM entries WHERE expires <= ?)", (now,))
+        conn.execute("DELETE FROM entries WHERE expires <= ?", (now,))
+        excess = conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0] - self.max_entries
+        if excess > 0:
+            oldest = "SELECT key FROM entries ORDER BY stored LIMIT ?"
+            conn.execute(f"DELETE FROM entry_tags WHERE key IN ({oldest})", (excess,))
+            conn.execute(f"DELETE FROM entries WHERE key IN ({oldest})", (excess,))
+
+    def _bump(self, conn):
+        """Increments the shared version (in a transaction) and publishes it"""
+        conn.execute("UPDATE counters SET value = value + 1 WHERE name = 'version'")
+        return self._counter_value('version')
+
+    def _publish(self, version):
+        _COUNTER.pack_into(self._counter, 0, version)
+
+    def invalidate_tags(self, tags):
+        """
+        Drops every entry tagged with one of tags, in every process, and
+        refuses values computed before now for them. Returns how many
+        entries were dropped.
+        """
+        with self._lock:
+            self._check_fork()
+            return self._invalidate(set(tags))
+
+    def _invalidate(self, tags):
+        """invalidate_tags(), plus the failed invalidations, under _lock"""
+        tags |= self._owed
+        if not tags:
+            return 0
+        conn = self._conn
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._bump(conn)
+                dropped = 0
+                for tag in tags:
+                    conn.execute(
+                        "INSERT INTO tag_generations (tag, generation, changed) VALUES (?, 1, ?) "
+                        "ON CONFLICT (tag) DO UPDATE SET generation = generation + 1, "
+                        "changed = excluded.changed", (tag, version))
+                    keys = [key for key, in conn.execute(
+                        "SELECT key FROM entry_tags WHERE tag = ?", (tag,))]
+                    for key in keys:
+                        conn.execute("DELETE FROM entry_tags WHERE key = ?", (key,))
+                        dropped += conn.execute("DELETE FROM entries WHERE key = ?",
+                                                (key,)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except sqlite3.Error as error:
+            self._owed = tags
+            logger.warning("Invalidation of %s in the shared cache failed, will retry: %s",
+                           ', '.join(sorted(tags)), error)
+            return 0
+        self._owed = set()
+        self._publish(version)
+        self._stats['invalidations'] += dropped
+        return dropped
+
+    def invalidated_since(self, version):
+        """
+        Tells what was invalidated after version: (cleared, tags), cleared
+        being whether the whole cache was cleared since.
+        """
+        with self._lock:
+            self._check_fork()
+            conn = self._conn
+            cleared = self._counter_value('cleared') > version
+            tags = [tag for tag, in conn.execute(
+                "SELECT tag FROM tag_generations WHERE changed > ?", (version,))]
+            return cleared, tags
+
+    def delete(self, key):
+        """Removes key from the cache; returns whether it was stored."""
+        blob = _key(key)
+        with self._lock:
+            self._check_fork()
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM entry_tags WHERE key = ?", (blob,))
+                deleted = conn.execute("DELETE FROM entries WHERE key = ?", (blob,)).rowcount
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return deleted > 0
+
+    def clear(self):
+        """Empties the cache for every process (counters are kept)."""
+        with self._lock:
+            self._check_fork()
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                version = self._bump(conn)
+                conn.execute("UPDATE counters SET value = ? WHERE name = 'cleared'", (version,))
+                conn.execute("DELETE FROM entry_tags")
+                conn.execute("DELETE FROM entries")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            self._publish(version)
+
+    def stats(self):
+        """Returns this process's hit/miss counters and the number of stored entries."""
+        with self._lock:
+            self._check_fork()
+            entries = self._conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+            stats = dict(self._stats, entries=entries)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+            self._counter.close()
+
+
+class TieredCache:
+    """
+    In-process cache (a QueryCache) in front of a SharedCache.
+
+    Lookups try the in-process cache first, then the shared one; a value
+    found there is copied into the in-process cache. Values are stored in
+    both. Invalidations go to both, and invalidations made by other
+    processes are applied to the in-process cache before every lookup, by
+    checking the shared version counter. Used by cache_query like a
+    QueryCache.
+
+    The shared tier is only an optimization: if its file cannot be read
+    or written (sqlite3.Error, e.g. locked past its timeout), the error
+    is logged and the in-process tier is used alone for that call.
+
+    Args:
+        local: The in-process QueryCache
+        shared: The SharedCache
+    """
+
+    def __init__(self, local, shared):
+        self.local = local
+        self.shared = shared
+        self._lock = threading.Lock()
+        self._version = shared.version()
+        self._pid = os.getpid()
+
+    def _sync(self):
+        """Applies the invalidations made by other processes since the last check"""
+        version = self.shared.version()
+        if version == self._version and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                # A forked child shares nothing with its parent's cache
+                self._pid = os.getpid()
+                self.local.clear()
+            seen = self._version
+            version = self.shared.version()
+            if version == seen:
+                return
+            try:
+                cleared, tags = self.shared.invalidated_since(seen)
+            except sqlite3.Error as error:
+                logger.warning("Shared cache unavailable, dropping the local tier: %s", error)
+                # What was invalidated is unknown: keep nothing that could be stale
+                cleared, tags = True, ()
+            if cleared:
+                self.local.clear()
+            elif tags:
+                self.local.invalidate_tags(tags)
+            self._version = max(self._version, version)
+
+    def get(self, key, default=MISSING):
+        """Returns the cached value of key, or default if neither tier has it."""
+        self._sync()
+        value = self.local.get(key)
+        if value is not MISSING:
+            return value
+        version = self.shared.version()
+        try:
+            found = self.shared.get(key)
+        except sqlite3.Error as error:
+            logger.warning("Shared cache lookup failed: %s", error)
+            return default
+        if found is MISSING:
+            return default
+        value, tags, expires = found
+        ttl = None if expires is None else max(expires - time.time(), 0.0)
+        self.local.set(key, value, ttl=ttl, tags=tags)
+        if self.shared.version() != version:
+            # Something was invalidated meanwhile, perhaps this value
+            self.local.delete(key)
+        return value
+
+    def peek(self, key, default=MISSING):
+        """
+        Returns the value of key in the in-process tier without counting
+        a hit or a miss (see QueryCache.peek()).
+        """
+        self._sync()
+        return self.local.peek(key, default)
+
+    def generation(self, tags=()):
+        """
+        Snapshot of the generation of tags in both tiers, for set(). The
+        shared part is None if the shared tier could not be read, and the
+        value is then only stored in the in-process tier.
+        """
+        self._sync()
+        tags = tuple(tags)
+        try:
+            shared = self.shared.generation(tags)
+        except sqlite3.Error as error:
+            logger.warning("Shared cache generation lookup failed: %s", error)
+            shared = None
+        return self.local.generation(tags), shared
+
+    def set(self, key, value, ttl=None, tags=(), generation=None):
+        """
+        Caches value in both tiers. With generation (from generation(tags)),
+        each tier refuses it if its tags were invalidated since. Returns
+        whether the in-process tier kept it.
+        """
+        self._sync()
+        local, shared = (None, None) if generation is None else generation
+        stored = self.local.set(key, value, ttl=ttl, tags=tags, generation=local)
+        if generation is None or shared is not None:
+            try:
+                self.shared.set(key, value, ttl=ttl, tags=tags, generation=shared)
+            except sqlite3.Error as error:
+                logger.warning("Shared cache store failed: %s", error)
+        return stored
+
+    def invalidate_tags(self, tags):
+        """Drops the entries tagged with one of tags in both tiers, and in other processes."""
+        tags = set(tags)
+        with self._lock:
+            seen = self.shared.version()
+            dropped = self.local.invalidate_tags(tags)
+            self.shared.invalidate_tags(tags)
+            if self._version == seen and self.shared.version() == seen + 1:
+                # Only this invalidation happened: nothing to apply from it
+                self._version = seen + 1
+        return dropped
+
+    def delete(self, key):
+        deleted = self.local.delete(key)
+        return self.shared.delete(key) or deleted
+
+    def clear(self):
+        self.local.clear()
+        self.shared.clear()
+
+    def stats(self):
+        """Returns the counters of both tiers."""
+        return {'local': self.local.stats(), 'shared': self.shared.stats()}
+
+    def __len__(self):
+        return len(self.local)
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""test cases for the cache_engine module"""
+
+import threading
+import time
+import unittest
+
+from cache_engine import MISSING, QueryCache, SingleFlight
+
+
+class FakeClock:
+    """Clock advanced by hand"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestLRU(unittest.TestCase):
+    """Test cases for the entry limit of QueryCache"""
+
+    def test_least_recently_used_evicted(self):
+        """Past max_entries the least recently used entry goes"""
+        cache = QueryCache(max_entries=3, stripes=1)
+        for key in 'abc':
+            cache.set(key, key.upper())
+        cache.get('a')
+        cache.set('d', 'D')
+        self.assertNotIn('b', cache)
+        self.assertEqual([cache.get(key) for key in 'acd'], ['A', 'C', 'D'])
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+    def test_overwrite(self):
+        """Setting a key again replaces its value without growing the cache"""
+        cache = QueryCache(max_entries=2, stripes=1)
+        cache.set('a', 1)
+        cache.set('a', 2)
+        self.assertEqual((cache['a'], len(cache)), (2, 1))
+
+    def test_stripes_share_the_limit(self):
+        """The entry limit holds across stripes"""
+        cache = QueryCache(max_entries=64, stripes=8)
+        for key in range(1000):
+            cache.set(key, key)
+        self.assertLessEqual(len(cache), 64)
+
+    def test_none_is_cached(self):
+        """None is a value; misses return MISSING"""
+        cache = QueryCache()
+        cache.set('a', None)
+        self.assertIsNone(cache.get('a'))
+        self.assertIs(cache.get('b'), MISSING)
+        self.assertEqual(cache.get('b', 'default'), 'default')
+
+    def test_peek(self):
+        """peek() finds values without counting hits or misses or reordering"""
+        cache = QueryCache(max_entries=2, stripes=1)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.peek('a'), 1)
+        self.assertIs(cache.peek('c'), MISSING)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (0, 0))
+        cache.set('c', 3)
+        self.assertNotIn('a', cache)
+
+    def test_mapping_interface(self):
+        """Item access raises KeyError on a miss"""
+        cache = QueryCache()
+        cache['a'] = 1
+        del cache['a']
+        with self.assertRaises(KeyError):
+            cache['a']
+        with self.assertRaises(KeyError):
+            del cache['a']
+
+    def test_invalid_limits(self):
+        """Limits must be positive"""
+        with self.assertRaises(ValueError):
+            QueryCache(max_entries=0)
+
+
+class TestTTL(unittest.TestCase):
+    """Test cases for the expiry of QueryCache entries"""
+
+    def setUp(self):
+        """Creates a cache with a 10 second TTL and a fake clock"""
+        self.clock = FakeClock()
+        self.cache = QueryCache(ttl=10, clock=self.clock)
+
+    def test_expiry(self):
+        """An entry is returned until its TTL elapses"""
+        self.cache.set('a', 1)
+        self.clock.now = 9.9
+        self.assertEqual(self.cache.get('a'), 1)
+        self.clock.now = 10
+        self.assertIs(self.cache.get('a'), MISSING)
+        self.assertEqual(len(self.cache), 0)
+        self.assertEqual(self.cache.stats()['expirations'], 1)
+
+    def test_own_ttl(self):
+        """set() can override the default TTL; a None default never expires"""
+        self.cache.set('short', 1, ttl=1)
+        self.cache.set('default', 2, ttl=None)
+        self.clock.now = 5
+        self.assertIs(self.cache.get('short'), MISSING)
+        self.assertEqual(self.cache.get('default'), 2)
+        self.cache.ttl = None
+        self.cache.set('forever', 3)
+        self.clock.now = 1000
+        self.assertIs(self.cache.get('default'), MISSING)
+        self.assertEqual(self.cache.get('forever'), 3)
+
+    def test_purge_expired(self):
+        """purge_expired() drops the expired entries only"""
+        self.cache.set('a', 1)
+        self.clock.now = 5
+        self.cache.set('b', 2)
+        self.clock.now = 12
+        self.assertEqual(self.cache.purge_expired(), 1)
+        self.assertEqual(self.cache.get('b'), 2)
+
+
+class TestBytes(unittest.TestCase):
+    """Test cases for the byte limit of QueryCache"""
+
+    def setUp(self):
+        """Creates a cache of 100 bytes sizing values by their length"""
+        self.cache = QueryCache(max_bytes=100, stripes=4, sizeof=len)
+
+    def test_total_limit(self):
+        """The byte limit applies to the whole cache, not each stripe"""
+        for key in range(20):
+            self.cache.set(key, 'x' * 30)
+            self.assertLessEqual(self.cache.stats()['bytes'], 100)
+        self.assertEqual(len(self.cache), 3)
+        self.assertIn(19, self.cache)
+
+    def test_oversized_rejected(self):
+        """A value larger than the whole cache is not cached"""
+        self.cache.set('small', 'x')
+        self.assertFalse(self.cache.set('big', 'x' * 101))
+        self.assertNotIn('big', self.cache)
+        self.assertIn('small', self.cache)
+        self.assertEqual(self.cache.stats()['rejected'], 1)
+
+    def test_clear(self):
+        """clear() empties the cache and its byte count"""
+        self.cache.set('a', 'x' * 50)
+        self.cache.clear()
+        self.assertEqual((len(self.cache), self.cache.stats()['bytes']), (0, 0))
+        self.assertTrue(self.cache.set('b', 'x' * 100))
+
+    def test_concurrent_sets(self):
+        """The limit holds with threads setting different keys"""
+        def fill(start):
+            for key in range(start, start + 500):
+                self.cache.set(key, 'x' * 10)
+
+        threads = [threading.Thread(target=fill, args=(i * 1000,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = self.cache.stats()
+        self.assertLessEqual(stats['bytes'], 100)
+        self.assertEqual(stats['bytes'], 10 * len(self.cache))
+
+
+
+class TestSingleFlight(unittest.TestCase):
+    """Test cases for SingleFlight"""
+
+    def setUp(self):
+        """Creates a SingleFlight and a computation blocked until released"""
+        self.flights = SingleFlight(timeout=5)
+        self.release = threading.Event()
+        self.calls = 0
+
+    def compute(self):
+        """Counts the call and waits to be released"""
+        self.calls += 1
+        self.release.wait(5)
+        return ['rows']
+
+    def start(self, count, results, func=None):
+        """Starts count threads calling do('key') and returns them"""
+        def call():
+            try:
+                results.append(self.flights.do('key', func or self.compute))
+            except Exception as error:
+                results.append(error)
+
+        threads = [threading.Thread(target=call) for _ in range(count)]
+        threads[0].start()
+        while self.flights.in_flight() == 0:
+            time.sleep(0.001)
+        for thread in threads[1:]:
+            thread.start()
+        return threads
+
+    def wait_coalesced(self, count):
+        """Waits until count callers wait for the call in flight"""
+        while self.flights.stats()['coalesced'] < count:
+            time.sleep(0.001)
+
+    def test_coalescing(self):
+        """Concurrent callers share one computation and its result"""
+        results = []
+        threads = self.start(8, results)
+        self.wait_coalesced(7)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 7)
+        self.assertTrue(all(result is results[0][0] for result, _ in results))
+        self.assertEqual(self.flights.stats(),
+                         {'leaders': 1, 'coalesced': 7, 'timeouts': 0, 'in_flight': 0})
+
+    def test_error_shared(self):
+        """Waiting callers get the exception of the computation"""
+        def fail():
+            self.release.wait(5)
+            raise ValueError("query failed")
+
+        results = []
+        threads = self.start(3, results, fail)
+        self.wait_coalesced(2)
+        self.release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([type(result) for result in results], [ValueError] * 3)
+
+    def test_timeout(self):
+        """A caller stops waiting after the timeout"""
+        results = []
+        threads = self.start(1, results)
+        with self.assertRaises(TimeoutError):
+            self.flights.do('key', self.compute, timeout=0.01)
+        self.release.set()
+        threads[0].join()
+        self.assertEqual(self.flights.stats()['timeouts'], 1)
+
+    def test_sequential_calls(self):
+        """Once a computation is over the next caller runs a new one"""
+        self.release.set()
+        self.assertEqual(self.flights.do('key', self.compute), (['rows'], False))
+        self.assertEqual(self.flights.do('key', self.compute), (['rows'], False))
+        self.assertEqual(self.calls, 2)
+
+    def test_reentrant(self):
+        """A computation needing its own key runs it instead of waiting"""
+        self.release.set()
+        result, _ = self.flights.do('key', lambda: self.flights.do('key', self.compute))
+        self.assertEqual(result, (['rows'], False))
+        self.assertEqual(self.flights.in_flight(), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""test cases for the cache_invalidation module and cache tags"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from cache_engine import MISSING, QueryCache
+from cache_invalidation import (SHARED_CACHE_ENV, cache_key, flush_writes, invalidate_tables,
+                                is_read_only, normalize_sql, register_cache, tables_read,
+                                tables_written, track_writes, unregister_cache)
+
+
+class TestParsing(unittest.TestCase):
+    """Test cases for the SQL helpers"""
+
+    def test_normalize_sql(self):
+        """Spacing, case and a trailing semicolon do not matter, strings do"""
+        self.assertEqual(normalize_sql("SELECT *\n  FROM Users WHERE name = 'Bob' ;"),
+                         "select * from users where name = 'Bob'")
+        self.assertNotEqual(normalize_sql("SELECT 'A'"), normalize_sql("SELECT 'a'"))
+
+    def test_literals_untouched(self):
+        """Spaces and punctuation inside literals are part of the key"""
+        self.assertNotEqual(normalize_sql("SELECT * FROM users WHERE name = 'a ,b'"),
+                            normalize_sql("SELECT * FROM users WHERE name = 'a,b'"))
+        self.assertNotEqual(normalize_sql("SELECT '( x'"), normalize_sql("SELECT '(x'"))
+        self.assertEqual(normalize_sql("SELECT f( 'x' ) , 1 ;"), "select f('x'), 1")
+
+    def test_cache_key(self):
+        """Equivalent queries share a key, different params do not"""
+        self.assertEqual(cache_key("select * from users", [1]),
+                         cache_key("SELECT *  FROM users;", (1,)))
+        self.assertEqual(cache_key("select :a, :b", {'b': 2, 'a': 1}),
+                         cache_key("select :a, :b", {'a': 1, 'b': 2}))
+        self.assertNotEqual(cache_key("select ?", (1,)), cache_key("select ?", (2,)))
+
+    def test_tables_read(self):
+        """FROM lists, joins and subqueries are found; literals are skipped"""
+        self.assertEqual(tables_read("SELECT * FROM users u, orders o WHERE u.id = o.user_id"),
+                         {'users', 'orders'})
+        self.assertEqual(tables_read("SELECT * FROM users JOIN orders ON 1 LEFT JOIN items"),
+                         {'users', 'orders', 'items'})
+        self.assertEqual(tables_read("SELECT * FROM (SELECT id FROM Users) WHERE id IN "
+                                     "(SELECT user_id FROM orders)"), {'users', 'orders'})
+        self.assertEqual(tables_read("SELECT * FROM users WHERE name = 'from logs'"),
+                         {'users'})
+
+    def test_schema_qualified(self):
+        """A schema-qualified table matches the tag of its plain name"""
+        self.assertEqual(tables_read("SELECT * FROM main.users"), {'users'})
+        self.assertEqual(tables_read('SELECT * FROM "main"."Users" JOIN main.orders ON 1'),
+                         {'users', 'orders'})
+        self.assertEqual(tables_written("UPDATE main.users SET name = 'x'"), 'users')
+        self.assertEqual(tables_written('DELETE FROM "main"."users"'), 'users')
+
+    def test_tables_written(self):
+        """The written table of each kind of write statement"""
+        self.assertEqual(tables_written("INSERT OR REPLACE INTO Users VALUES (1)"), 'users')
+        self.assertEqual(tables_written("update users set name = 'x'"), 'users')
+        self.assertEqual(tables_written("DELETE FROM \"users\""), 'users')
+        self.assertEqual(tables_written("WITH t AS (SELECT 1) DELETE FROM users"), 'users')
+        self.assertIsNone(tables_written("SELECT * FROM users"))
+
+    def test_is_read_only(self):
+        """Only SELECT statements are cached"""
+        self.assertTrue(is_read_only("  select 1"))
+        self.assertTrue(is_read_only("WITH t AS (SELECT 1) SELECT * FROM t"))
+        self.assertFalse(is_read_only("WITH t AS (SELECT 1) UPDATE users SET id = 1"))
+        self.assertFalse(is_read_only("PRAGMA table_info(users)"))
+
+
+class TestTags(unittest.TestCase):
+    """Test cases for the tags of QueryCache"""
+
+    def setUp(self):
+        """Creates a cache with entries tagged by table"""
+        self.cache = QueryCache()
+        self.cache.set('users', 1, tags=['users'])
+        self.cache.set('orders', 2, tags=['orders'])
+        self.cache.set('both', 3, tags=['users', 'orders'])
+
+    def test_invalidate(self):
+        """Entries with one of the tags are dropped, the others kept"""
+        self.assertEqual(self.cache.invalidate_tags(['users']), 2)
+        self.assertIs(self.cache.get('users'), MISSING)
+        self.assertIs(self.cache.get('both'), MISSING)
+        self.assertEqual(self.cache.get('orders'), 2)
+        self.assertEqual(self.cache.invalidate_tags(['users']), 0)
+
+    def test_stale_value_refused(self):
+        """A value computed before an invalidation of its tags is refused"""
+        generation = self.cache.generation(['users'])
+        self.cache.invalidate_tags(['users'])
+        self.assertFalse(self.cache.set('users', 4, tags=['users'], generation=generation))
+        self.assertIs(self.cache.get('users'), MISSING)
+
+    def test_other_tags_accepted(self):
+        """Invalidating other tags does not refuse the value"""
+        generation = self.cache.generation(['users'])
+        self.cache.invalidate_tags(['orders'])
+        self.assertTrue(self.cache.set('users', 4, tags=['users'], generation=generation))
+
+    def test_clear_refuses(self):
+        """A value computed before clear() is refused"""
+        generation = self.cache.generation(['users'])
+        self.cache.clear()
+        self.assertFalse(self.cache.set('users', 4, tags=['users'], generation=generation))
+
+
+class TestTrackWrites(unittest.TestCase):
+    """Test cases for track_writes"""
+
+    def setUp(self):
+        """Creates a database and a registered cache holding a read of users"""
+        environ = patch.dict(os.environ)
+        environ.start()
+        self.addCleanup(environ.stop)
+        os.environ.pop(SHARED_CACHE_ENV, None)
+
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.conn = sqlite3.connect(self.path)
+        self.conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        self.conn.execute("CREATE TABLE orders (id INTEGER PRIMARY KEY)")
+        self.conn.commit()
+        self.cache = register_cache(QueryCache())
+        self.cache.set('users', [], tags=['users'])
+
+    def tearDown(self):
+        """Unregisters the cache and removes the database"""
+        unregister_cache(self.cache)
+        self.conn.close()
+        os.remove(self.path)
+
+    def cached(self):
+        """Tells whether the read of users is still cached"""
+        return self.cache.get('users') is not MISSING
+
+    def test_commit(self):
+        """A committed write invalidates the tables it wrote"""
+        with track_writes(self.conn):
+            self.conn.execute("INSERT INTO users (name) VALUES ('a')")
+            self.conn.commit()
+        self.assertFalse(self.cached())
+
+    def test_after_commit_returns(self):
+        """Generations change once the commit is over, not when it starts"""
+        generation = self.cache.generation(['users'])
+        with track_writes(self.conn):
+            self.conn.execute("INSERT INTO users (name) VALUES ('a')")
+            self.assertEqual(self.cache.generation(['users']), generation)
+            self.conn.commit()
+            self.assertEqual(self.cache.generation(['users']), generation)
+            flush_writes(self.conn)
+            self.assertNotEqual(self.cache.generation(['users']), generation)
+            self.assertFalse(self.cached())
+
+    def test_rollback(self):
+        """Rolled back and uncommitted writes invalidate nothing"""
+        with track_writes(self.conn):
+            self.conn.execute("INSERT INTO users (name) VALUES ('a')")
+            self.conn.rollback()
+            self.conn.execute("INSERT INTO users (name) VALUES ('b')")
+        self.conn.rollback()
+        self.assertTrue(self.cached())
+
+    def test_schema_qualified_write(self):
+        """A write to main.users invalidates a read of main.users"""
+        self.cache.set('main', [], tags=sorted(tables_read("SELECT * FROM main.users")))
+        with track_writes(self.conn):
+            self.conn.execute("UPDATE main.users SET name = 'x'")
+            self.conn.commit()
+        self.assertIs(self.cache.get('main'), MISSING)
+        self.assertFalse(self.cached())
+
+    def test_other_table(self):
+        """Writes to other tables leave the entry alone"""
+        with track_writes(self.conn):
+            self.conn.execute("INSERT INTO orders DEFAULT VALUES")
+            self.conn.commit()
+        self.assertTrue(self.cached())
+
+    def test_autocommit(self):
+        """Writes in autocommit mode are committed as they run"""
+        conn = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(conn.close)
+        with track_writes(conn):
+            conn.execute("DELETE FROM users")
+        self.assertFalse(self.cached())
+
+    def test_nested(self):
+        """Nested blocks share a tracker; the trace callback is removed at the end"""
+        with track_writes(self.conn):
+            with track_writes(self.conn):
+                self.conn.execute("UPDATE users SET name = 'x'")
+            self.conn.commit()
+            self.assertTrue(self.cached())
+        self.assertFalse(self.cached())
+        self.cache.set('users', [], tags=['users'])
+        self.conn.execute("DELETE FROM users")
+        self.conn.commit()
+        self.assertTrue(self.cached())
+
+    def test_invalidate_tables(self):
+        """Table names are matched case-insensitively"""
+        self.assertEqual(invalidate_tables(['"Users"']), 1)
+        self.assertFalse(self.cached())
+
+
+if __name__ == "__main__":
+    unittest.main()
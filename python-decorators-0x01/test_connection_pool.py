@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""test cases for the connection_pool module"""
+
+import gc
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+
+from connection_pool import ConnectionPool, sqlite_factory
+
+
+class PoolTestCase(unittest.TestCase):
+    """Creates a SQLite database and a pool over it for each test"""
+
+    def setUp(self):
+        """Creates the database file"""
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        conn = sqlite3.connect(self.path)
+        conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY, name TEXT)")
+        conn.commit()
+        conn.close()
+        self.pools = []
+
+    def tearDown(self):
+        """Closes the pools and removes the database"""
+        for pool in self.pools:
+            pool.close()
+        os.remove(self.path)
+
+    def pool(self, **options):
+        """Returns a new pool over the test database"""
+        pool = ConnectionPool(sqlite_factory(self.path), **options)
+        self.pools.append(pool)
+        return pool
+
+
+class TestCheckout(PoolTestCase):
+    """Test cases for acquire() and release() in checkout mode"""
+
+    def test_reuse(self):
+        """A released connection is handed out again, not reopened"""
+        pool = self.pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        status = pool.status()
+        self.assertEqual((status['created'], status['reused'], status['in_use']), (1, 1, 1))
+
+    def test_distinct_connections(self):
+        """Connections out at the same time are distinct"""
+        pool = self.pool(max_size=2)
+        first, second = pool.acquire(), pool.acquire()
+        self.assertIsNot(first, second)
+        self.assertEqual(pool.status()['size'], 2)
+
+    def test_timeout(self):
+        """acquire() gives up once every connection stays out"""
+        pool = self.pool(max_size=1)
+        pool.acquire()
+        with self.assertRaises(TimeoutError):
+            pool.acquire(timeout=0.05)
+        self.assertEqual(pool.status()['waits'], 1)
+
+    def test_wait_for_release(self):
+        """A waiting caller gets the connection released by another thread"""
+        pool = self.pool(max_size=1)
+        conn = pool.acquire()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.acquire(timeout=5)))
+        waiter.start()
+        pool.release(conn)
+        waiter.join()
+        self.assertEqual(got, [conn])
+
+    def test_rollback_on_release(self):
+        """Uncommitted work is rolled back when the connection comes back"""
+        pool = self.pool()
+        with pool.connection() as conn:
+            conn.execute("INSERT INTO users (name) VALUES ('ghost')")
+        with pool.connection() as conn:
+            self.assertEqual(conn.execute("SELECT COUNT(*) FROM users").fetchone()[0], 0)
+
+    def test_release_twice(self):
+        """Releasing a connection twice or a foreign one is ignored"""
+        pool = self.pool()
+        conn = pool.acquire()
+        pool.release(conn)
+        pool.release(conn)
+        pool.release(sqlite3.connect(':memory:'))
+        self.assertEqual(pool.status()['idle'], 1)
+
+    def test_broken_connection_replaced(self):
+        """A connection failing its health check is replaced"""
+        pool = self.pool(check_after=0)
+        conn = pool.acquire()
+        pool.release(conn)
+        conn.close()
+        replacement = pool.acquire()
+        self.assertIsNot(replacement, conn)
+        self.assertEqual(pool.status()['failed_checks'], 1)
+
+    def test_discard(self):
+        """A discarded connection is closed and frees its slot"""
+        pool = self.pool(max_size=1)
+        conn = pool.acquire()
+        pool.release(conn, discard=True)
+        self.assertEqual(pool.status()['size'], 0)
+        self.assertIsNot(pool.acquire(timeout=0), conn)
+
+    def test_idle_timeout(self):
+        """Connections idle for too long are closed"""
+        pool = self.pool(idle_timeout=0)
+        pool.release(pool.acquire())
+        pool.acquire()
+        self.assertEqual(pool.status()['evicted'], 1)
+
+    def test_closed(self):
+        """A closed pool hands out no connection"""
+        pool = self.pool()
+        pool.close()
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
+
+
+class TestPerThread(PoolTestCase):
+    """Test cases for per_thread mode"""
+
+    def test_pinned(self):
+        """A thread keeps its connection, other threads get their own"""
+        pool = self.pool(per_thread=True)
+        conn = pool.acquire()
+        pool.release(conn)
+        self.assertIs(pool.acquire(), conn)
+        other = []
+        thread = threading.Thread(target=lambda: other.append(pool.acquire()))
+        thread.start()
+        thread.join()
+        self.assertIsNot(other[0], conn)
+
+    def test_returned_when_thread_ends(self):
+        """The connection of a finished thread goes back to the pool"""
+        pool = self.pool(per_thread=True, max_size=1)
+        thread = threading.Thread(target=pool.acquire)
+        thread.start()
+        thread.join()
+        gc.collect()
+        self.assertEqual(pool.status()['idle'], 1)
+        pool.acquire(timeout=0)
+
+
+@unittest.skipUnless(hasattr(os, 'fork'), "needs os.fork")
+class TestFork(PoolTestCase):
+    """Test cases for a pool used across os.fork()"""
+
+    def test_child_starts_empty(self):
+        """A forked child opens its own connections and counts its own stats"""
+        pool = self.pool()
+        conn = pool.acquire()
+        pool.release(pool.acquire())
+        read, write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            try:
+                status = pool.status()
+                child = pool.acquire()
+                report = {'status': status, 'same': child is conn,
+                          'rows': child.execute("SELECT COUNT(*) FROM users").fetchone()[0]}
+                os.write(write, json.dumps(report).encode())
+            finally:
+                os._exit(0)
+        os.close(write)
+        with os.fdopen(read) as pipe:
+            report = json.loads(pipe.read())
+        os.waitpid(pid, 0)
+
+        self.assertEqual(report['status']['size'], 0)
+        self.assertEqual(report['status']['created'], 0)
+        self.assertFalse(report['same'])
+        self.assertEqual(report['rows'], 0)
+        # The parent's pool is untouched
+        self.assertEqual(pool.status()['created'], 2)
+        pool.release(conn)
+        self.assertEqual(pool.status()['idle'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
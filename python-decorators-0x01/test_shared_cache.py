@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""test cases for the shared_cache module"""
+
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from cache_engine import MISSING, QueryCache
+from cache_invalidation import SHARED_CACHE_ENV, cache_key
+from shared_cache import SharedCache, TieredCache
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run(code, **env):
+    """Runs code in a new Python process started in this directory"""
+    subprocess.run([sys.executable, '-c', code], cwd=HERE, check=True,
+                   env=dict(os.environ, **env))
+
+
+class SharedCacheTestCase(unittest.TestCase):
+    """Creates the file of a shared cache for each test"""
+
+    def setUp(self):
+        """Creates a temporary directory for the cache file"""
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'qc.db')
+        self.caches = []
+
+    def tearDown(self):
+        """Closes the caches and removes their files"""
+        for cache in self.caches:
+            cache.close()
+        shutil.rmtree(self.directory)
+
+    def shared(self, **options):
+        """Returns a SharedCache over the test file"""
+        cache = SharedCache(self.path, **options)
+        self.caches.append(cache)
+        return cache
+
+
+class TestSharedCache(SharedCacheTestCase):
+    """Test cases for SharedCache"""
+
+    def test_round_trip(self):
+        """A value comes back with its tags"""
+        cache = self.shared()
+        cache.set(('select', (1,)), [(1, 'Alice')], tags=['users'])
+        value, tags, _ = cache.get(('select', (1,)))
+        self.assertEqual((value, tags), ([(1, 'Alice')], ('users',)))
+        self.assertIs(cache.get(('select', (2,))), MISSING)
+
+    def test_canonical_keys(self):
+        """Equal keys find the same entry however their strings were built"""
+        cache = self.shared()
+        name = ''.join(['ali', 'ce'])
+        # The same string twice pickles differently from two equal strings
+        cache.set(cache_key("select ?, ?", [name, name]), 1)
+        key = cache_key("select ?, ?", ['alice', ''.join(['al', 'ice'])])
+        self.assertEqual(cache.get(key)[0], 1)
+
+    def test_expiry(self):
+        """Expired entries are not returned"""
+        cache = self.shared()
+        cache.set('key', 1, ttl=0)
+        self.assertIs(cache.get('key'), MISSING)
+
+    def test_stale_value_refused(self):
+        """A value computed before an invalidation of its tags is refused"""
+        cache = self.shared()
+        generation = cache.generation(['users'])
+        self.shared().invalidate_tags(['users'])
+        self.assertFalse(cache.set('key', 1, tags=['users'], generation=generation))
+        self.assertTrue(cache.set('key', 1, tags=['users'],
+                                  generation=cache.generation(['users'])))
+
+    def test_too_large(self):
+        """Values over max_value_bytes are not stored"""
+        cache = self.shared(max_value_bytes=100)
+        self.assertFalse(cache.set('key', 'x' * 1000))
+        self.assertEqual(cache.stats()['rejected'], 1)
+
+    def test_invalidation_retried(self):
+        """An invalidation blocked by a lock is retried; its tags are not served meanwhile"""
+        cache = self.shared(timeout=0.05)
+        cache.set('key', 1, tags=['users'])
+        locker = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(locker.close)
+        locker.execute("BEGIN EXCLUSIVE")
+        with self.assertLogs('shared_cache', 'WARNING'):
+            self.assertEqual(cache.invalidate_tags(['users']), 0)
+        locker.execute("ROLLBACK")
+
+        self.assertIs(cache.get('key'), MISSING)
+        self.assertTrue(cache.set('other', 2, tags=['users']))
+        self.assertEqual(cache.stats()['invalidations'], 1)
+        self.assertIs(self.shared().get('key'), MISSING)
+
+
+class TestTieredCache(SharedCacheTestCase):
+    """Test cases for TieredCache"""
+
+    def tiered(self, **options):
+        """Returns a TieredCache over a new QueryCache and SharedCache"""
+        return TieredCache(QueryCache(), self.shared(**options))
+
+    def test_promotion(self):
+        """A value stored by another process is found and copied locally"""
+        run(f"from shared_cache import SharedCache\n"
+            f"SharedCache({self.path!r}).set('key', [1, 2], tags=['users'])")
+        cache = self.tiered()
+        self.assertEqual(cache.get('key'), [1, 2])
+        self.assertEqual(cache.local.get('key'), [1, 2])
+
+    def test_invalidation_across_processes(self):
+        """An invalidation in another process reaches the local tier"""
+        cache = self.tiered()
+        cache.set('key', 1, tags=['users'])
+        cache.set('other', 2, tags=['orders'])
+        run(f"from shared_cache import SharedCache\n"
+            f"SharedCache({self.path!r}).invalidate_tags(['users'])")
+        self.assertIs(cache.get('key'), MISSING)
+        self.assertEqual(cache.get('other'), 2)
+
+    def test_writer_process(self):
+        """A process that only writes through track_writes invalidates the shared tier"""
+        cache = self.tiered()
+        cache.set('key', 1, tags=['users'])
+        database = os.path.join(self.directory, 'users.db')
+        run(f"import sqlite3\n"
+            f"from cache_invalidation import track_writes\n"
+            f"conn = sqlite3.connect({database!r})\n"
+            f"with track_writes(conn):\n"
+            f"    conn.execute('CREATE TABLE users (id INTEGER)')\n"
+            f"    conn.execute('INSERT INTO users VALUES (1)')\n"
+            f"    conn.commit()\n", **{SHARED_CACHE_ENV: self.path})
+        self.assertIs(cache.get('key'), MISSING)
+        self.assertIs(cache.shared.get('key'), MISSING)
+
+    def test_own_invalidation(self):
+        """An invalidation made here drops the entries of both tiers"""
+        cache = self.tiered()
+        cache.set('key', 1, tags=['users'])
+        self.assertEqual(cache.invalidate_tags(['users']), 1)
+        self.assertIs(cache.get('key'), MISSING)
+        self.assertIs(cache.shared.get('key'), MISSING)
+
+    def test_locked_file(self):
+        """With the shared file locked, values are still cached locally"""
+        cache = self.tiered(timeout=0.05)
+        locker = sqlite3.connect(self.path, isolation_level=None)
+        self.addCleanup(locker.close)
+        locker.execute("BEGIN EXCLUSIVE")
+        with self.assertLogs('shared_cache', 'WARNING'):
+            generation = cache.generation(['users'])
+            self.assertTrue(cache.set('key', 1, tags=['users'], generation=generation))
+            self.assertEqual(cache.get('key'), 1)
+            self.assertIs(cache.get('missing'), MISSING)
+        locker.execute("ROLLBACK")
+        self.assertIs(cache.shared.get('key'), MISSING)
+
+    @unittest.skipUnless(hasattr(os, 'fork'), "needs os.fork")
+    def test_forked_child(self):
+        """A forked child reads over its own connection and its invalidations reach the parent"""
+        cache = self.tiered()
+        cache.set('key', 1, tags=['users'])
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                if cache.local.get('key') is not MISSING and cache.get('key') == 1:
+                    cache.invalidate_tags(['users'])
+                    code = 0
+            finally:
+                os._exit(code)
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertIs(cache.get('key'), MISSING)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -3,30 +3,49 @@
 Module that provides a generator function to a stream user data from a database one row at a time.
 """
 
-import sqlite3
+from streaming import connect, stream_rows, DEFAULT_ARRAYSIZE
+from tail import follow_rows
 
 
-def stream_users():
+def stream_users(arraysize=DEFAULT_ARRAYSIZE, connection=None, compact=False,
+		follow=False, poll_interval=0.1, max_poll_interval=5.0, wakeup=None,
+		stop=None):
 	"""
 	Generator function that connects to a database and yields rows from the user_data table one by one.
-	
+
+	The whole scan runs on one streaming cursor (unbuffered on MySQL), and
+	rows are pulled from the driver arraysize at a time, so memory use is
+	bounded by arraysize instead of the size of the table.
+
+	Args:
+	    arraysize(int): Number of rows fetched from the driver at a time
+	    connection: Optional open connection (sqlite3 or mysql.connector).
+	        When omitted, a connection to user_data.db is opened and closed
+	        as soon as the scan ends or the consumer stops early.
+	    compact(bool): Yield compact records (row.age, row['age'] and
+	        row[3] all work) that cost about as much memory as a tuple
+	    follow(bool): Keep yielding the users inserted after the end of the
+	        table was reached, like `tail -f` (see tail.py). Polls every
+	        poll_interval seconds, backing off to max_poll_interval while
+	        nothing is inserted, until the generator is closed or stop
+	        (a threading.Event) is set. Setting wakeup (a threading.Event,
+	        see tail.watch_inserts) makes it poll right away.
+
 	Returns:
 	    generator: Yields one row at a time from user_data table
 	"""
 
-	# Establish a connection to the database
-	conn = sqlite3.connect('user_data.db')
+	# Establish a connection to the database unless the caller owns one
+	own_connection = connection is None
+	if own_connection:
+		connection = connect()
 
-	# Create a cursor object to execute SQL queries
-	cursor = conn.cursor()
-
-	# Execute a SELECT query on the user_data table
-	cursor.execute('SELECT * FROM user_data')
+	if follow:
+		yield from follow_rows(connection, arraysize=arraysize, compact=compact,
+				min_interval=poll_interval, max_interval=max_poll_interval,
+				wakeup=wakeup, stop=stop, close_connection=own_connection)
+		return
 
 	# Fetch and yield one row at a time
-	for row in cursor:
-		yield row
-
-	# Close the connection when done
-	cursor.close()
-	conn.close()
\ No newline at end of file
+	yield from stream_rows(connection, 'SELECT * FROM user_data',
+			arraysize=arraysize, close_connection=own_connection, compact=compact)
@@ -1,99 +1,152 @@
-def stream_users_in_batches(batch_size):
-	"""Fetch userrs in batches of a specified size
-	
-	Args:
-	    batch_size(int): The number of userss to fetch in each batch
-		
-	Yields:
-	    A list of user records"""
+#!/usr/bin/env python3
+"""
+Module that streams users from the database in batches and processes them.
+"""
+
+import sqlite3
+
+from checkpoint import run_checkpointed
+from pushdown import select_batches, Selection
+from streaming import connect, describe, keyset_batches
+
+# Users older than this are kept by batch_processing
+MIN_AGE = 25
+
+
+def stream_users_in_batches(batch_size, columnar=False, after=None, adaptive=None,
+		selection=None):
+	"""Fetch user rows in batches of specified size
+	Args: batch_size(int): The number of users to fetch in each batch
+	      columnar(bool): Yield each batch as a NumPy structured array
+	          (batch['age'] is the age column) instead of a list of rows.
+	          Requires numpy.
+	      after: Only fetch the users whose user_id comes after this one
+	          (used to resume an interrupted job)
+	      adaptive: Optional adaptive.AdaptiveBatchSize that grows or
+	          shrinks each batch to hit a target fetch latency and memory
+	          budget (batch_size is then ignored, use its initial size)
+	      selection: Optional pushdown.Selection; only its columns and the
+	          users matching its predicates are fetched (batches then hold
+	          up to batch_size matching users)
+
+	Yields: A list of user records, or a structured array in columnar mode"""
 	if batch_size <= 0:
 	    raise ValueError("Batch size must be a positive integer")
-	
-	# Assume that a database connection is established
-	cursor = db_connection.cursor()
 
-	offset = 0
-	while True:
-		# Fetch one batch from the our connection
-		cursor.execute('SELECT * FROM user_data ORDER BY id LIMIT $s OFFSET $s'
-				(batch_size, offset)
-				)
-		batch= cursor.fetchall()
+	if columnar:
+		yield from _stream_columnar_batches(batch_size, after, adaptive, selection)
+		return
 
-		# If no more records, stop thie iteration
-		if not batch:
-			break
+	# Rows support both index and key access (user['age'])
+	connection = connect(row_factory=sqlite3.Row)
 
-		# Move to the next batch
-		offset += batch_size
+	try:
+		# Each batch seeks past the last user_id of the previous one,
+		# so late batches are as cheap as the first
+		for batch in _batches(connection, batch_size, after, adaptive, selection):
+			yield batch
+	finally:
+		connection.close()
 
-##########################################################################
+def _batches(connection, batch_size, after, adaptive, selection):
+	"""Keyset batches of the whole table, or of a selection of it"""
+	if selection is None:
+		return keyset_batches(connection, batch_size, after=after, sizer=adaptive)
+	return select_batches(connection, batch_size, selection, after=after,
+		sizer=adaptive)
 
-def batch_processing(batch_size=100):
-	"""Process users in batches and filter those over the age of 25
-	Args:
-	    batch_size(int): The number of users to fetch in each batch
-		
-	Returns: A list of users above the age of 25"""
+def _stream_columnar_batches(batch_size, after=None, adaptive=None, selection=None):
+	"""Yields each batch of users as a NumPy structured array"""
+	from columnar import batch_dtype, to_columnar
 
-	filtered_users = []
+	# Plain tuple rows convert straight into the structured array
+	connection = connect()
 
-	# Use the stream_users_in_batches function written earlier
-	for batch in stream_users_in_batches(batch_size):
+	try:
+		columns = '*' if selection is None else selection.select()
+		description = describe(connection, columns=columns)
+		dtype = None
+		for batch in _batches(connection, batch_size, after, adaptive, selection):
+			# Work out the column types from every value, widening them
+			# when a later batch holds e.g. a REAL where earlier ones had ints
+			dtype = batch_dtype(description, batch, dtype)
+			yield to_columnar(batch, description, dtype)
+	finally:
+		connection.close()
 
-		# Process each user in the current batch
-		for user in batch:
-			# Assuming 'user' is a dict or object with an 'age' attribute
-			# Adapt this according to your actual data structure
-			if user['age'] > 25:
-				filtered_users.append(user)
-	    # Optionally, you can showcase the number of users that have been generated thus far
-		print(f"Processed {len(filtered_users)} so far...")
-		return filtered_users
-	
-###################################################
-
-def stream_users_in_batches(batch_size):
-	"""Fetch user rows in batches of specified size
-	Args: batch_size(int): The number of users to fetch in each batch
-	
-	Yields: A list of user records"""
-	if batch_size <= 0:
-	    raise ValueError("Batch size must be a positive integer")
-	
-	# Assume that a database connection is established
-	cursor = db_connection.cursor()
-
-	offset = 0
-	while True:
-		# Fetch one batch from our connection
-		cursor.execute('SELECT * FROM user_data ORDER BY id LIMIT %s OFFSET %s'
-				(batch_size, offset)
-				)
-		batch = cursor.fetchall()
-		# If no more records, stop the iteration	
-		if not batch:
-			break
-
-		yield batch
-		offset += batch_size
-
-def batch_processing(batch_size):
+def batch_processing(batch_size, columnar=False, workers=None, ordered=True,
+		pushdown=True):
 	"""Process users in batches and yield those over the age of 25
 	Args: batch_size(int): The number of users in each batch
-	Yields: 
-	    dict: The number of users above the age of 25"""
+	      columnar(bool): Filter whole batches with a vectorized age mask
+	          and yield the filtered structured arrays. Requires numpy.
+	      workers(int): Scan key-range partitions of the table in this many
+	          worker processes, each over its own read-only connection
+	      ordered(bool): With workers, keep the users in user_id order
+	          (False yields each chunk of a partition as soon as it is done)
+	      pushdown(bool): Filter the ages in the query (WHERE age > 25)
+	          so only matching users are fetched, instead of fetching
+	          every user and filtering in Python
+	Yields:
+	    dict: The number of users above the age of 25
+	    (a structured array of them per batch in columnar mode)"""
+	if workers:
+		from parallel import parallel_batch_processing
+
+		for chunk in parallel_batch_processing(batch_size, workers, ordered):
+			for user in chunk:
+				yield user
+
+			print(f"Processed {len(chunk)} users above 25 so far...")
+		return
+
+	selection = Selection(where=[('age', '>', MIN_AGE)]) if pushdown else None
+
+	if columnar:
+		for batch in stream_users_in_batches(batch_size, columnar=True,
+				selection=selection):
+			# One vectorized comparison over the whole age column,
+			# unless the database already filtered the ages
+			filtered = batch if pushdown else batch[batch['age'] > MIN_AGE]
+			yield filtered
+
+			print(f"Processed {len(filtered)} users above 25 so far...")
+		return
+
 	# Use the stream_users_in_batches function
-	for batch in stream_users_in_batches(batch_size):
+	for batch in stream_users_in_batches(batch_size, selection=selection):
 		filtered_count = 0
 
 		#process each user in the current batch
 		for user in batch:
 			# Yield users over 25 directly instead of collecting in a list
-			if user['age'] > 25:
+			# (with pushdown every fetched user already is)
+			if pushdown or user['age'] > MIN_AGE:
 				yield user
 				filtered_count += 1
 
 
 		# Print progress information
-		print(f"Processed {filtered_count} users above 25 so far...")
\ No newline at end of file
+		print(f"Processed {filtered_count} users above 25 so far...")
+
+def resumable_batch_processing(batch_size, consumer, checkpoint_path, every=1, committed=None):
+	"""Process users in batches, handing those over 25 to a consumer, in a
+	job that resumes where it left off if it fails
+	Args: batch_size(int): The number of users in each batch
+	      consumer: Callable receiving the list of users above 25 of each batch
+	      checkpoint_path(str): JSON file where the last processed user_id
+	          is saved
+	      every(int): Number of batches between two checkpoint saves
+	          (batches are handed over at least once: a crash may replay
+	          up to every of them)
+	      committed: Callable returning the last user_id the consumer
+	          stored with its writes, for exactly once delivery (the
+	          consumer then also receives that user_id, see run_checkpointed)
+	Returns:
+	    Checkpoint: The final checkpoint of the job"""
+	def process(batch, *last_key):
+		consumer([user for user in batch if user['age'] > MIN_AGE], *last_key)
+
+	return run_checkpointed(
+		lambda after: stream_users_in_batches(batch_size, after=after),
+		process, checkpoint_path, every, committed=committed)
@@ -1,66 +1,81 @@
-def paginate_users(page_size, offset):
+#!/usr/bin/env python3
+"""
+Module that lazily paginates through the user_data table.
+"""
+
+import sqlite3
+
+from streaming import connect, fetch_page, prefetch, KEY_COLUMN
+
+
+def paginate_users(connection, page_size, last_user_id=None):
 	"""
 	Fetches a page of users from a database.
 	Args:
+	    connection: Open database connection
 	    page_size(int): Number of users to fetch per page
-		offset(int): Starting position for fetching users
-		
+	    last_user_id: user_id of the last user on the previous page
+	        (None to fetch the first page)
+
 	Returns:
 	    list: A list of user records for the requested page"""
-	
-	# Simulating database connection
-	# In a real application, you would use a proper database connection
-	# Example with sqlite3:
-	# conn = sqlite3.connect('users.db')
-	# cursor = conn.cursor()
 
-	# Constructing the SQL query with LIMIT and OFFSET for pagination
-	query = f"SELECT * FROM user_data LIMIT {page_size} OFFSET {offset}"
+	# Keyset pagination: WHERE user_id > ? ORDER BY user_id LIMIT ?
+	# The database seeks straight to the page through the primary key
+	# instead of skipping over every row before it like OFFSET does
+	page, _ = fetch_page(connection, page_size, after=last_user_id)
+	return page
+
 
-	# simulating execution of the query
-	# In a real application:
-	# cursor.execute(query)
-	# results = cursor.fetchall()
+def lazy_pages(page_size):
+	"""
+	Generator function that lazily loads whole pages of users.
+
+	Args:
+	    page_size(int): Number of users to fetch per page
 
-	# For simulation purposes, generating mock results
-	# Assuming we have 100 users in the database
-	all_users = [{"id": i, "name": f"User {i}", "email": f"User{i}@example.com"} for i in range (1, 101)]
+	Yields:
+	    list: The user records of one page"""
 
-	# Calculate which users to return based on LIMIT and OFFSET
-	start_index = offset																					
-	end_index = min(offset + page_size, len(all_users))
+	connection = connect(row_factory=sqlite3.Row)
+	try:
+		last_user_id = None
+		while True:
+			current_page = paginate_users(connection, page_size, last_user_id)
+			if not current_page:
+				break
 
-	# Return empty list if we're out of range
-	if start_index >= len(all_users):
-		return []
-	
-	# Log the query that would be executed
-	print(f"Executing query: {query}")
+			yield current_page
 
-	return all_users[start_index:end_index]
+			# Remember where this page ended for the next page
+			last_user_id = current_page[-1][KEY_COLUMN]
+	finally:
+		connection.close()
 
 
-def lazy_paginate_users(page_size):
+def lazy_paginate_users(page_size, prefetch_pages=0):
 	"""
 	Generator function that lazily loads pages of users from a database.
 	Only fetches the next page when needed.
 
 	Args:
 	    page_size(int): Number of users to fetch per page
+	    prefetch_pages(int): Number of pages to fetch ahead in a background
+	        thread while the current page is consumed (0 disables it). The
+	        thread waits whenever that many pages are already waiting.
 
 	Yields:
 	    list: A list of user records for the current page"""
 
-	offset = 0
-	while True:
-		current_page = paginate_users(page_size, offset)
-		if not current_page:
-			break
-
-		# Yield each user record individually
-		for user in current_page:
-			yield user
+	if prefetch_pages:
+		pages = prefetch(lambda: lazy_pages(page_size), prefetch_pages)
+	else:
+		pages = lazy_pages(page_size)
 
-			
-	    # Update offset for the next page
-		offset += page_size				 
\ No newline at end of file
+	try:
+		for current_page in pages:
+			# Yield each user record individually
+			for user in current_page:
+				yield user
+	finally:
+		pages.close()
@@ -1,69 +1,102 @@
-def stream_user_ages():
+#!/usr/bin/env python3
+"""
+Module that streams user ages to compute aggregate statistics.
+"""
+
+import sqlite3
+
+from aggregates import age_statistics, read_age_aggregates
+from pushdown import select_batches, Selection
+from stats import StreamStats
+from streaming import connect
+
+# Bucket edges of the age histogram
+AGE_BUCKETS = list(range(0, 101, 10))
+
+
+def stream_user_ages(where=()):
 	"""
 	Generator function that streams user ages one by one from the database.
 	This avoids loading the entire dataset into memory.
+
+	Args:
+	    where: Optional predicates the users must match, e.g.
+	        [('age', '>=', 18)] (see pushdown.Selection); they are compiled
+	        into the query when possible
 	
 	Yields:
 	    int: Age of each user, one at a time
 		"""
-	# Simulate database connection setup
-	# In a real application: conn = database.connect(...)
+	connection = connect()
 
 	# We'll use batched fetching under the hood for efficiency
 	# This is an implementation detail hidden from the caller
-	offset = 0
 	batch_size  = 100 # Process in small batches for efficiency
 
-	while True:
-		# Construct SQL query to fetch a batch of user records
+	try:
 		# Note: We're NOT using SQL's AVG function as required
-		query = f"SELECT age from users LIMIT {batch_size} OFFSET {offset}"
-		
-		# For simulation purposes only -  in a real app you'd execute the query
-		print(f"Executing query: {query}")
-		# Simulate fetching the batch of user records
-		# In a real application: cursor = conn.cursor(); cursor.execute(query); results = cursor.fetchall()
-		# Create simulated data - would be your actual query results
-		# Asssume we have 1000 users total
-		all_ages = [20 + (i % 60) for i in range(1, 1001)]  # Ages between 20-79
-
-		start_idx = offset
-		end_idx = min(offset + batch_size, len(all_ages))
-
-		# Check if we've processed all records
-		if start_idx >= len(all_ages):
-			break
-
-		# Get the current batch of ages
-		current_batch = all_ages[start_idx:end_idx]
-
-		# Yield each age in the current batch
-		for age in current_batch:
-			yield age
-
-		# Move to the next batch
-		offset += batch_size
-
-def calculate_average_age():
+		# Each batch seeks past the last user_id of the previous one
+		# (keyset pagination) instead of rescanning with OFFSET
+		# Only the key and the age column are fetched (user_id, age)
+		selection = Selection(columns=('age',), where=where)
+		for batch in select_batches(connection, batch_size, selection):
+			# Yield each age in the current batch
+			for row in batch:
+				yield row[1]
+	finally:
+		connection.close()
+
+def calculate_age_statistics(workers=None):
+	"""
+	Computes every age statistic in a single pass over the users.
+
+	Args:
+	    workers(int): Split the table into key ranges and scan them in this
+	        many processes, merging their partial statistics
+
+	Returns:
+	    dict: count, sum, mean, variance, stddev, min, max, approximate
+	        percentiles and the age histogram (see stats.StreamStats)
+		"""
+	if workers:
+		from parallel import parallel_stats
+
+		return parallel_stats('age', workers, histogram_edges=AGE_BUCKETS).result()
+
+	# Iterate over the ages streamed from the database, updating every
+	# statistic at once instead of scanning the table once per statistic
+	return StreamStats(AGE_BUCKETS).update_many(stream_user_ages()).result()
+
+def calculate_average_age(maintained=True):
 	"""
 	Calculates the average age of all users in the database.
 
+	When the maintained age aggregates are installed (see aggregates.py)
+	the average is read from them in constant time; otherwise, or with
+	maintained=False, it is computed by streaming every age.
+
+	Args:
+	    maintained(bool): Use the maintained aggregates when available
+
 	Returns:
 	    float: Average age of all users
 		"""
-	total_age = 0
-	user_count = 0
-
-	# Iterate over the ages streamed from the database
-	for age in stream_user_ages():
-		total_age += age
-		user_count += 1
+	if maintained:
+		connection = connect()
+		try:
+			return age_statistics(read_age_aggregates(connection))['mean']
+		except (LookupError, sqlite3.OperationalError):
+			# Aggregates not installed, fall back to a full scan
+			pass
+		finally:
+			connection.close()
 
-	# Calculate and return the average age
-	return total_age / user_count if user_count > 0 else 0
+	return calculate_age_statistics()['mean']
 
 
 # Main execution
 if __name__ == "__main__":
-	avg_age = calculate_average_age()
-	print(f"Average age of users: {avg_age:.2f}")
\ No newline at end of file
+	age_stats = calculate_age_statistics()
+	print(f"Average age of users: {age_stats['mean']:.2f}")
+	print(f"Standard deviation: {age_stats['stddev']:.2f}")
+	print(f"Median age: {age_stats['percentiles'][50]}")
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Adaptive batch sizing for the keyset-paginated generators.
+
+The right batch size depends on where the data lives: a local SQLite file
+answers a query in microseconds, a remote MySQL server may take tens of
+milliseconds per round trip. AdaptiveBatchSize measures how long each
+batch took to fetch and how many bytes its rows hold, and picks the size
+of the next batch so that a fetch takes about target_latency seconds
+without the batch growing past max_bytes, within caller-provided bounds.
+"""
+
+# Number of rows sampled to estimate the size of a row
+SAMPLE_ROWS = 20
+
+
+def estimate_row_bytes(rows):
+	"""
+	Estimates the payload size of a row from a sample of a batch.
+
+	Text and bytes count their length, other values 8 bytes.
+
+	Returns:
+	    float: Average number of bytes per row
+	"""
+	sample = rows[:SAMPLE_ROWS]
+	if not sample:
+		return 0.0
+	total = 0
+	for row in sample:
+		values = row.values() if isinstance(row, dict) else row
+		for value in values:
+			total += len(value) if isinstance(value, (str, bytes)) else 8
+	return total / len(sample)
+
+
+class AdaptiveBatchSize:
+	"""
+	Picks batch sizes that hit a target fetch latency and memory budget.
+
+	Per-row fetch time and row size are tracked as moving averages. After
+	each batch the next size is the largest one that fits both targets,
+	moved at most by a factor of `step` from the current size so that one
+	slow or fast batch does not swing it wildly.
+
+	Args:
+	    initial(int): Size of the first batch
+	    min_size(int): Smallest batch size allowed
+	    max_size(int): Largest batch size allowed
+	    target_latency(float): Wanted fetch time of a batch, in seconds
+	    max_bytes(int): Memory budget of a batch, in estimated payload bytes
+	    step(float): Largest growth or shrink factor between two batches
+	    on_batch: Optional stats hook, called after every batch with a dict:
+	        batch_size, rows, seconds, row_bytes and next_batch_size
+	"""
+
+	def __init__(self, initial=100, min_size=10, max_size=100000,
+			target_latency=0.05, max_bytes=16 * 1024 * 1024, step=2.0,
+			on_batch=None):
+		if not 0 < min_size <= max_size:
+			raise ValueError("Batch size bounds must satisfy 0 < min_size <= max_size")
+		self.min_size = min_size
+		self.max_size = max_size
+		self.target_latency = target_latency
+		self.max_bytes = max_bytes
+		self.step = step
+		self.on_batch = on_batch
+		self.size = self._clamp(initial)
+		self.row_seconds = None
+		self.row_bytes = None
+		self.sizes = []
+
+	def _clamp(self, size):
+		return max(self.min_size, min(self.max_size, int(size)))
+
+	@staticmethod
+	def _average(previous, value, weight=0.3):
+		# Exponential moving average, started on the first value
+		return value if previous is None else previous + weight * (value - previous)
+
+	def record(self, requested, rows, seconds):
+		"""
+		Records how a batch went and picks the size of the next one.
+
+		Args:
+		    requested(int): Batch size asked for
+		    rows(list): Rows returned
+		    seconds(float): Time taken to fetch them
+
+		Returns:
+		    int: Size of the next batch
+		"""
+		self.sizes.append(requested)
+		if rows:
+			self.row_seconds = self._average(self.row_seconds, seconds / len(rows))
+			self.row_bytes = self._average(self.row_bytes, estimate_row_bytes(rows))
+
+			wanted = self.max_size
+			if self.row_seconds > 0:
+				wanted = min(wanted, self.target_latency / self.row_seconds)
+			if self.row_bytes > 0:
+				wanted = min(wanted, self.max_bytes / self.row_bytes)
+			wanted = max(self.size / self.step, min(self.size * self.step, wanted))
+			self.size = self._clamp(wanted)
+
+		if self.on_batch is not None:
+			self.on_batch({
+				'batch_size': requested,
+				'rows': len(rows),
+				'seconds': seconds,
+				'row_bytes': self.row_bytes,
+				'next_batch_size': self.size,
+			})
+		return self.size
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Incrementally maintained age aggregates for the user_data table.
+
+Two small tables hold the running count, sum and sum of squares of the
+ages, and the number of users per age bucket:
+
+    user_data_age_stats(id, count, total, total_squares)   -- one row
+    user_data_age_buckets(bucket, count)                  -- one row per bucket
+
+Triggers on user_data keep them up to date on every INSERT, UPDATE and
+DELETE, so the average age and the age distribution are read without
+scanning user_data.
+
+REPLACE (and INSERT OR REPLACE) deletes the row it replaces, but SQLite
+only fires the DELETE trigger for that when the writing connection has
+PRAGMA recursive_triggers on; otherwise the old row stays counted. The
+connections of streaming.connect() and any connection passed to
+install_age_aggregates() or ensure_age_aggregates() have it on; call
+enable_replace_triggers() on any other sqlite3 connection that writes to
+user_data. MySQL always fires the DELETE trigger of a REPLACE. verify_age_aggregates()
+recomputes everything from scratch to check the maintained values, and
+ensure_age_aggregates() installs them only when they are missing (or do not
+verify), so it can run on every start without rescanning the table.
+
+Works with both sqlite3 and mysql.connector connections.
+"""
+
+import math
+
+from streaming import is_sqlite, keyset_batches, placeholder, KEY_COLUMN, TABLE_NAME
+
+# Width of the age buckets (bucket n holds ages n*10 to n*10+9)
+BUCKET_WIDTH = 10
+
+STATS_TABLE = 'user_data_age_stats'
+BUCKETS_TABLE = 'user_data_age_buckets'
+
+
+def _bucket(connection, age):
+	"""SQL expression of the bucket of an age"""
+	if is_sqlite(connection):
+		return f"CAST({age} / {BUCKET_WIDTH} AS INTEGER)"
+	return f"FLOOR({age} / {BUCKET_WIDTH})"
+
+
+def _add_to_bucket(connection, age, delta):
+	"""SQL statement adding delta users to the bucket of an age"""
+	bucket = _bucket(connection, age)
+	if is_sqlite(connection):
+		return (f"INSERT INTO {BUCKETS_TABLE} (bucket, count) VALUES ({bucket}, {delta}) "
+			f"ON CONFLICT(bucket) DO UPDATE SET count = count + {delta};")
+	return (f"INSERT INTO {BUCKETS_TABLE} (bucket, count) VALUES ({bucket}, {delta}) "
+		f"ON DUPLICATE KEY UPDATE count = count + {delta};")
+
+
+def _add_to_stats(age, sign):
+	"""SQL statement adding (sign=+) or removing (sign=-) an age"""
+	return (f"UPDATE {STATS_TABLE} SET count = count {sign} 1, "
+		f"total = total {sign} {age}, "
+		f"total_squares = total_squares {sign} {age} * {age} WHERE id = 1;")
+
+
+def enable_replace_triggers(connection):
+	"""
+	Makes REPLACE on a sqlite3 connection fire the DELETE trigger for the
+	row it replaces, so the aggregates drop it. A no-op on MySQL.
+	"""
+	if is_sqlite(connection):
+		connection.execute("PRAGMA recursive_triggers = ON")
+
+
+def _trigger_names(table_name):
+	return [f"{table_name}_age_insert", f"{table_name}_age_update", f"{table_name}_age_delete"]
+
+
+def _trigger(connection, name, event, table_name, body):
+	"""CREATE TRIGGER statement in the connection's SQL dialect"""
+	if is_sqlite(connection):
+		return (f"CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON {table_name} "
+			f"BEGIN {' '.join(body)} END")
+	return (f"CREATE TRIGGER {name} AFTER {event} ON {table_name} "
+		f"FOR EACH ROW BEGIN {' '.join(body)} END")
+
+
+def install_age_aggregates(connection, table_name=TABLE_NAME):
+	"""
+	Creates the aggregate tables and triggers, and fills them from scratch.
+
+	Safe to call again: existing triggers are replaced and the aggregates
+	rebuilt.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    table_name(str): Table holding the users
+	"""
+	enable_replace_triggers(connection)
+	number = 'REAL' if is_sqlite(connection) else 'DOUBLE'
+	cursor = connection.cursor()
+	cursor.execute(f"""
+		CREATE TABLE IF NOT EXISTS {STATS_TABLE} (
+			id INTEGER PRIMARY KEY,
+			count BIGINT NOT NULL,
+			total {number} NOT NULL,
+			total_squares {number} NOT NULL
+		)
+	""")
+	cursor.execute(f"""
+		CREATE TABLE IF NOT EXISTS {BUCKETS_TABLE} (
+			bucket INTEGER PRIMARY KEY,
+			count BIGINT NOT NULL
+		)
+	""")
+
+	insert, update, delete = _trigger_names(table_name)
+	triggers = {
+		insert: ('INSERT', [
+			_add_to_stats('NEW.age', '+'),
+			_add_to_bucket(connection, 'NEW.age', 1),
+		]),
+		update: ('UPDATE', [
+			_add_to_stats('OLD.age', '-'),
+			_add_to_bucket(connection, 'OLD.age', -1),
+			_add_to_stats('NEW.age', '+'),
+			_add_to_bucket(connection, 'NEW.age', 1),
+		]),
+		delete: ('DELETE', [
+			_add_to_stats('OLD.age', '-'),
+			_add_to_bucket(connection, 'OLD.age', -1),
+		]),
+	}
+	for name, (event, body) in triggers.items():
+		cursor.execute(f"DROP TRIGGER IF EXISTS {name}")
+		cursor.execute(_trigger(connection, name, event, table_name, body))
+	cursor.close()
+
+	rebuild_age_aggregates(connection, table_name)
+
+
+def age_aggregates_installed(connection, table_name=TABLE_NAME):
+	"""
+	Tells whether the aggregate tables are filled and the three triggers
+	are in place.
+	"""
+	names = _trigger_names(table_name)
+	mark = placeholder(connection)
+	marks = ', '.join([mark] * len(names))
+	cursor = connection.cursor()
+	try:
+		if is_sqlite(connection):
+			cursor.execute(f"SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' "
+				f"AND name IN ({marks})", names)
+			tables_query = "SELECT COUNT(*) FROM sqlite_master WHERE type = 'table' AND name = ?"
+		else:
+			cursor.execute(f"SELECT COUNT(*) FROM information_schema.TRIGGERS "
+				f"WHERE TRIGGER_SCHEMA = DATABASE() AND TRIGGER_NAME IN ({marks})", names)
+			tables_query = ("SELECT COUNT(*) FROM information_schema.TABLES "
+				"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s")
+		if cursor.fetchone()[0] != len(names):
+			return False
+		cursor.execute(tables_query, (STATS_TABLE,))
+		if not cursor.fetchone()[0]:
+			return False
+		cursor.execute(f"SELECT COUNT(*) FROM {STATS_TABLE} WHERE id = 1")
+		return cursor.fetchone()[0] == 1
+	finally:
+		cursor.close()
+
+
+def ensure_age_aggregates(connection, table_name=TABLE_NAME, verify=False):
+	"""
+	Installs the aggregates (see install_age_aggregates) unless they
+	already are. Once installed the triggers keep them up to date, so
+	nothing is rebuilt and user_data is not scanned.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    table_name(str): Table holding the users
+	    verify(bool): Also recompute the aggregates (one scan) and
+	        reinstall them if they do not match the maintained ones
+
+	Returns:
+	    bool: Whether they were (re)installed
+	"""
+	enable_replace_triggers(connection)
+	if age_aggregates_installed(connection, table_name):
+		if not verify or verify_age_aggregates(connection, table_name)[0]:
+			return False
+	install_age_aggregates(connection, table_name)
+	return True
+
+
+def recompute_age_aggregates(connection, table_name=TABLE_NAME, batch_size=10000):
+	"""
+	Computes the aggregates from scratch with one scan of the table.
+
+	Returns:
+	    dict: count, total, total_squares and buckets ({bucket: count})
+	"""
+	result = {'count': 0, 'total': 0.0, 'total_squares': 0.0, 'buckets': {}}
+	buckets = result['buckets']
+	for batch in keyset_batches(connection, batch_size, table_name,
+			columns=f"{KEY_COLUMN}, age"):
+		for _, age in batch:
+			age = float(age)
+			result['count'] += 1
+			result['total'] += age
+			result['total_squares'] += age * age
+			bucket = int(age // BUCKET_WIDTH)
+			buckets[bucket] = buckets.get(bucket, 0) + 1
+	return result
+
+
+def rebuild_age_aggregates(connection, table_name=TABLE_NAME):
+	"""Overwrites the maintained aggregates with freshly computed ones"""
+	fresh = recompute_age_aggregates(connection, table_name)
+	mark = placeholder(connection)
+	cursor = connection.cursor()
+	cursor.execute(f"DELETE FROM {STATS_TABLE}")
+	cursor.execute(f"DELETE FROM {BUCKETS_TABLE}")
+	cursor.execute(
+		f"INSERT INTO {STATS_TABLE} (id, count, total, total_squares) "
+		f"VALUES (1, {mark}, {mark}, {mark})",
+		(fresh['count'], fresh['total'], fresh['total_squares']))
+	cursor.executemany(
+		f"INSERT INTO {BUCKETS_TABLE} (bucket, count) VALUES ({mark}, {mark})",
+		sorted(fresh['buckets'].items()))
+	connection.commit()
+	cursor.close()
+
+
+def read_age_aggregates(connection):
+	"""
+	Reads the maintained aggregates, without scanning user_data.
+
+	Returns:
+	    dict: count, total, total_squares and buckets ({bucket: count})
+	"""
+	cursor = connection.cursor()
+	cursor.execute(f"SELECT count, total, total_squares FROM {STATS_TABLE} WHERE id = 1")
+	row = cursor.fetchone()
+	cursor.execute(f"SELECT bucket, count FROM {BUCKETS_TABLE} WHERE count > 0")
+	buckets = {int(bucket): int(count) for bucket, count in cursor.fetchall()}
+	cursor.close()
+
+	if row is None:
+		raise LookupError("Age aggregates are not installed, run install_age_aggregates()")
+	count, total, total_squares = row
+	return {
+		'count': int(count),
+		'total': float(total),
+		'total_squares': float(total_squares),
+		'buckets': buckets,
+	}
+
+
+def age_statistics(aggregates):
+	"""
+	Derives the age statistics from aggregates.
+
+	Returns:
+	    dict: count, sum, mean, variance, stddev and histogram
+	        ([((low, high), count)] with high exclusive)
+	"""
+	count = aggregates['count']
+	mean = aggregates['total'] / count if count else 0
+	variance = max(aggregates['total_squares'] / count - mean * mean, 0.0) if count else 0.0
+	return {
+		'count': count,
+		'sum': aggregates['total'],
+		'mean': mean,
+		'variance': variance,
+		'stddev': math.sqrt(variance),
+		'histogram': [
+			((bucket * BUCKET_WIDTH, (bucket + 1) * BUCKET_WIDTH), number)
+			for bucket, number in sorted(aggregates['buckets'].items())
+		],
+	}
+
+
+def verify_age_aggregates(connection, table_name=TABLE_NAME):
+	"""
+	Recomputes the aggregates from scratch and compares them with the
+	maintained ones.
+
+	Returns:
+	    tuple: (ok, maintained, recomputed)
+	"""
+	maintained = read_age_aggregates(connection)
+	recomputed = recompute_age_aggregates(connection, table_name)
+
+	ok = (
+		maintained['count'] == recomputed['count']
+		and maintained['buckets'] == {b: c for b, c in recomputed['buckets'].items() if c}
+		and math.isclose(maintained['total'], recomputed['total'], rel_tol=1e-9, abs_tol=1e-6)
+		and math.isclose(maintained['total_squares'], recomputed['total_squares'],
+			rel_tol=1e-9, abs_tol=1e-6)
+	)
+	return ok, maintained, recomputed
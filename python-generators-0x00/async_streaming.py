@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Async generator variants of the user_data streaming API, built on aiosqlite.
+
+Every function here is an async generator, consumed with `async for`, so an
+asyncio service can stream users without blocking its event loop:
+
+    async with aclosing(async_stream_users_in_batches(1000)) as batches:
+        async for batch in batches:
+            ...
+
+The queries are the same as in the synchronous generators (keyset pages
+for the batches, one fetchmany() cursor for the full stream). When the
+generator is closed early, or its task is cancelled while the generator
+awaits a query, the cursor is closed and the generator's own connection
+with it. Use contextlib.aclosing() so that an early `break`, or a
+cancellation while the loop body awaits something else, releases them
+right away instead of when the generator is garbage collected.
+
+read_ahead=N fetches up to N pages ahead in a separate task while the
+current one is consumed; the task waits whenever N pages are waiting.
+
+Each aiosqlite connection runs its queries on its own thread. To serve
+many concurrent streams from one event loop, open one connection with
+async_connect() and pass it to every generator: their queries are then
+queued on that connection's single thread instead of one thread each.
+Requires aiosqlite.
+"""
+
+import asyncio
+import sqlite3
+
+import aiosqlite
+
+from streaming import (page_query, row_key, DATABASE_PATH, DEFAULT_ARRAYSIZE,
+		KEY_COLUMN, TABLE_NAME)
+
+# Marks the end of a read-ahead stream
+_DONE = object()
+
+
+async def async_connect(database_path=DATABASE_PATH, row_factory=None):
+	"""
+	Opens an aiosqlite connection to the user_data database.
+
+	Args:
+	    database_path(str): Path to the SQLite database file
+	    row_factory: Optional sqlite3 row factory (e.g. sqlite3.Row)
+
+	Returns:
+	    aiosqlite.Connection: The open connection
+	"""
+	connection = await aiosqlite.connect(database_path)
+	if row_factory is not None:
+		connection.row_factory = row_factory
+	return connection
+
+
+async def read_ahead(source, depth=2):
+	"""
+	Async generator that reads ahead from another async iterable in a task.
+
+	The task pulls items from the source into a queue of at most depth
+	items while the consumer works on the current one, and waits when the
+	queue is full. Exceptions raised by the source are re-raised in the
+	consumer. When the consumer stops, the task is cancelled and the source
+	closed.
+
+	Args:
+	    source: Async iterable to read ahead from
+	    depth(int): Maximum number of items read ahead
+
+	Yields:
+	    The items of the source, in order
+	"""
+	if depth <= 0:
+		raise ValueError("Read-ahead depth must be a positive integer")
+
+	buffer = asyncio.Queue(maxsize=depth)
+
+	async def produce():
+		try:
+			try:
+				async for item in source:
+					await buffer.put((item, None))
+			finally:
+				if hasattr(source, 'aclose'):
+					await source.aclose()
+		except Exception as e:
+			await buffer.put((_DONE, e))
+			return
+		await buffer.put((_DONE, None))
+
+	task = asyncio.create_task(produce())
+	try:
+		while True:
+			item, error = await buffer.get()
+			if item is _DONE:
+				if error is not None:
+					raise error
+				break
+			yield item
+	finally:
+		task.cancel()
+		try:
+			await task
+		except asyncio.CancelledError:
+			pass
+
+
+async def _owned(connection, row_factory=None):
+	"""Returns (connection, own_connection), opening one if none is given"""
+	if connection is not None:
+		return connection, False
+	return await async_connect(row_factory=row_factory), True
+
+
+async def async_fetch_page(connection, page_size, after=None,
+		table_name=TABLE_NAME, key=KEY_COLUMN, columns='*', until=None):
+	"""
+	Fetches one keyset page of rows that come right after a given key.
+
+	Returns:
+	    tuple: (rows, last_key) where last_key is None for an empty page
+	"""
+	query, params = page_query('?', page_size, after, table_name, key,
+			columns, until)
+	async with connection.execute(query, params) as cursor:
+		rows = await cursor.fetchall()
+		if not rows:
+			return rows, None
+		return rows, row_key(rows[-1], key, cursor.description)
+
+
+async def async_keyset_batches(connection, batch_size, table_name=TABLE_NAME,
+		key=KEY_COLUMN, columns='*', after=None, until=None):
+	"""
+	Async generator that walks a whole table page by page using keyset
+	pagination (see streaming.keyset_batches).
+
+	Yields:
+	    list: One page of rows at a time
+	"""
+	while True:
+		batch, last_key = await async_fetch_page(connection, batch_size, after,
+				table_name, key, columns, until)
+
+		# If no more records, stop the iteration
+		if not batch:
+			break
+
+		yield batch
+
+		# A short page means we just read the end of the table
+		if len(batch) < batch_size:
+			break
+
+		# Continue right after the last key of this page
+		after = last_key
+
+
+async def async_stream_chunks(connection, query, params=(),
+		arraysize=DEFAULT_ARRAYSIZE, close_connection=False):
+	"""
+	Async generator that streams the rows of one query, arraysize at a time.
+
+	The query runs on a single cursor read with fetchmany(), so at most
+	one fetch worth of rows is held in memory. The cursor is closed when
+	the scan ends, fails, is cancelled or closed early, and the connection
+	too with close_connection=True.
+
+	Yields:
+	    list: Up to arraysize rows at a time
+	"""
+	cursor = None
+	try:
+		if arraysize <= 0:
+			raise ValueError("Array size must be a positive integer")
+
+		cursor = await connection.execute(query, params)
+		while True:
+			rows = await cursor.fetchmany(arraysize)
+			if not rows:
+				break
+			yield rows
+	finally:
+		if cursor is not None:
+			await cursor.close()
+		if close_connection:
+			await connection.close()
+
+
+def _maybe_read_ahead(pages, depth):
+	"""Wraps a page generator in read_ahead() when depth is not 0"""
+	if depth:
+		return read_ahead(pages, depth)
+	return pages
+
+
+async def async_stream_users(arraysize=DEFAULT_ARRAYSIZE, connection=None,
+		read_ahead_chunks=0):
+	"""
+	Async generator that yields the rows of the user_data table one by one.
+
+	Args:
+	    arraysize(int): Number of rows fetched from the driver at a time
+	    connection: Optional open aiosqlite connection, shared with other
+	        streams; one is opened and closed by the generator otherwise
+	    read_ahead_chunks(int): Number of fetches of arraysize rows to read
+	        ahead while the current one is consumed (0 disables it)
+
+	Yields:
+	    tuple: One user row at a time
+	"""
+	connection, own_connection = await _owned(connection)
+	chunks = _maybe_read_ahead(async_stream_chunks(connection,
+			f"SELECT * FROM {TABLE_NAME}", arraysize=arraysize), read_ahead_chunks)
+	try:
+		async for rows in chunks:
+			for row in rows:
+				yield row
+	finally:
+		await chunks.aclose()
+		if own_connection:
+			await connection.close()
+
+
+async def async_stream_users_in_batches(batch_size, connection=None,
+		after=None, read_ahead_batches=0):
+	"""
+	Async generator that fetches users in keyset-paginated batches.
+
+	Args:
+	    batch_size(int): Number of users per batch
+	    connection: Optional open aiosqlite connection, shared with other
+	        streams; one returning sqlite3.Row rows is opened otherwise
+	    after: Only fetch the users whose user_id comes after this one
+	    read_ahead_batches(int): Number of batches to fetch ahead while
+	        the current one is consumed (0 disables it)
+
+	Yields:
+	    list: One batch of user rows at a time
+	"""
+	connection, own_connection = await _owned(connection, sqlite3.Row)
+	batches = _maybe_read_ahead(async_keyset_batches(connection, batch_size,
+			after=after), read_ahead_batches)
+	try:
+		async for batch in batches:
+			yield batch
+	finally:
+		await batches.aclose()
+		if own_connection:
+			await connection.close()
+
+
+async def async_lazy_paginate_users(page_size, connection=None,
+		read_ahead_pages=0):
+	"""
+	Async generator that lazily loads pages of users, yielding one user at
+	a time. The next page is only fetched once the current one is used up,
+	unless read_ahead_pages asks for pages to be fetched ahead.
+
+	Args:
+	    page_size(int): Number of users to fetch per page
+	    connection: Optional open aiosqlite connection, shared with other
+	        streams; one returning sqlite3.Row rows is opened otherwise
+	    read_ahead_pages(int): Number of pages to fetch ahead (0 disables it)
+
+	Yields:
+	    A user row at a time
+	"""
+	pages = async_stream_users_in_batches(page_size, connection,
+			read_ahead_batches=read_ahead_pages)
+	try:
+		async for current_page in pages:
+			for user in current_page:
+				yield user
+	finally:
+		await pages.aclose()
+
+
+async def async_stream_user_ages(connection=None, batch_size=100):
+	"""
+	Async generator that streams user ages one by one.
+
+	Args:
+	    connection: Optional open aiosqlite connection, shared with other
+	        streams; one is opened and closed by the generator otherwise
+	    batch_size(int): Number of ages fetched per keyset page
+
+	Yields:
+	    int: Age of each user, one at a time
+	"""
+	connection, own_connection = await _owned(connection)
+	batches = async_keyset_batches(connection, batch_size,
+			columns=f"{KEY_COLUMN}, age")
+	try:
+		async for batch in batches:
+			for _, age in batch:
+				yield age
+	finally:
+		await batches.aclose()
+		if own_connection:
+			await connection.close()
+
+
+if __name__ == "__main__":
+	async def main():
+		total = count = 0
+		async for age in async_stream_user_ages():
+			total += age
+			count += 1
+		print(f"Average age of {count} users: {total / count if count else 0:.2f}")
+
+	asyncio.run(main())
@@ -0,0 +1,543 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the user_data streaming generators.
+
+Generates synthetic SQLite user_data databases (100k, 1M and 10M users by
+default) and runs every streaming strategy of this project over each of
+them, one fresh process per run, reporting:
+    - rows per second and total time;
+    - time to first row;
+    - per-batch latency percentiles;
+    - peak RSS of the process.
+Results are written to a JSON file. Passing the JSON file of a previous
+release as --baseline flags the strategies that got slower.
+
+With --micro it also runs the focused comparisons:
+    - how long each batch takes to fetch as the scan moves deeper into
+      the table, with OFFSET and with keyset pagination;
+    - the age > 25 filter end to end, row at a time against the
+      columnar path including the conversion of each batch to a NumPy
+      array (skipped when numpy is not installed);
+    - throughput and memory of the row types a stream can yield: tuples,
+      dicts, sqlite3.Row and compact records.
+
+Usage:
+    python3 benchmark.py [--sizes 100000 1000000 10000000] [--batch-size 1000]
+                         [--output benchmark_results.json] [--baseline old.json]
+                         [--tolerance 0.1] [--data-dir benchmark_data] [--micro]
+                         [--timeout 3600]
+"""
+
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import queue
+import random
+import resource
+import sqlite3
+import sys
+import time
+import tracemalloc
+import uuid
+
+from streaming import dict_factory, describe, fetch_page, keyset_batches
+from rows import record_maker
+
+
+def create_user_db(db_path, rows, chunk_size=10000):
+	"""
+	Creates a synthetic user_data SQLite database.
+
+	Args:
+	    db_path(str): Path of the database file to (re)create
+	    rows(int): Number of users to generate
+	    chunk_size(int): Number of users inserted per transaction
+	"""
+	if os.path.exists(db_path):
+		os.remove(db_path)
+
+	conn = sqlite3.connect(db_path)
+	conn.execute('''
+		CREATE TABLE user_data (
+			user_id TEXT PRIMARY KEY,
+			name TEXT NOT NULL,
+			email TEXT NOT NULL,
+			age INTEGER NOT NULL
+		)
+	''')
+
+	rng = random.Random(42)
+	created = 0
+	while created < rows:
+		count = min(chunk_size, rows - created)
+		users = []
+		for i in range(created, created + count):
+			users.append((
+				str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+				f"User {i}",
+				f"user{i}@example.com",
+				rng.randint(18, 90),
+			))
+		conn.executemany('INSERT INTO user_data VALUES (?, ?, ?, ?)', users)
+		conn.commit()
+		created += count
+
+	conn.close()
+	print(f"Created {rows} users in {db_path}")
+
+
+def offset_page(conn, batch_size, offset):
+	"""Fetches one page the old way, with LIMIT/OFFSET"""
+	cursor = conn.execute(
+		'SELECT * FROM user_data ORDER BY user_id LIMIT ? OFFSET ?',
+		(batch_size, offset))
+	return cursor.fetchall()
+
+
+def bench_pagination(db_path, batch_size=1000, samples=10):
+	"""
+	Compares per-batch latency of OFFSET and keyset pagination.
+
+	Walks the whole table once with keyset pagination, recording the
+	time taken by each batch, and times OFFSET pages at the same depth.
+
+	Returns:
+	    list: (offset, offset_ms, keyset_ms) tuples at evenly spaced depths
+	"""
+	conn = sqlite3.connect(db_path)
+	total = conn.execute('SELECT COUNT(*) FROM user_data').fetchone()[0]
+	pages = max(1, total // batch_size)
+	step = max(1, pages // samples)
+
+	results = []
+	after = None
+	page = 0
+	while True:
+		start = time.perf_counter()
+		batch, last_key = fetch_page(conn, batch_size, after)
+		keyset_ms = (time.perf_counter() - start) * 1000
+		if not batch:
+			break
+
+		if page % step == 0:
+			offset = page * batch_size
+			start = time.perf_counter()
+			offset_page(conn, batch_size, offset)
+			offset_ms = (time.perf_counter() - start) * 1000
+			results.append((offset, offset_ms, keyset_ms))
+
+		after = last_key
+		page += 1
+
+	conn.close()
+	return results
+
+
+def bench_columnar(db_path, batch_size=10000):
+	"""
+	Compares the age > 25 filter row at a time and as a vectorized mask.
+
+	Both paths are timed end to end, the way batch_processing() runs them:
+	the row path fetches sqlite3.Row batches and tests each user, the
+	columnar path fetches tuple batches, works out their dtype, builds the
+	structured arrays and applies the mask. The columnar time is also
+	broken down into fetching, converting and masking.
+
+	Returns:
+	    dict: Seconds spent by each path (and each columnar step) and the
+	        number of matching users
+	"""
+	from columnar import batch_dtype, to_columnar
+
+	conn = sqlite3.connect(db_path)
+	conn.row_factory = sqlite3.Row
+	start = time.perf_counter()
+	row_matches = 0
+	for batch in keyset_batches(conn, batch_size):
+		for user in batch:
+			if user['age'] > 25:
+				row_matches += 1
+	row_seconds = time.perf_counter() - start
+
+	conn.row_factory = None
+	description = describe(conn)
+	fetch_seconds = convert_seconds = mask_seconds = 0.0
+	columnar_matches = 0
+	dtype = None
+	start = time.perf_counter()
+	for batch in keyset_batches(conn, batch_size):
+		fetched = time.perf_counter()
+		dtype = batch_dtype(description, batch, dtype)
+		array = to_columnar(batch, description, dtype)
+		converted = time.perf_counter()
+		columnar_matches += int((array['age'] > 25).sum())
+		masked = time.perf_counter()
+		fetch_seconds += fetched - start
+		convert_seconds += converted - fetched
+		mask_seconds += masked - converted
+		start = masked
+	conn.close()
+
+	assert row_matches == columnar_matches
+	return {
+		'matches': row_matches,
+		'row_seconds': row_seconds,
+		'columnar_seconds': fetch_seconds + convert_seconds + mask_seconds,
+		'fetch_seconds': fetch_seconds,
+		'convert_seconds': convert_seconds,
+		'mask_seconds': mask_seconds,
+	}
+
+
+def bench_rows(db_path, arraysize=1000, held=100000):
+	"""
+	Compares the row types a stream can yield.
+
+	For each row type, streams the whole table (throughput) and measures
+	the memory taken by the first held rows when kept in a list.
+
+	Returns:
+	    dict: {row type: (rows per second, bytes per held row)}
+	"""
+	# Row factory of each row type; compact records are built from tuples
+	row_types = {
+		'tuple': None,
+		'dict': dict_factory,
+		'sqlite3.Row': sqlite3.Row,
+		'compact': None,
+	}
+
+	results = {}
+	conn = sqlite3.connect(db_path)
+	for name, row_factory in row_types.items():
+		for measure_memory in (False, True):
+			cursor = conn.cursor()
+			cursor.row_factory = row_factory
+			cursor.execute('SELECT * FROM user_data')
+			make = record_maker(cursor.description) if name == 'compact' else None
+
+			if measure_memory:
+				tracemalloc.start()
+			start = time.perf_counter()
+			kept = []
+			count = 0
+			while True:
+				rows = cursor.fetchmany(arraysize)
+				if not rows:
+					break
+				if make is not None:
+					rows = [make(row) for row in rows]
+				if measure_memory:
+					kept.extend(rows)
+					if len(kept) >= held:
+						break
+				count += len(rows)
+			elapsed = time.perf_counter() - start
+
+			if measure_memory:
+				memory = tracemalloc.get_traced_memory()[0] / len(kept)
+				tracemalloc.stop()
+			else:
+				rate = count / elapsed
+			cursor.close()
+			del kept
+		results[name] = (rate, memory)
+	conn.close()
+	return results
+
+
+def percentile(values, q):
+	"""Returns the q-th percentile (0 to 100) of a list of numbers"""
+	if not values:
+		return None
+	ordered = sorted(values)
+	index = min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))
+	return ordered[index]
+
+
+def _stream_users(batch_size, compact=False):
+	module = importlib.import_module('0-stream_users')
+	return module.stream_users(arraysize=batch_size, compact=compact), 'row'
+
+
+def _batches(batch_size, columnar=False):
+	module = importlib.import_module('1-batch_processing')
+	return module.stream_users_in_batches(batch_size, columnar=columnar), 'batch'
+
+
+def _batch_processing(batch_size):
+	module = importlib.import_module('1-batch_processing')
+	return module.batch_processing(batch_size), 'row'
+
+
+def _lazy_paginate(batch_size, prefetch_pages=0):
+	module = importlib.import_module('2-lazy_paginate')
+	return module.lazy_paginate_users(batch_size, prefetch_pages), 'row'
+
+
+def _stream_user_ages(batch_size):
+	module = importlib.import_module('4-stream_ages')
+	return module.stream_user_ages(), 'row'
+
+
+# name -> callable(batch_size) returning (iterator, 'row' or 'batch')
+STRATEGIES = {
+	'stream_users': _stream_users,
+	'stream_users_compact': lambda batch_size: _stream_users(batch_size, compact=True),
+	'stream_users_in_batches': _batches,
+	'stream_users_in_batches_columnar': lambda batch_size: _batches(batch_size, columnar=True),
+	'batch_processing': _batch_processing,
+	'lazy_paginate_users': _lazy_paginate,
+	'lazy_paginate_users_prefetch': lambda batch_size: _lazy_paginate(batch_size, prefetch_pages=4),
+	'stream_user_ages': _stream_user_ages,
+}
+
+
+def measure_stream(iterator, unit, batch_size):
+	"""
+	Consumes a stream and measures it.
+
+	Per-batch latency is the time between two batches for batch streams,
+	and the time taken by each batch_size rows for row streams.
+
+	Returns:
+	    dict: rows, seconds, rows_per_sec, time_to_first_row_ms and
+	        batch_latency_ms percentiles
+	"""
+	latencies = []
+	rows = 0
+	first_row = None
+	start = previous = time.perf_counter()
+	pending = 0
+	for item in iterator:
+		now = time.perf_counter()
+		if first_row is None:
+			first_row = now - start
+		if unit == 'batch':
+			rows += len(item)
+			latencies.append(now - previous)
+			previous = now
+		else:
+			rows += 1
+			pending += 1
+			if pending == batch_size:
+				latencies.append(now - previous)
+				previous = now
+				pending = 0
+	seconds = time.perf_counter() - start
+
+	latencies_ms = [latency * 1000 for latency in latencies]
+	return {
+		'rows': rows,
+		'seconds': seconds,
+		'rows_per_sec': rows / seconds if seconds > 0 else None,
+		'time_to_first_row_ms': first_row * 1000 if first_row is not None else None,
+		'batch_latency_ms': {
+			'p50': percentile(latencies_ms, 50),
+			'p90': percentile(latencies_ms, 90),
+			'p99': percentile(latencies_ms, 99),
+			'max': max(latencies_ms) if latencies_ms else None,
+		},
+	}
+
+
+def run_strategy(name, data_dir, batch_size, results):
+	"""
+	Runs one strategy against data_dir/user_data.db, in a fresh process.
+
+	The generators open user_data.db in the current directory, so the
+	process moves to data_dir first. Progress prints are silenced. A
+	result is always sent back, with the error if the strategy failed.
+	"""
+	try:
+		os.chdir(data_dir)
+		with contextlib.redirect_stdout(io.StringIO()):
+			iterator, unit = STRATEGIES[name](batch_size)
+			result = measure_stream(iterator, unit, batch_size)
+	except ImportError as e:
+		result = {'skipped': str(e)}
+	except BaseException as e:
+		result = {'error': f"{type(e).__name__}: {e}"}
+	# ru_maxrss is in kilobytes on Linux
+	result['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+	results.put(result)
+
+
+def run_isolated(name, data_dir, batch_size, timeout=None):
+	"""
+	Runs a strategy in a new process so that its peak RSS is its own.
+
+	If the process dies without a result (e.g. killed for running out of
+	memory) or runs for more than timeout seconds, an error result is
+	returned instead of waiting forever.
+	"""
+	context = multiprocessing.get_context('spawn')
+	results = context.Queue()
+	process = context.Process(target=run_strategy, args=(name, data_dir, batch_size, results))
+	process.start()
+	deadline = None if timeout is None else time.monotonic() + timeout
+	result = None
+	while result is None:
+		try:
+			result = results.get(timeout=1.0)
+		except queue.Empty:
+			if not process.is_alive():
+				# Give a result sent just before exiting a last chance
+				try:
+					result = results.get(timeout=1.0)
+				except queue.Empty:
+					result = {'error': f"process exited with code {process.exitcode}"}
+			elif deadline is not None and time.monotonic() > deadline:
+				process.terminate()
+				result = {'error': f"timed out after {timeout} seconds"}
+	process.join()
+	return result
+
+
+def prepare_database(data_dir, rows):
+	"""Creates data_dir/user_data.db with rows users, unless it already exists"""
+	os.makedirs(data_dir, exist_ok=True)
+	db_path = os.path.join(data_dir, 'user_data.db')
+	if os.path.exists(db_path):
+		conn = sqlite3.connect(db_path)
+		try:
+			count = conn.execute('SELECT COUNT(*) FROM user_data').fetchone()[0]
+		except sqlite3.Error:
+			count = None
+		conn.close()
+		if count == rows:
+			return db_path
+	create_user_db(db_path, rows)
+	return db_path
+
+
+def run_micro(db_path, rows, batch_size):
+	"""Runs the focused comparisons on one database and prints them"""
+	results = {'pagination': [], 'columnar': None, 'row_types': {}}
+
+	print(f"\nPer-batch latency, batch_size={batch_size}")
+	print(f"{'offset':>10} {'OFFSET ms':>10} {'keyset ms':>10}")
+	for offset, offset_ms, keyset_ms in bench_pagination(db_path, batch_size):
+		print(f"{offset:>10} {offset_ms:>10.2f} {keyset_ms:>10.2f}")
+		results['pagination'].append({'offset': offset, 'offset_ms': offset_ms, 'keyset_ms': keyset_ms})
+
+	try:
+		result = bench_columnar(db_path)
+	except ImportError:
+		print("\nnumpy is not installed, skipping the columnar benchmark")
+	else:
+		results['columnar'] = result
+		print(f"\nage > 25 filter over {rows} users ({result['matches']} matches)")
+		print(f"  row at a time:     {result['row_seconds']:.3f}s")
+		print(f"  columnar:          {result['columnar_seconds']:.3f}s "
+			f"(fetch {result['fetch_seconds']:.3f}s, build the arrays "
+			f"{result['convert_seconds']:.3f}s, mask {result['mask_seconds']:.3f}s)")
+
+	print(f"\nRow types over a {rows}-row stream")
+	print(f"{'row type':>12} {'rows/s':>10} {'bytes/row':>10}")
+	for name, (rate, memory) in bench_rows(db_path).items():
+		print(f"{name:>12} {rate:>10.0f} {memory:>10.0f}")
+		results['row_types'][name] = {'rows_per_sec': rate, 'bytes_per_row': memory}
+	return results
+
+
+def compare(results, baseline_path, tolerance):
+	"""
+	Compares rows/sec against a previous results file.
+
+	Returns:
+	    list: (rows, strategy, baseline rows/sec, current rows/sec) of every
+	        run more than tolerance slower than its baseline
+	"""
+	with open(baseline_path, 'r') as baseline_file:
+		baseline = json.load(baseline_file)
+	previous = {
+		# Older result files kept the table size under 'rows'
+		(run.get('table_rows', run.get('rows')), run['strategy']): run.get('rows_per_sec')
+		for run in baseline['runs']
+	}
+
+	regressions = []
+	for run in results['runs']:
+		before = previous.get((run['table_rows'], run['strategy']))
+		after = run.get('rows_per_sec')
+		if before and after and after < before * (1 - tolerance):
+			regressions.append((run['table_rows'], run['strategy'], before, after))
+	return regressions
+
+
+def main():
+	"""Runs the benchmark suite and writes the results as JSON"""
+	parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+	parser.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000, 10000000])
+	parser.add_argument('--batch-size', type=int, default=1000)
+	parser.add_argument('--strategies', nargs='+', choices=sorted(STRATEGIES), default=list(STRATEGIES))
+	parser.add_argument('--output', default='benchmark_results.json')
+	parser.add_argument('--baseline', help='results of a previous run to compare against')
+	parser.add_argument('--tolerance', type=float, default=0.1,
+		help='allowed rows/sec slowdown against the baseline (default 0.1)')
+	parser.add_argument('--data-dir', default='benchmark_data',
+		help='where the synthetic databases are kept between runs')
+	parser.add_argument('--micro', action='store_true', help='also run the focused comparisons')
+	parser.add_argument('--timeout', type=float, default=3600,
+		help='seconds after which a strategy run is stopped (default 3600)')
+	args = parser.parse_args()
+
+	results = {
+		'meta': {
+			'timestamp': time.time(),
+			'python': sys.version.split()[0],
+			'platform': platform.platform(),
+			'batch_size': args.batch_size,
+		},
+		'runs': [],
+		'micro': {},
+	}
+
+	for rows in args.sizes:
+		data_dir = os.path.abspath(os.path.join(args.data_dir, str(rows)))
+		db_path = prepare_database(data_dir, rows)
+
+		print(f"\n{rows} users")
+		print(f"{'strategy':>34} {'rows/s':>10} {'first ms':>9} {'p50 ms':>8} {'p99 ms':>8} {'RSS MB':>8}")
+		for name in args.strategies:
+			run = run_isolated(name, data_dir, args.batch_size, args.timeout)
+			# 'rows' is what the strategy yielded, 'table_rows' the table size
+			run.update({'table_rows': rows, 'strategy': name})
+			results['runs'].append(run)
+			if 'skipped' in run:
+				print(f"{name:>34} skipped: {run['skipped']}")
+				continue
+			if 'error' in run:
+				print(f"{name:>34} failed: {run['error']}")
+				continue
+			latency = run['batch_latency_ms']
+			print(f"{name:>34} {run['rows_per_sec']:>10.0f} {run['time_to_first_row_ms']:>9.2f} "
+				f"{latency['p50']:>8.2f} {latency['p99']:>8.2f} {run['peak_rss_mb']:>8.1f}")
+			# The generators must see every row of the table (batch_processing only keeps users above 25)
+			if name != 'batch_processing' and run['rows'] != rows:
+				print(f"{'':>34} warning: streamed {run['rows']} rows out of {rows}")
+
+		if args.micro:
+			results['micro'][str(rows)] = run_micro(db_path, rows, args.batch_size)
+
+	with open(args.output, 'w') as output_file:
+		json.dump(results, output_file, indent=2)
+	print(f"\nResults written to {args.output}")
+
+	if args.baseline:
+		regressions = compare(results, args.baseline, args.tolerance)
+		for rows, name, before, after in regressions:
+			print(f"REGRESSION {name} at {rows} rows: {before:.0f} -> {after:.0f} rows/s")
+		if regressions:
+			sys.exit(1)
+		print(f"No regression against {args.baseline}")
+
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Resumable, checkpointed batch jobs over the user_data generators.
+
+A long scan periodically saves the key of the last batch its consumer has
+finished with (the watermark) to a small JSON file. When the job is run
+again after a failure, it resumes right after that watermark instead of
+starting over from the first row.
+
+Delivery is at least once: a crash after the consumer finished a batch but
+before the watermark was saved hands that batch over again. For exactly
+once, the consumer stores the watermark itself, in the same transaction as
+its own writes, and run_checkpointed() resumes from it (see committed).
+"""
+
+import json
+import os
+import time
+
+from streaming import KEY_COLUMN
+
+
+class Checkpoint:
+	"""
+	Watermark of a batch job, persisted to a JSON file.
+
+	The file is written to a temporary file first and then renamed over the
+	previous one, so a crash while saving never leaves a corrupt checkpoint.
+	"""
+
+	def __init__(self, path):
+		self.path = path
+		self.last_key = None
+		self.batches = 0
+		self.rows = 0
+		self.done = False
+		self.load()
+
+	def load(self):
+		"""Reads the checkpoint file, if there is one"""
+		try:
+			with open(self.path, 'r') as checkpoint_file:
+				state = json.load(checkpoint_file)
+		except FileNotFoundError:
+			return
+		self.last_key = state.get('last_key')
+		self.batches = state.get('batches', 0)
+		self.rows = state.get('rows', 0)
+		self.done = state.get('done', False)
+
+	def save(self):
+		"""Writes the checkpoint file atomically"""
+		state = {
+			'last_key': self.last_key,
+			'batches': self.batches,
+			'rows': self.rows,
+			'done': self.done,
+			'updated': time.time(),
+		}
+		temp_path = f"{self.path}.tmp"
+		with open(temp_path, 'w') as checkpoint_file:
+			json.dump(state, checkpoint_file)
+			checkpoint_file.flush()
+			os.fsync(checkpoint_file.fileno())
+		os.replace(temp_path, self.path)
+
+	def reset(self):
+		"""Forgets the watermark so that the next run starts over"""
+		if os.path.exists(self.path):
+			os.remove(self.path)
+		self.last_key = None
+		self.batches = 0
+		self.rows = 0
+		self.done = False
+
+
+def run_checkpointed(make_batches, consumer, checkpoint_path, every=1,
+		key=KEY_COLUMN, skip_completed=False, committed=None):
+	"""
+	Runs a batch job that can resume where a previous run failed.
+
+	Every batch is handed to the consumer, and the watermark advances only
+	once the consumer has returned. It is saved every `every` batches and
+	when the job ends, so a new run never skips a batch the consumer did
+	not finish. Batches are delivered at least once: a crash after the
+	consumer returns and before the next save hands the unsaved batches
+	over again, one batch with every=1 and up to `every` with a larger
+	interval, so the consumer must be idempotent. If the consumer raises,
+	the watermark of the batches before it is saved and the error is
+	re-raised.
+
+	For exactly once delivery pass committed, a callable returning the last
+	key the consumer has durably stored (None before the first batch). The
+	consumer is then called as consumer(batch, last_key) and must store
+	last_key in the same transaction as its writes; the job resumes after
+	committed() rather than after the checkpoint file, so a batch the
+	consumer committed is never handed over again.
+
+	A job that completed is run again from the beginning by the next call,
+	unless skip_completed is set.
+
+	Args:
+	    make_batches: Callable taking the key to start after (None for the
+	        beginning) and returning an iterable of batches in key order,
+	        e.g. lambda after: keyset_batches(connection, 1000, after=after)
+	    consumer: Callable receiving each batch (and its last key, see
+	        committed)
+	    checkpoint_path(str): Path of the JSON checkpoint file
+	    every(int): Number of batches between two checkpoint saves
+	    key(str): Key column; rows must support row[key] (dicts,
+	        sqlite3.Row and compact records do)
+	    skip_completed(bool): Do nothing if the checkpoint says the job
+	        already completed, instead of starting a new run
+	    committed: Callable returning the last key stored by the consumer,
+	        for exactly once delivery
+
+	Returns:
+	    Checkpoint: The final checkpoint (done is True once the whole
+	        table has been processed)
+	"""
+	if every <= 0:
+		raise ValueError("Checkpoint interval must be a positive integer")
+
+	checkpoint = Checkpoint(checkpoint_path)
+	if checkpoint.done:
+		if skip_completed:
+			print(f"Job already completed ({checkpoint.rows} rows), nothing to resume")
+			return checkpoint
+		# The previous run finished: this one is a new run
+		checkpoint.reset()
+	if committed is not None:
+		# The consumer's own watermark is the one that matches its writes
+		checkpoint.last_key = committed()
+	if checkpoint.last_key is not None:
+		print(f"Resuming after {key} {checkpoint.last_key} "
+			f"({checkpoint.rows} rows already processed)")
+
+	unsaved = 0
+	try:
+		for batch in make_batches(checkpoint.last_key):
+			if not batch:
+				continue
+			last_key = batch[-1][key]
+			if committed is None:
+				consumer(batch)
+			else:
+				consumer(batch, last_key)
+
+			# The consumer is done with this batch: move the watermark
+			checkpoint.last_key = last_key
+			checkpoint.batches += 1
+			checkpoint.rows += len(batch)
+			unsaved += 1
+			if unsaved >= every:
+				checkpoint.save()
+				unsaved = 0
+		checkpoint.done = True
+	finally:
+		# Save what was finished, whether the job ended or failed
+		checkpoint.save()
+	return checkpoint
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Columnar batches for the user_data generators.
+
+Turns a batch of fetched rows into a NumPy structured array, so filters
+and aggregates can run as vectorized operations over whole columns
+instead of one Python dict at a time. Building the array walks every value
+in Python, so a single cheap filter is not faster than testing each row:
+the columnar mode pays off when several operations run over the same
+batch. Requires numpy.
+"""
+
+from decimal import Decimal
+
+import numpy as np
+
+
+def _kind(value):
+	if isinstance(value, bool):
+		return np.bool_
+	if isinstance(value, int):
+		return np.int64
+	if isinstance(value, (float, Decimal)):
+		return np.float64
+	return object
+
+
+def column_dtype(values):
+	"""
+	Picks the NumPy type used to store a column, from all of its values.
+
+	SQLite columns can hold values of different types, so every value is
+	looked at. Integers become int64, floats and MySQL DECIMALs float64,
+	and a mix of integers and floats is widened to float64 so no fraction
+	is lost. Everything else (text, NULLs, mixes) is kept as Python objects.
+	"""
+	kinds = {_kind(value) for value in values}
+	if len(kinds) == 1:
+		return kinds.pop()
+	return widest(kinds)
+
+
+def widest(dtypes):
+	"""
+	Returns the type able to hold the values of all of dtypes: int64 for
+	booleans and integers, float64 once a float is involved, else object.
+	"""
+	dtypes = {np.dtype(dtype) for dtype in dtypes}
+	if len(dtypes) == 1:
+		return dtypes.pop()
+	if dtypes <= {np.dtype(np.bool_), np.dtype(np.int64)}:
+		return np.dtype(np.int64)
+	if dtypes <= {np.dtype(np.bool_), np.dtype(np.int64), np.dtype(np.float64)}:
+		return np.dtype(np.float64)
+	return np.dtype(object)
+
+
+def batch_dtype(description, batch, previous=None):
+	"""
+	Builds the structured dtype of a batch from its cursor description.
+
+	Args:
+	    description: The cursor description the batch was fetched with
+	    batch(list): The rows of the batch, used to pick the type of
+	        each column
+	    previous: Optional dtype of the earlier batches, widened where
+	        this batch needs it (so the dtype of a stream never narrows)
+
+	Returns:
+	    numpy.dtype: One named field per column
+	"""
+	columns = list(zip(*batch)) if batch else [()] * len(description)
+	fields = []
+	for position, (column, values) in enumerate(zip(description, columns)):
+		dtype = column_dtype(values)
+		if previous is not None:
+			dtype = widest((dtype, previous[position]))
+		fields.append((column[0], dtype))
+	return np.dtype(fields)
+
+
+def to_columnar(batch, description, dtype=None):
+	"""
+	Converts a batch of tuple rows into a NumPy structured array.
+
+	Args:
+	    batch(list): Rows as tuples, in cursor description order
+	    description: The cursor description the batch was fetched with
+	    dtype: Optional dtype to reuse (see batch_dtype)
+
+	Returns:
+	    numpy.ndarray: Structured array, one field per column
+	        (array['age'] is the age column)
+	"""
+	if not isinstance(batch[0], tuple):
+		batch = [tuple(row) for row in batch]
+	if dtype is None:
+		dtype = batch_dtype(description, batch)
+	return np.array(batch, dtype=dtype)
+
+
+def column_dict(array):
+	"""Returns a structured array as a dict of column arrays"""
+	return {name: array[name] for name in array.dtype.names}
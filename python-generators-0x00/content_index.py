@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Local index of user_id -> content hash, used to re-seed incrementally.
+
+The index lives in a small SQLite sidecar file next to the CSV. It holds a
+16-byte BLAKE2b digest of every user row last written to the database, so
+a re-seed can tell new and changed rows from unchanged ones without asking
+the database server, and only send the rows that differ. It also keeps a
+fingerprint of the whole table as of the last sync, to notice when the
+table was changed by something else and the hashes can no longer be
+trusted.
+"""
+
+import hashlib
+import sqlite3
+
+# Default path of the sidecar file
+INDEX_PATH = 'user_data.hashes.db'
+
+# Number of user_ids looked up per query (below SQLite's parameter limit)
+LOOKUP_CHUNK = 500
+
+
+def content_hash(record):
+	"""
+	Hashes the content of a [user_id, name, email, age] record.
+
+	Values are normalized to stripped strings, so '42' and ' 42' hash the
+	same, and separated by a byte that does not occur in CSV text.
+
+	Returns:
+	    bytes: 16-byte digest
+	"""
+	content = '\x1f'.join(str(value).strip() for value in record[1:])
+	return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+
+class ContentIndex:
+	"""
+	user_id -> content hash index stored in a SQLite file.
+
+	Args:
+	    path(str): Path of the sidecar file (created if missing)
+	"""
+
+	def __init__(self, path=INDEX_PATH):
+		self.path = path
+		self.connection = sqlite3.connect(path)
+		self.connection.execute("""
+			CREATE TABLE IF NOT EXISTS content_hashes (
+				user_id TEXT PRIMARY KEY,
+				hash BLOB NOT NULL
+			) WITHOUT ROWID
+		""")
+		self.connection.execute("""
+			CREATE TABLE IF NOT EXISTS index_meta (
+				name TEXT PRIMARY KEY,
+				value TEXT NOT NULL
+			) WITHOUT ROWID
+		""")
+		self.connection.commit()
+
+	def __len__(self):
+		return self.connection.execute("SELECT COUNT(*) FROM content_hashes").fetchone()[0]
+
+	def lookup(self, user_ids):
+		"""
+		Returns the stored hashes of the given user_ids.
+
+		Returns:
+		    dict: {user_id: hash} for the user_ids that are indexed
+		"""
+		user_ids = list(user_ids)
+		hashes = {}
+		for start in range(0, len(user_ids), LOOKUP_CHUNK):
+			part = user_ids[start:start + LOOKUP_CHUNK]
+			marks = ', '.join('?' * len(part))
+			hashes.update(self.connection.execute(
+				f"SELECT user_id, hash FROM content_hashes WHERE user_id IN ({marks})",
+				part))
+		return hashes
+
+	def update(self, pairs):
+		"""Stores (user_id, hash) pairs and commits them"""
+		self.connection.executemany(
+			"INSERT OR REPLACE INTO content_hashes (user_id, hash) VALUES (?, ?)",
+			pairs)
+		self.connection.commit()
+
+	def clear(self):
+		"""Forgets every hash, e.g. when the database was emptied"""
+		self.connection.execute("DELETE FROM content_hashes")
+		self.connection.execute("DELETE FROM index_meta WHERE name = 'fingerprint'")
+		self.connection.commit()
+
+	def fingerprint(self):
+		"""Returns the table fingerprint saved by set_fingerprint(), or None"""
+		row = self.connection.execute(
+			"SELECT value FROM index_meta WHERE name = 'fingerprint'").fetchone()
+		return row[0] if row else None
+
+	def set_fingerprint(self, fingerprint):
+		"""Saves the fingerprint of the table the hashes describe"""
+		self.connection.execute(
+			"INSERT OR REPLACE INTO index_meta (name, value) VALUES ('fingerprint', ?)",
+			(fingerprint,))
+		self.connection.commit()
+
+	def close(self):
+		self.connection.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+		return False
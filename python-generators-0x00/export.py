@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Columnar export of user_data streams to Arrow IPC or Parquet files.
+
+Batches from the streaming generators are converted to Arrow record
+batches and written out as they arrive, one row group at a time, so the
+table is never materialized in memory. The files can then be read back
+memory-mapped by downstream jobs without touching the database.
+Requires pyarrow.
+
+Usage:
+    python3 export.py users.parquet [parquet|arrow] [compression]
+"""
+
+import sys
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from streaming import connect, describe, is_sqlite, keyset_batches, TABLE_NAME
+
+FORMATS = ('parquet', 'arrow')
+
+
+def arrow_type(declared):
+	"""
+	Picks the Arrow type of a column from its declared SQL type, following
+	SQLite's affinity rules (which also cover the MySQL type names).
+	DECIMAL and NUMERIC columns become float64, like in columnar.py.
+
+	Args:
+	    declared(str): Declared type, e.g. 'INTEGER' or 'decimal(5,2)'
+
+	Returns:
+	    pyarrow.DataType: The column's type, or None if it cannot be told
+	        from the declaration (no type, or an unknown one)
+	"""
+	declared = (declared or '').lower()
+	if 'int' in declared:
+		return pa.int64()
+	if 'char' in declared or 'clob' in declared or 'text' in declared:
+		return pa.string()
+	if 'blob' in declared or 'binary' in declared:
+		return pa.binary()
+	if any(name in declared for name in ('real', 'floa', 'doub', 'dec', 'numeric')):
+		return pa.float64()
+	if declared.startswith('bool'):
+		return pa.bool_()
+	return None
+
+
+def declared_types(connection, table_name=TABLE_NAME):
+	"""
+	Reads the declared type of every column of a table.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    table_name(str): Table to look up
+
+	Returns:
+	    dict: Declared type by column name
+	"""
+	cursor = connection.cursor()
+	try:
+		if is_sqlite(connection):
+			cursor.execute(f"PRAGMA table_info({table_name})")
+			return {row[1]: row[2] for row in cursor.fetchall()}
+		cursor.execute(
+			"SELECT COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS "
+			"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table_name,))
+		return {name: declared for name, declared in cursor.fetchall()}
+	finally:
+		cursor.close()
+
+
+def storage_type(classes):
+	"""
+	Picks the Arrow type able to hold every value of a SQLite column,
+	from the storage classes found in it (see typeof()). Integers and
+	reals mixed become float64; text mixed with anything else, text.
+
+	Args:
+	    classes: Storage classes, e.g. {'integer', 'real', 'null'}
+
+	Returns:
+	    pyarrow.DataType: The column's type, or None for a column with
+	        no value (empty or only NULLs)
+	"""
+	classes = set(classes) - {'null'}
+	if not classes:
+		return None
+	if classes == {'integer'}:
+		return pa.int64()
+	if classes <= {'integer', 'real'}:
+		return pa.float64()
+	if classes == {'blob'}:
+		return pa.binary()
+	return pa.string()
+
+
+def column_types(connection, columns, table_name=TABLE_NAME):
+	"""
+	Picks the Arrow type of each column of a table, so that every row
+	group of an export has the same schema.
+
+	MySQL enforces the declared types, which are used as they are. SQLite
+	does not (an INTEGER column can hold 30.5 or text), so the storage
+	classes actually found in each column are used, at the cost of one
+	pass over the table, and the declared type only for columns without
+	any value.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    columns: Column names
+	    table_name(str): Table to look up
+
+	Returns:
+	    list: Arrow type of each column (None if it cannot be told)
+	"""
+	declared = declared_types(connection, table_name)
+	types = [arrow_type(declared.get(column)) for column in columns]
+	if not is_sqlite(connection):
+		return types
+	found = connection.execute("SELECT " + ", ".join(
+		f"GROUP_CONCAT(DISTINCT typeof({column}))" for column in columns)
+		+ f" FROM {table_name}").fetchone()
+	return [storage_type(classes.split(',') if classes else ()) or column_type
+		for classes, column_type in zip(found, types)]
+
+
+def column_array(values, column_type=None):
+	"""
+	Converts the values of one column into an Arrow array of column_type.
+
+	The values are converted with the type Arrow infers for them, then
+	cast with a safe cast, which refuses anything that would lose data (a
+	fraction cast to an integer, an integer too large for a float...).
+	SQLite does not enforce declared types, so text columns also accept
+	other values, stored as their text.
+
+	Raises:
+	    ValueError: If the values do not fit column_type
+	"""
+	if column_type is None:
+		return pa.array(values)
+	if pa.types.is_string(column_type):
+		values = [value if value is None or isinstance(value, str) else str(value)
+			for value in values]
+	try:
+		return pa.array(values).cast(column_type)
+	except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as error:
+		raise ValueError(f"Values do not fit the column type {column_type}: {error}") from error
+
+
+class ColumnarWriter:
+	"""
+	Streams rows into an Arrow IPC or Parquet file, row group by row group.
+
+	Rows are buffered until row_group_size of them are waiting, then
+	written as one row group (one record batch for Arrow IPC). Memory is
+	bounded by row_group_size rows.
+
+	The schema of a file is fixed once it is started, so the type of each
+	column should be given (see column_types()): it is then used for every
+	row group, and values that do not fit raise ValueError instead of
+	being truncated. Columns without a type take the type Arrow infers
+	from the first row group (text if it only holds NULLs). A stream
+	without any row still gets a file, with the schema and no row group.
+
+	Args:
+	    path(str): File to write
+	    columns: Column names, in row order
+	    file_format(str): 'parquet' or 'arrow' (Arrow IPC file)
+	    compression(str): Codec, e.g. 'zstd', 'snappy', 'gzip' (Parquet),
+	        'zstd' or 'lz4' (Arrow IPC), or None
+	    row_group_size(int): Number of rows per row group
+	    types: Optional Arrow type of each column, in column order (None
+	        entries are inferred)
+	"""
+
+	def __init__(self, path, columns, file_format='parquet', compression='zstd',
+			row_group_size=100000, types=None):
+		if file_format not in FORMATS:
+			raise ValueError(f"Unknown export format {file_format!r}, expected one of {FORMATS}")
+		if row_group_size <= 0:
+			raise ValueError("Row group size must be a positive integer")
+
+		self.path = path
+		self.columns = list(columns)
+		self.file_format = file_format
+		self.compression = None if compression in (None, 'none') else compression
+		self.row_group_size = row_group_size
+		self.types = list(types) if types is not None else [None] * len(self.columns)
+		if len(self.types) != len(self.columns):
+			raise ValueError("Expected one type per column")
+		self.schema = None
+		self.rows_written = 0
+		self._pending = []
+		self._writer = None
+
+	def write_rows(self, rows):
+		"""Adds rows (tuples, dicts, sqlite3.Row or compact records)"""
+		for row in rows:
+			self._pending.append(tuple(row.values()) if isinstance(row, dict) else row)
+		while len(self._pending) >= self.row_group_size:
+			group = self._pending[:self.row_group_size]
+			del self._pending[:self.row_group_size]
+			self._write_group(group)
+
+	def _open(self, types):
+		"""Starts the file with one column of each of types"""
+		self.schema = pa.schema([pa.field(name, column_type)
+			for name, column_type in zip(self.columns, types)])
+		if self.file_format == 'parquet':
+			self._writer = pq.ParquetWriter(self.path, self.schema,
+				compression=self.compression or 'none')
+		else:
+			options = pa.ipc.IpcWriteOptions(compression=self.compression)
+			self._writer = pa.ipc.new_file(self.path, self.schema, options=options)
+
+	def _write_group(self, rows):
+		values = list(zip(*rows))
+		types = self.schema.types if self.schema is not None else self.types
+		arrays = [column_array(column, column_type)
+			for column, column_type in zip(values, types)]
+
+		if self._writer is None:
+			# The first row group fixes the types left to infer
+			self._open([pa.string() if pa.types.is_null(array.type) else array.type
+				for array in arrays])
+			arrays = [array.cast(column_type)
+				for array, column_type in zip(arrays, self.schema.types)]
+		batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+		if self.file_format == 'parquet':
+			self._writer.write_batch(batch, row_group_size=len(rows))
+		else:
+			self._writer.write_batch(batch)
+		self.rows_written += len(rows)
+
+	def close(self):
+		"""Writes the last, partial row group and finishes the file"""
+		if self._pending:
+			self._write_group(self._pending)
+			self._pending = []
+		if self._writer is None and self.schema is None:
+			# No row at all: still write the file, with its schema
+			self._open([pa.string() if column_type is None else column_type
+				for column_type in self.types])
+		if self._writer is not None:
+			self._writer.close()
+			self._writer = None
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, exc_type, exc_value, traceback):
+		if exc_type is not None:
+			# Finish the file with the row groups already written
+			self._pending = []
+		self.close()
+		return False
+
+
+def export_batches(batches, path, columns, file_format='parquet',
+		compression='zstd', row_group_size=100000, types=None):
+	"""
+	Writes a stream of batches (lists of rows) to a columnar file.
+
+	Returns:
+	    int: Number of rows written
+	"""
+	with ColumnarWriter(path, columns, file_format, compression, row_group_size,
+			types) as writer:
+		for batch in batches:
+			writer.write_rows(batch)
+	return writer.rows_written
+
+
+def export_users(path, file_format='parquet', compression='zstd',
+		row_group_size=100000, batch_size=10000, connection=None,
+		table_name=TABLE_NAME):
+	"""
+	Exports the whole user_data table to an Arrow IPC or Parquet file.
+
+	Args:
+	    path(str): File to write
+	    file_format(str): 'parquet' or 'arrow'
+	    compression(str): Compression codec, or None
+	    row_group_size(int): Number of rows per row group
+	    batch_size(int): Number of rows fetched per query
+	    connection: Optional open connection (sqlite3 or mysql.connector);
+	        user_data.db is used by default
+
+	Returns:
+	    int: Number of rows written
+	"""
+	own_connection = connection is None
+	if own_connection:
+		connection = connect()
+	try:
+		columns = [column[0] for column in describe(connection, table_name)]
+		types = column_types(connection, columns, table_name)
+		batches = keyset_batches(connection, batch_size, table_name)
+		return export_batches(batches, path, columns, file_format, compression,
+			row_group_size, types)
+	finally:
+		if own_connection:
+			connection.close()
+
+
+def read_export(path):
+	"""
+	Reads an exported file back, memory-mapped.
+
+	Uncompressed Arrow IPC files are read zero-copy: the column data stays
+	in the mapped file pages instead of being copied into memory. Parquet
+	and compressed Arrow IPC files are decoded from the mapped file.
+
+	Returns:
+	    pyarrow.Table: The exported rows
+	"""
+	if path.endswith('.parquet'):
+		return pq.read_table(path, memory_map=True)
+	# The table's buffers keep the mapping alive as long as they are used
+	source = pa.memory_map(path, 'r')
+	return pa.ipc.open_file(source).read_all()
+
+
+if __name__ == "__main__":
+	if len(sys.argv) < 2:
+		print(__doc__.split('Usage:')[1].strip())
+		sys.exit(1)
+	output = sys.argv[1]
+	export_format = sys.argv[2] if len(sys.argv) > 2 else 'parquet'
+	codec = sys.argv[3] if len(sys.argv) > 3 else 'zstd'
+	written = export_users(output, export_format, codec)
+	print(f"Exported {written} users to {output}")
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""
+Parallel scans of the user_data table over key-range partitions.
+
+The table is split into key ranges, each range is scanned by a worker
+process over its own read-only connection, and the workers' filtered
+output is merged back into a single stream, in key order or in whichever
+order the partitions finish. Ranges are scanned in chunks of a bounded
+number of rows and only a few chunks are in flight at once, so the
+parent's memory stays bounded however large the table is. Column
+statistics are computed the same way, each worker returning a partial
+StreamStats that is merged into the total.
+"""
+
+import functools
+import os
+from collections import deque
+from concurrent.futures import (ProcessPoolExecutor, as_completed, wait,
+		FIRST_COMPLETED)
+
+from stats import StreamStats
+from streaming import (connect_readonly, keyset_batches, placeholder,
+		stream_cursor, DATABASE_PATH, KEY_COLUMN, TABLE_NAME)
+
+
+def partition_bounds(connection, partitions, table_name=TABLE_NAME, key=KEY_COLUMN):
+	"""
+	Splits a table into contiguous key ranges of roughly equal size.
+
+	Integer keys are split evenly between MIN and MAX. Other keys (like the
+	UUID user_id) are split on sampled boundaries: the key found at each
+	quantile of the index, which also keeps the ranges balanced when the
+	keys are not evenly spread.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    partitions(int): Number of ranges wanted
+	    table_name(str): Table to split
+	    key(str): Unique, indexed column to split on
+
+	Returns:
+	    list: (after, until) tuples; a range holds the keys greater than
+	        after and up to until, None meaning unbounded
+	"""
+	if partitions <= 0:
+		raise ValueError("Number of partitions must be a positive integer")
+
+	cursor = connection.cursor()
+	try:
+		cursor.execute(f"SELECT MIN({key}), MAX({key}), COUNT(*) FROM {table_name}")
+		low, high, total = cursor.fetchone()
+		if not total:
+			return []
+		# No more ranges than rows: each bound below is then a real row
+		partitions = min(partitions, total)
+
+		bounds = []
+		if isinstance(low, int) and isinstance(high, int):
+			step = (high - low + 1) / partitions
+			bounds = [low - 1 + round(step * i) for i in range(1, partitions)]
+		else:
+			mark = placeholder(connection)
+			for i in range(1, partitions):
+				cursor.execute(
+					f"SELECT {key} FROM {table_name} ORDER BY {key} LIMIT 1 OFFSET {mark}",
+					(total * i // partitions - 1,))
+				row = cursor.fetchone()
+				if row is not None:
+					bounds.append(row[0])
+	finally:
+		cursor.close()
+
+	# Drop duplicates so that no range is empty by construction
+	bounds = sorted(set(bounds))
+	edges = [None] + bounds + [None]
+	return list(zip(edges[:-1], edges[1:]))
+
+
+def scan_partition(connection_factory, after, until, batch_size=1000,
+		min_age=25, table_name=TABLE_NAME, key=KEY_COLUMN, max_rows=None):
+	"""
+	Scans one key range, or its next max_rows rows, and keeps the users
+	older than min_age.
+
+	Runs inside a worker process, over a connection of its own.
+
+	Returns:
+	    tuple: (matches, last_key, finished): the matching users, as dicts,
+	        in key order, the last key scanned and whether the range is
+	        over (otherwise scan the rest of it after last_key)
+	"""
+	connection = connection_factory()
+	try:
+		cursor = stream_cursor(connection, dictionary=True)
+		matches = []
+		scanned = 0
+		last_key = after
+		finished = True
+		for batch in keyset_batches(connection, batch_size, table_name, key,
+				after=after, cursor=cursor, until=until):
+			for user in batch:
+				if user['age'] > min_age:
+					matches.append(user)
+			last_key = batch[-1][key]
+			scanned += len(batch)
+			# A full page may be followed by more rows: stop here for now
+			if max_rows is not None and scanned >= max_rows and len(batch) == batch_size:
+				finished = False
+				break
+		cursor.close()
+		return matches, last_key, finished
+	finally:
+		connection.close()
+
+
+def scan_partition_stats(connection_factory, after, until, column,
+		batch_size=1000, histogram_edges=None, table_name=TABLE_NAME,
+		key=KEY_COLUMN):
+	"""
+	Computes the statistics of one column over one key range.
+
+	Runs inside a worker process, over a connection of its own.
+
+	Returns:
+	    StreamStats: The partial statistics of the range
+	"""
+	connection = connection_factory()
+	try:
+		state = StreamStats(histogram_edges)
+		for batch in keyset_batches(connection, batch_size, table_name, key,
+				columns=f"{key}, {column}", after=after, until=until):
+			for _, value in batch:
+				state.update(value)
+		return state
+	finally:
+		connection.close()
+
+
+def _partition_ranges(connection_factory, partitions, table_name, key):
+	"""Opens one connection to split the table into key ranges"""
+	connection = connection_factory()
+	try:
+		return partition_bounds(connection, partitions, table_name, key)
+	finally:
+		connection.close()
+
+
+class _Partition:
+	"""A key range being scanned chunk by chunk, and its chunks in flight"""
+
+	__slots__ = ('after', 'until', 'chunks', 'finished')
+
+	def __init__(self, after, until):
+		self.after = after
+		self.until = until
+		# Futures of the chunks submitted and not yielded yet, in key order
+		self.chunks = deque()
+		# Whether the whole range has been submitted
+		self.finished = False
+
+
+def parallel_batch_processing(batch_size, workers=None, ordered=True,
+		partitions=None, min_age=25, connection_factory=None,
+		table_name=TABLE_NAME, key=KEY_COLUMN, chunk_rows=None,
+		max_in_flight=None):
+	"""
+	Generator that filters users older than min_age with a pool of processes.
+
+	Each key range is scanned in chunks of about chunk_rows rows, each
+	chunk resuming after the last key of the previous one. At most
+	max_in_flight chunks are running or waiting to be yielded at any time,
+	and new ones are submitted as results are consumed, so memory is
+	bounded by the chunks in flight rather than the size of the table.
+
+	Args:
+	    batch_size(int): Number of users each worker fetches per query
+	    workers(int): Number of worker processes (defaults to the CPU count)
+	    ordered(bool): Yield chunks in key order. When False they are
+	        yielded as soon as they are done
+	    partitions(int): Number of key ranges (defaults to 4 per worker, so
+	        fast workers pick up more ranges and results arrive in pieces)
+	    min_age: Users must be strictly older than this
+	    connection_factory: Picklable callable returning a new read-only
+	        connection, called once per chunk in a worker. Defaults to a
+	        read-only connection to user_data.db; pass e.g.
+	        seed.connect_to_prodev to scan MySQL
+	    table_name(str): Table to scan
+	    key(str): Unique, indexed column to partition on
+	    chunk_rows(int): Number of rows a worker scans per chunk (defaults
+	        to 10 batches)
+	    max_in_flight(int): Number of chunks running or done but not
+	        consumed yet (defaults to 2 per worker)
+
+	Yields:
+	    list: The matching users of one chunk
+	"""
+	if batch_size <= 0:
+		raise ValueError("Batch size must be a positive integer")
+
+	if connection_factory is None:
+		connection_factory = functools.partial(connect_readonly, DATABASE_PATH)
+	workers = workers or os.cpu_count() or 1
+	partitions = partitions or workers * 4
+	chunk_rows = chunk_rows or batch_size * 10
+	max_in_flight = max_in_flight or workers * 2
+
+	pending = deque(_Partition(after, until) for after, until in
+			_partition_ranges(connection_factory, partitions, table_name, key))
+	in_flight = 0
+
+	def submit():
+		"""Submits the next chunks, earliest ranges first, up to max_in_flight"""
+		nonlocal in_flight
+		for partition in pending:
+			if in_flight >= max_in_flight:
+				return
+			if partition.finished:
+				continue
+			after = partition.after
+			if partition.chunks:
+				# The next chunk starts where the last submitted one ended
+				last = partition.chunks[-1]
+				if not last.done():
+					continue
+				_, after, finished = last.result()
+				if finished:
+					partition.finished = True
+					continue
+			partition.chunks.append(executor.submit(scan_partition,
+				connection_factory, after, partition.until, batch_size,
+				min_age, table_name, key, chunk_rows))
+			in_flight += 1
+
+	def take(partition):
+		"""Returns the matches of the first chunk of a partition (done)"""
+		nonlocal in_flight
+		matches, last_key, finished = partition.chunks.popleft().result()
+		in_flight -= 1
+		if not partition.chunks:
+			partition.after = last_key
+			partition.finished = partition.finished or finished
+		return matches
+
+	def wait_any():
+		wait([chunk for partition in pending for chunk in partition.chunks
+				if not chunk.done()], return_when=FIRST_COMPLETED)
+
+	executor = ProcessPoolExecutor(max_workers=workers)
+	try:
+		while pending:
+			submit()
+			if ordered:
+				partition = pending[0]
+				if not partition.chunks:
+					if partition.finished:
+						pending.popleft()
+					continue
+				while not partition.chunks[0].done():
+					# Keep the other workers busy meanwhile
+					wait_any()
+					submit()
+				matches = take(partition)
+				if matches:
+					yield matches
+				continue
+
+			ready = [partition for partition in pending
+				if partition.chunks and partition.chunks[0].done()]
+			if not ready:
+				wait_any()
+				continue
+			for partition in ready:
+				matches = take(partition)
+				if matches:
+					yield matches
+			pending = deque(partition for partition in pending
+				if partition.chunks or not partition.finished)
+	finally:
+		# Drop the chunks nobody will read if the consumer stops early
+		executor.shutdown(wait=True, cancel_futures=True)
+
+
+def parallel_stats(column, workers=None, partitions=None, histogram_edges=None,
+		batch_size=1000, connection_factory=None, table_name=TABLE_NAME,
+		key=KEY_COLUMN):
+	"""
+	Computes the statistics of a column with a pool of processes.
+
+	Each worker computes a partial StreamStats over its key ranges and the
+	partial states are merged as they come back.
+
+	Args:
+	    column(str): Numeric column to summarize
+	    workers(int): Number of worker processes (defaults to the CPU count)
+	    partitions(int): Number of key ranges (defaults to 4 per worker)
+	    histogram_edges: Optional bucket edges for the histogram
+	    batch_size(int): Number of rows each worker fetches per query
+	    connection_factory: Picklable callable returning a new read-only
+	        connection (see parallel_batch_processing)
+	    table_name(str): Table to scan
+	    key(str): Unique, indexed column to partition on
+
+	Returns:
+	    StreamStats: The statistics of the whole column
+	"""
+	if connection_factory is None:
+		connection_factory = functools.partial(connect_readonly, DATABASE_PATH)
+	workers = workers or os.cpu_count() or 1
+	partitions = partitions or workers * 4
+
+	ranges = _partition_ranges(connection_factory, partitions, table_name, key)
+
+	result = StreamStats(histogram_edges)
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [
+			executor.submit(scan_partition_stats, connection_factory, after,
+				until, column, batch_size, histogram_edges, table_name, key)
+			for after, until in ranges
+		]
+		for future in as_completed(futures):
+			result.merge(future.result())
+	return result
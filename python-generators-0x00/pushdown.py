@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Predicate and projection pushdown for the user_data generators.
+
+A Selection lists the columns a pipeline needs and the predicates its rows
+must match:
+
+    Selection(columns=('user_id', 'age'), where=[('age', '>', 25)])
+
+Predicates are (column, operator, value) tuples, all of which must hold.
+Those written with a SQL operator are compiled into a parameterized WHERE
+clause, and the column list into the SELECT clause, so rows that do not
+match (and columns that are not needed) never leave the database, which
+can also use an index on the filtered column. Predicates it cannot push
+down (Python-only operators or a callable) are applied to the fetched rows
+in Python instead.
+"""
+
+import operator
+import re
+
+from streaming import describe, keyset_batches, placeholder, row_key, KEY_COLUMN, TABLE_NAME
+
+# Operators compiled into SQL, with the Python equivalent used by matches()
+SQL_OPERATORS = {
+	'=': operator.eq,
+	'!=': operator.ne,
+	'<': operator.lt,
+	'<=': operator.le,
+	'>': operator.gt,
+	'>=': operator.ge,
+	'in': lambda value, values: value in values,
+	'not in': lambda value, values: value not in values,
+	'is null': lambda value, _: value is None,
+	'is not null': lambda value, _: value is not None,
+}
+
+# Operators only evaluated in Python
+PYTHON_OPERATORS = {
+	'startswith': lambda value, prefix: value is not None and value.startswith(prefix),
+	'endswith': lambda value, suffix: value is not None and value.endswith(suffix),
+	'contains': lambda value, part: value is not None and part in value,
+	'regex': lambda value, pattern: value is not None and re.search(pattern, value) is not None,
+}
+
+_IDENTIFIER = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+def _column(name):
+	"""Checks that a column name is a plain identifier before it goes into SQL"""
+	if not isinstance(name, str) or not _IDENTIFIER.match(name):
+		raise ValueError(f"Invalid column name {name!r}")
+	return name
+
+
+def _predicate(predicate):
+	"""Normalizes a predicate to (column, operator, value)"""
+	if len(predicate) == 2:
+		column, op = predicate
+		value = None
+	else:
+		column, op, value = predicate
+	if isinstance(op, str):
+		op = op.lower()
+		if op not in SQL_OPERATORS and op not in PYTHON_OPERATORS:
+			raise ValueError(f"Unknown operator {op!r}")
+		if op in ('in', 'not in'):
+			value = tuple(value)
+	elif not callable(op):
+		raise ValueError(f"Operator must be a string or a callable, got {op!r}")
+	return _column(column), op, value
+
+
+class Selection:
+	"""
+	Columns to fetch and predicates to filter rows by.
+
+	Args:
+	    columns: Column names to fetch (None fetches every column)
+	    where: Predicates, all of which must hold. Each is a tuple
+	        (column, operator, value) where operator is one of SQL_OPERATORS
+	        (pushed down), one of PYTHON_OPERATORS, or a callable taking the
+	        column value and returning a bool (both applied in Python).
+	        'is null' and 'is not null' take no value.
+	"""
+
+	def __init__(self, columns=None, where=()):
+		self.columns = None if columns is None else tuple(_column(c) for c in columns)
+		self.predicates = [_predicate(predicate) for predicate in where]
+
+	@staticmethod
+	def _pushable(predicate):
+		op = predicate[1]
+		return isinstance(op, str) and op in SQL_OPERATORS
+
+	def pushed(self):
+		"""Predicates compiled into SQL"""
+		return [p for p in self.predicates if self._pushable(p)]
+
+	def residual(self):
+		"""Predicates applied in Python"""
+		return [p for p in self.predicates if not self._pushable(p)]
+
+	def select(self, key=KEY_COLUMN):
+		"""
+		SELECT list of the selection.
+
+		The key column (needed to seek the next page) and the columns of
+		the Python predicates are added when they are not selected; the key
+		column comes first.
+		"""
+		if self.columns is None:
+			return '*'
+		columns = list(self.columns)
+		for column in [column for column, _, _ in self.residual()]:
+			if column not in columns:
+				columns.append(column)
+		if key not in columns:
+			columns.insert(0, key)
+		return ', '.join(columns)
+
+	def where(self, mark):
+		"""
+		Parameterized WHERE condition of the pushed-down predicates.
+
+		Args:
+		    mark(str): Parameter marker of the driver ('?' or '%s')
+
+		Returns:
+		    tuple: (condition, params), or None if nothing is pushed down
+		"""
+		conditions = []
+		params = []
+		for column, op, value in self.pushed():
+			if op in ('is null', 'is not null'):
+				conditions.append(f"{column} {op.upper()}")
+			elif op in ('in', 'not in'):
+				if not value:
+					# Nothing is IN an empty list; everything is NOT IN it
+					conditions.append('1 = 0' if op == 'in' else '1 = 1')
+					continue
+				marks = ', '.join([mark] * len(value))
+				conditions.append(f"{column} {op.upper()} ({marks})")
+				params.extend(value)
+			else:
+				conditions.append(f"{column} {op} {mark}")
+				params.append(value)
+		if not conditions:
+			return None
+		return ' AND '.join(conditions), tuple(params)
+
+	def matcher(self, description):
+		"""
+		Returns a function telling whether a fetched row matches the
+		Python predicates, or None if there are none.
+
+		Args:
+		    description: The cursor description the rows are fetched with
+		"""
+		residual = self.residual()
+		if not residual:
+			return None
+
+		tests = []
+		for column, op, value in residual:
+			if callable(op):
+				tests.append((column, lambda v, _, test=op: bool(test(v)), value))
+			else:
+				tests.append((column, PYTHON_OPERATORS[op], value))
+
+		def matches(row):
+			return all(test(row_key(row, column, description), value)
+				for column, test, value in tests)
+
+		return matches
+
+	def matches(self, row, description=None):
+		"""
+		Evaluates every predicate on a row in Python.
+
+		Args:
+		    row: A dict, sqlite3.Row or compact record (tuples need the
+		        cursor description)
+		    description: The cursor description of tuple rows
+		"""
+		for column, op, value in self.predicates:
+			field = row_key(row, column, description)
+			if callable(op):
+				if not op(field):
+					return False
+			elif op in SQL_OPERATORS:
+				if op not in ('is null', 'is not null') and field is None:
+					# NULL never compares true in SQL
+					return False
+				if not SQL_OPERATORS[op](field, value):
+					return False
+			elif not PYTHON_OPERATORS[op](field, value):
+				return False
+		return True
+
+
+def select_batches(connection, batch_size, selection, table_name=TABLE_NAME,
+		key=KEY_COLUMN, after=None, cursor=None, compact=False, sizer=None):
+	"""
+	Generator that walks a table in keyset pages, fetching only the
+	selected columns and the rows that match the selection.
+
+	The pushed-down predicates go into each page's WHERE clause; the
+	others filter the fetched pages in Python, and pages left empty are
+	skipped.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    batch_size(int): Number of rows to fetch per page
+	    selection(Selection): Columns and predicates
+	    table_name(str): Table to read from
+	    key(str): Unique, indexed column used to order and seek the pages
+	    after: Optional key to start after (None starts from the beginning)
+	    cursor: Optional cursor to reuse for every page
+	    compact(bool): Yield rows as compact records (see rows.py)
+	    sizer: Optional adaptive.AdaptiveBatchSize
+
+	Yields:
+	    list: One page of matching rows at a time
+	"""
+	columns = selection.select(key)
+	where = selection.where(placeholder(connection))
+	matches = None
+	if selection.residual():
+		matches = selection.matcher(describe(connection, table_name, columns))
+
+	for batch in keyset_batches(connection, batch_size, table_name, key, columns,
+			after, cursor, compact=compact, sizer=sizer, where=where):
+		if matches is not None:
+			batch = [row for row in batch if matches(row)]
+			if not batch:
+				continue
+		yield batch
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Compact row type for the user_data generators.
+
+Instead of a fresh dict per row, rows can be built as instances of a
+tuple-based record class generated once per result schema. Records have
+no per-instance __dict__ (only __slots__ = ()), so they take about as much
+memory as a plain tuple, while still supporting index (row[0]), key
+(row['age']) and attribute (row.age) access.
+"""
+
+import functools
+from collections import namedtuple
+
+
+@functools.lru_cache(maxsize=None)
+def record_class(columns):
+	"""
+	Returns the record class of a result schema, creating it on first use.
+
+	Args:
+	    columns(tuple): Column names, in cursor description order
+
+	Returns:
+	    type: A namedtuple subclass with key access by column name
+	"""
+	base = namedtuple('Record', columns, rename=True)
+	index = {name: position for position, name in enumerate(columns)}
+
+	class Record(base):
+		__slots__ = ()
+		_index = index
+
+		def __getitem__(self, key):
+			if isinstance(key, str):
+				return tuple.__getitem__(self, self._index[key])
+			return tuple.__getitem__(self, key)
+
+		def __contains__(self, key):
+			# Like a dict row: 'age' in row tests for a column, not a value
+			return key in self._index
+
+		def keys(self):
+			"""Column names, like dict.keys()"""
+			return self._index.keys()
+
+		def get(self, key, default=None):
+			"""Value of a column, or default if there is no such column"""
+			position = self._index.get(key)
+			return default if position is None else tuple.__getitem__(self, position)
+
+	return Record
+
+
+def record_maker(description):
+	"""
+	Returns a fast constructor of records from the tuples of a cursor.
+
+	Args:
+	    description: The cursor description the rows are fetched with
+
+	Returns:
+	    callable: Builds one record from one tuple row
+	"""
+	cls = record_class(tuple(column[0] for column in description))
+	return functools.partial(tuple.__new__, cls)
+
+
+def compact_rows(rows, description):
+	"""Converts a list of tuple (or dict) rows into a list of records"""
+	make = record_maker(description)
+	if rows and isinstance(rows[0], dict):
+		return [make(row.values()) for row in rows]
+	return [make(row) for row in rows]
@@ -1,9 +1,23 @@
 import mysql.connector
+import sqlite3
 import uuid
 import csv
 import os
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
 from mysql.connector import Error
 
+from aggregates import ensure_age_aggregates
+from checkpoint import run_checkpointed
+from content_index import content_hash, ContentIndex, INDEX_PATH
+from streaming import is_sqlite, keyset_batches, prefetch, stream_rows
+
+# Namespace of the user_ids derived from emails (see user_id_for)
+USER_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_DNS, 'users.alx-prodev')
+
 
 def connect_db():
 	"""Connects to the MySQL database server"""
@@ -29,14 +43,19 @@ def create_database(connection):
 	except Error as e:
 		print(f"Error while creating database: {e}")
 
-def connect_to_prodev():
-	"""Connects to the ALX_prodev database in MySQL"""
+def connect_to_prodev(allow_local_infile=False):
+	"""Connects to the ALX_prodev database in MySQL
+
+	Args:
+	    allow_local_infile: Allow LOAD DATA LOCAL INFILE on this connection
+	        (needed by load_data_infile)"""
 	try:
 		connection = mysql.connector.connect(
 			host = 'localhost',
 			user = 'root',
 			password = 'password', #Replace with your MySQL password
-			database  = 'ALX_prodev' 
+			database  = 'ALX_prodev',
+			allow_local_infile = allow_local_infile
 		)
 		if connection.is_connected():
 			print("Successfully connected to ALX_prodev database")
@@ -46,6 +65,25 @@ def connect_to_prodev():
 		return None
 	
 
+def create_age_aggregates(connection, verify=False):
+	"""Creates the maintained age aggregates of user_data and their triggers
+
+	Only when they are missing: once installed, the triggers keep them up
+	to date and there is nothing to rebuild.
+
+	Args:
+	    connection: MySQL (or sqlite3) connection
+	    verify: Also recompute the aggregates (one scan of user_data) and
+	        rebuild them if they do not match"""
+	try:
+		if ensure_age_aggregates(connection, verify=verify):
+			print("Age aggregates installed")
+		else:
+			print("Age aggregates already installed")
+	except (Error, sqlite3.Error) as e:
+		print(f"Error while installing age aggregates: {e}")
+
+
 def create_table(connection):
 	"""Creates a table user_data if it does not exist with the required fields"""
 	try:
@@ -54,6 +92,7 @@ def create_table(connection):
 		CREATE TABLE IF NOT EXISTS user_data(
 			user_id CHAR(36) PRIMARY KEY,
 			name VARCHAR(255) NOT NULL,
+			email VARCHAR(255) NOT NULL,
 			age DECIMAL(5,2) NOT NULL,
 			INDEX (user_id)
 		)
@@ -63,62 +102,489 @@ def create_table(connection):
 		print(f"Error while creating table: {e}")
 	
 
-def insert_data(connection, data):
-	"""Inserts data in the database if it does not exist"""
-	try:
-		cursor = connection.cursor()
+def chunks(records, chunk_size):
+	"""Splits an iterable of records into lists of at most chunk_size records"""
+	iterator = iter(records)
+	while True:
+		chunk = list(islice(iterator, chunk_size))
+		if not chunk:
+			return
+		yield chunk
+
 
-		#Check if record exists with this user_id
-		check_query = "SELECT COUNT(*) FROM user_data WHERE user_id = %s"
-		insert_query = """
-        INSERT INTO user_data (user_id, name, email, age)
-		VALUES (%s, %s, %s, %s)
+def insert_query(connection):
+	"""Returns the bulk insert statement that skips existing user_ids"""
+	if is_sqlite(connection):
+		return """
+		INSERT OR IGNORE INTO user_data (user_id, name, email, age)
+		VALUES (?, ?, ?, ?)
 		"""
+	# A no-op update on duplicates; unlike INSERT IGNORE it does not
+	# silence other errors such as invalid data
+	return """
+	INSERT INTO user_data (user_id, name, email, age)
+	VALUES (%s, %s, %s, %s)
+	ON DUPLICATE KEY UPDATE user_id = user_id
+	"""
 
-		for record in data:
-			# If user_id is not provided, generate one
-			if not record[0]:
-				record[0] = str(uuid.uuid4())
 
-				# Check if record exists
-				cursor.execute(check_query, (record[0],))
-				count = cursor.fetchnone()[0]
+def upsert_query(connection):
+	"""Returns the bulk statement that inserts new users and updates existing ones"""
+	if is_sqlite(connection):
+		return """
+		INSERT INTO user_data (user_id, name, email, age)
+		VALUES (?, ?, ?, ?)
+		ON CONFLICT(user_id) DO UPDATE SET
+		name = excluded.name, email = excluded.email, age = excluded.age
+		"""
+	return """
+	INSERT INTO user_data (user_id, name, email, age)
+	VALUES (%s, %s, %s, %s)
+	ON DUPLICATE KEY UPDATE
+	name = VALUES(name), email = VALUES(email), age = VALUES(age)
+	"""
 
-				if count == 0:
-					cursor.execute(insert_query, tuple(record))
-					print(f"Inserted record for {record[1]}")
-				else:
-					print(f"Record with user_id {record[0]} already exists, skipping")
 
+def insert_data(connection, data, chunk_size=1000):
+	"""Inserts data in the database if it does not exist
+
+	Records are sent chunk_size at a time with executemany(), which
+	mysql.connector turns into a single multi-row INSERT, and each chunk is
+	committed as one transaction. Records whose user_id already exists are
+	skipped by the database itself instead of being checked one by one.
+
+	Args:
+	    connection: MySQL (or sqlite3) connection
+	    data: Iterable of [user_id, name, email, age] records
+	    chunk_size: Number of records inserted per transaction
+
+	Returns:
+	    int: Number of records inserted"""
+	return insert_chunks(connection, chunks(data, chunk_size))
+
+
+def insert_chunks(connection, record_chunks):
+	"""Inserts chunks of records, one executemany() and transaction each
+
+	Args:
+	    connection: MySQL (or sqlite3) connection
+	    record_chunks: Iterable of lists of [user_id, name, email, age] records
+
+	Returns:
+	    int: Number of records inserted"""
+	query = insert_query(connection)
+	inserted = 0
+	try:
+		cursor = connection.cursor()
+
+		for chunk in record_chunks:
+			start = time.perf_counter()
+
+			# If user_id is not provided, derive one from the email
+			for record in chunk:
+				if not record[0]:
+					record[0] = user_id_for(record)
+
+			cursor.executemany(query, [tuple(record) for record in chunk])
 			connection.commit()
-			print("Data insertion completed")
-	except Error as e:
+
+			elapsed = time.perf_counter() - start
+			# MySQL counts a row touched by ON DUPLICATE KEY as 0 when
+			# nothing changed, so rowcount is the number of new rows
+			added = max(cursor.rowcount, 0)
+			inserted += added
+			rate = len(chunk) / elapsed if elapsed > 0 else float('inf')
+			print(f"Inserted {added}/{len(chunk)} records in {elapsed:.3f}s ({rate:.0f} rows/s)")
+
+		cursor.close()
+		print(f"Data insertion completed: {inserted} new records")
+	except (Error, sqlite3.Error) as e:
+		connection.rollback()
 		print(f"Error while inserting data: {e}")
+	return inserted
 
 
-def load_csv_data(file_path):
-	"""Load data from a CSV file"""
-	data = []
+def load_data_infile(connection, file_path):
+	"""Loads a CSV file with LOAD DATA LOCAL INFILE (MySQL fast path)
+
+	The server parses and inserts the file itself, which is much faster
+	than sending INSERT statements. Rows whose user_id already exists are
+	skipped, and missing user_ids are generated with UUID().
+
+	Requires a connection opened with connect_to_prodev(allow_local_infile=True)
+	and local_infile enabled on the server.
+
+	Args:
+	    connection: MySQL connection
+	    file_path: Path of the CSV file, with a header row
+
+	Returns:
+	    int: Number of records inserted"""
 	try:
-		with open(file_path, 'r') as csv_file:
-			csv_reader = csv.reader(csv_file)
-			headers = next(csv_reader) # Skip header row
+		with open(file_path, 'r', newline='') as csv_file:
+			headers = next(csv.reader(csv_file))
+	except (FileNotFoundError, StopIteration):
+		print(f"CSV File not found or empty: {file_path}")
+		return 0
 
-			for row in csv_reader:
-				# If no user_id is provided, it will be generated in insert_data function
+	# Read user_id into a variable so empty ones can be generated
+	columns = ['@user_id' if header == 'user_id' else header for header in headers]
+	if 'user_id' in headers:
+		generate = "user_id = IF(@user_id = '', UUID(), @user_id)"
+	else:
+		generate = "user_id = UUID()"
 
-				if len(row) < 4:
-					row = [''] + row # Add empty user_id if not provided
-				data.append(row)
+	query = f"""
+	LOAD DATA LOCAL INFILE %s IGNORE INTO TABLE user_data
+	FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '"'
+	LINES TERMINATED BY '\\n'
+	IGNORE 1 LINES
+	({', '.join(columns)})
+	SET {generate}
+	"""
+	try:
+		start = time.perf_counter()
+		cursor = connection.cursor()
+		cursor.execute(query, (os.path.abspath(file_path),))
+		connection.commit()
+		elapsed = time.perf_counter() - start
+		inserted = cursor.rowcount
+		cursor.close()
+		rate = inserted / elapsed if elapsed > 0 else float('inf')
+		print(f"Loaded {inserted} records in {elapsed:.3f}s ({rate:.0f} rows/s)")
+		return inserted
+	except Error as e:
+		connection.rollback()
+		print(f"Error while loading data: {e}")
+		return 0
 
-		return data
+
+def read_csv_chunks(file_path, chunk_size=1000):
+	"""Generator that reads a CSV file chunk_size records at a time
+
+	Only one chunk is held in memory at once, whatever the size of the
+	file, and the first chunk is available as soon as it is parsed.
+
+	Args:
+	    file_path: Path of the CSV file, with a header row
+	    chunk_size: Number of records per chunk
+
+	Yields:
+	    list: Up to chunk_size [user_id, name, email, age] records"""
+	try:
+		with open(file_path, 'r', newline='') as csv_file:
+			csv_reader = csv.reader(csv_file)
+			headers = next(csv_reader, None) # Skip header row
+
+			yield from chunks(csv_records(csv_reader), chunk_size)
 	except FileNotFoundError:
 		print(f"CSV File not found: {file_path}")
-		return []
+
+
+def csv_records(rows):
+	"""Turns parsed CSV rows into [user_id, name, email, age] records"""
+	for row in rows:
+		# If no user_id is provided, it will be generated in insert_data function
+		if len(row) < 4:
+			row = [''] + row # Add empty user_id if not provided
+		yield row
+
+
+def load_csv_data(file_path):
+	"""Load data from a CSV file"""
+	data = []
+	try:
+		for chunk in read_csv_chunks(file_path):
+			data.extend(chunk)
+		return data
 	except Exception as e:
 		print(f"Error loading CSV data: {e}")
 		return []
-def row_generator(connection, table_name="user_data", batch_size=100):
+
+
+def stream_csv_data(connection, file_path, chunk_size=1000, queue_depth=4):
+	"""Streams a CSV file into user_data with constant memory
+
+	Runs a two-stage pipeline: a background thread parses the file into
+	chunks while the current thread inserts them, so parsing and insertion
+	overlap. At most queue_depth parsed chunks wait in between; the parser
+	pauses when the inserts fall behind, so memory stays flat however
+	large the file is.
+
+	Args:
+	    connection: MySQL (or sqlite3) connection
+	    file_path: Path of the CSV file, with a header row
+	    chunk_size: Number of records per chunk and transaction
+	    queue_depth: Maximum number of parsed chunks waiting to be inserted
+
+	Returns:
+	    int: Number of records inserted"""
+	try:
+		parsed = prefetch(lambda: read_csv_chunks(file_path, chunk_size), queue_depth)
+		return insert_chunks(connection, parsed)
+	except Exception as e:
+		print(f"Error loading CSV data: {e}")
+		return 0
+
+
+def sync_csv_data(connection, file_path, index_path=INDEX_PATH, chunk_size=1000, queue_depth=4):
+	"""Re-seeds user_data from a CSV file, sending only new and changed rows
+
+	A local index (see content_index.py) remembers the content hash of
+	every row written by the previous runs. Each parsed chunk is compared
+	with it locally: rows whose user_id is not indexed are new, rows whose
+	hash differs have changed, and only those are sent, with one bulk
+	insert-or-update per chunk. The index is updated once the chunk is
+	committed, so a failed run only sends its unfinished rows again.
+
+	Rows are never deleted, like with stream_csv_data. Records without a
+	user_id get one derived from their email (see user_id_for), so they
+	are recognized from one run to the next.
+
+	Before trusting the index, the fingerprint of the table (see
+	table_fingerprint) is compared with the one saved at the end of the
+	previous sync. If the table was changed by anything else since (or
+	emptied), the index is cleared and every row is sent again.
+
+	Args:
+	    connection: MySQL (or sqlite3) connection
+	    file_path: Path of the CSV file, with a header row
+	    index_path: Path of the index sidecar file
+	    chunk_size: Number of records compared and written per transaction
+	    queue_depth: Maximum number of parsed chunks waiting to be compared
+
+	Returns:
+	    dict: Number of new, changed and unchanged records"""
+	report = {'new': 0, 'changed': 0, 'unchanged': 0}
+	query = upsert_query(connection)
+	with ContentIndex(index_path) as index:
+		if len(index) and table_fingerprint(connection) != index.fingerprint():
+			print("user_data changed since the last sync, clearing the content index")
+			index.clear()
+
+		try:
+			cursor = connection.cursor()
+			parsed = prefetch(lambda: read_csv_chunks(file_path, chunk_size), queue_depth)
+			for chunk in parsed:
+				start = time.perf_counter()
+				for record in chunk:
+					if not record[0]:
+						record[0] = user_id_for(record)
+				known = index.lookup(record[0] for record in chunk)
+
+				send = []
+				hashes = []
+				for record in chunk:
+					digest = content_hash(record)
+					stored = known.get(record[0])
+					if stored == digest:
+						report['unchanged'] += 1
+						continue
+					report['new' if stored is None else 'changed'] += 1
+					send.append(tuple(record))
+					hashes.append((record[0], digest))
+
+				if send:
+					cursor.executemany(query, send)
+					connection.commit()
+					index.update(hashes)
+
+				elapsed = time.perf_counter() - start
+				print(f"Synced {len(send)}/{len(chunk)} records in {elapsed:.3f}s")
+
+			cursor.close()
+			print(f"Sync completed: {report['new']} new, {report['changed']} changed, "
+				f"{report['unchanged']} unchanged records")
+		except (Error, sqlite3.Error) as e:
+			connection.rollback()
+			print(f"Error while syncing data: {e}")
+
+		try:
+			# The hashes now describe the table as it is
+			index.set_fingerprint(table_fingerprint(connection))
+		except (Error, sqlite3.Error) as e:
+			# The next sync will find no matching fingerprint and start over
+			print(f"Error while saving the table fingerprint: {e}")
+	return report
+
+
+def csv_byte_ranges(file_path, parts):
+	"""Splits a CSV file into byte ranges that start and end on line boundaries
+
+	Assumes that quoted fields do not contain line breaks.
+
+	Args:
+	    file_path: Path of the CSV file, with a header row
+	    parts: Number of ranges wanted
+
+	Returns:
+	    list: (start, end) byte offsets, the header row excluded"""
+	size = os.path.getsize(file_path)
+	with open(file_path, 'rb') as csv_file:
+		csv_file.readline() # Skip header row
+		bounds = [csv_file.tell()]
+
+		for i in range(1, parts):
+			position = bounds[0] + (size - bounds[0]) * i // parts
+			if position <= bounds[-1]:
+				continue
+			# Move to the start of the next line (or stay if already there)
+			csv_file.seek(position - 1)
+			csv_file.readline()
+			if csv_file.tell() < size:
+				bounds.append(csv_file.tell())
+
+	bounds.append(size)
+	return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+
+def load_csv_range(connection_factory, file_path, start, end, chunk_size=1000):
+	"""Parses and loads one byte range of a CSV file
+
+	Runs inside a worker process, over a connection of its own, and
+	commits once per chunk_size records.
+
+	Returns:
+	    dict: parsed and inserted record counts for the range, and whether
+	        the whole range was loaded"""
+	def lines(csv_file):
+		while csv_file.tell() < end:
+			line = csv_file.readline()
+			if not line:
+				break
+			yield line.decode('utf-8')
+
+	report = {'start': start, 'end': end, 'parsed': 0, 'inserted': 0, 'complete': False}
+	connection = connection_factory()
+	if connection is None:
+		return report
+
+	def counted(records):
+		for record in records:
+			report['parsed'] += 1
+			yield record
+		report['complete'] = True
+
+	try:
+		with open(file_path, 'rb') as csv_file:
+			csv_file.seek(start)
+			records = counted(csv_records(csv.reader(lines(csv_file))))
+			report['inserted'] = insert_chunks(connection, chunks(records, chunk_size))
+	finally:
+		connection.close()
+	return report
+
+
+def user_id_for(record):
+	"""Returns the user_id of a [user_id, name, email, age] record without one
+
+	The id is derived from the email (a UUID5), so the same CSV row gets
+	the same user_id on every run instead of being inserted again."""
+	return str(uuid.uuid5(USER_ID_NAMESPACE, record[2].strip().lower()))
+
+
+def _crc32(text):
+	return zlib.crc32(str(text).encode('utf-8'))
+
+
+def table_fingerprint(connection, table_name="user_data"):
+	"""Returns a fingerprint of the content of user_data
+
+	The row count and the sum of a CRC32 of every row, computed by the
+	database in one scan: only one row comes back. Any insert, update or
+	delete changes it (barring CRC collisions).
+
+	Returns:
+	    str: 'count:checksum'"""
+	cursor = connection.cursor()
+	if is_sqlite(connection):
+		connection.create_function('crc32', 1, _crc32, deterministic=True)
+		content = "user_id || char(31) || name || char(31) || email || char(31) || age"
+	else:
+		content = "CONCAT_WS(CHAR(31), user_id, name, email, age)"
+	cursor.execute(f"SELECT COUNT(*), COALESCE(SUM(CRC32({content})), 0) FROM {table_name}")
+	count, checksum = cursor.fetchone()
+	cursor.close()
+	return f"{int(count)}:{int(checksum)}"
+
+
+def count_rows(connection, table_name="user_data"):
+	"""Returns the number of rows of a table"""
+	cursor = connection.cursor()
+	cursor.execute(f"SELECT COUNT(*) FROM {table_name}")
+	count = cursor.fetchone()[0]
+	cursor.close()
+	return count
+
+
+def parallel_load_csv(file_path, workers=None, chunk_size=1000, connection_factory=connect_to_prodev):
+	"""Parses and loads a CSV file with a pool of processes
+
+	The file is split into byte ranges aligned on line boundaries; each
+	range is parsed in its own process and loaded over its own connection,
+	one transaction per chunk_size records. A consistency report compares
+	the rows parsed, inserted and added to the table once all are done.
+
+	Args:
+	    file_path: Path of the CSV file, with a header row
+	    workers: Number of worker processes (defaults to the CPU count)
+	    chunk_size: Number of records per transaction
+	    connection_factory: Picklable callable returning a new connection
+
+	Returns:
+	    dict: The consistency report (None if the database is unreachable)"""
+	workers = workers or os.cpu_count() or 1
+	ranges = csv_byte_ranges(file_path, workers)
+
+	connection = connection_factory()
+	if connection is None:
+		return None
+	before = count_rows(connection)
+	start = time.perf_counter()
+
+	reports = []
+	with ProcessPoolExecutor(max_workers=workers) as executor:
+		futures = [
+			executor.submit(load_csv_range, connection_factory, file_path, range_start, range_end, chunk_size)
+			for range_start, range_end in ranges
+		]
+		for future in as_completed(futures):
+			try:
+				reports.append(future.result())
+			except Exception as e:
+				print(f"Error in CSV loading worker: {e}")
+				reports.append({'parsed': 0, 'inserted': 0, 'complete': False})
+
+	elapsed = time.perf_counter() - start
+	after = count_rows(connection)
+	connection.close()
+
+	parsed = sum(report['parsed'] for report in reports)
+	inserted = sum(report['inserted'] for report in reports)
+	report = {
+		'ranges': len(ranges),
+		'failed_ranges': sum(1 for report in reports if not report['complete']),
+		'parsed': parsed,
+		'inserted': inserted,
+		'skipped': parsed - inserted,
+		'rows_before': before,
+		'rows_after': after,
+		'consistent': after - before == inserted and all(report['complete'] for report in reports),
+		'seconds': elapsed,
+	}
+
+	rate = parsed / elapsed if elapsed > 0 else float('inf')
+	print(f"Loaded {report['ranges']} ranges in {elapsed:.2f}s ({rate:.0f} rows/s)")
+	print(f"Parsed {parsed} records: {inserted} inserted, {report['skipped']} already present")
+	print(f"Table rows: {before} -> {after}")
+	if report['consistent']:
+		print("Consistency check passed")
+	else:
+		print(f"Consistency check FAILED ({report['failed_ranges']} ranges incomplete)")
+	return report
+
+
+def row_generator(connection, table_name="user_data", batch_size=100, streaming=False, compact=False, adaptive=None):
 	"""
 	A generator function that streams rows from a database table one by one
 	
@@ -126,38 +592,92 @@ def row_generator(connection, table_name="user_data", batch_size=100):
 	    connection: MySQL database connection
 		table_name: Name of the table to stream from
 		batch_size: Number of rows to fetch at once (for efficiency)
+		streaming: Run a single query on an unbuffered (server-side) cursor
+		    and read it batch_size rows at a time with fetchmany(), instead
+		    of issuing one keyset-paginated query per batch
+		compact: Yield compact records instead of dictionaries: one
+		    tuple-based class is generated per table schema, rows keep key
+		    (row['age']) and attribute (row.age) access and cost about as
+		    much memory as a tuple
+		adaptive: Optional adaptive.AdaptiveBatchSize that grows or shrinks
+		    the keyset batches to hit a target fetch latency and memory
+		    budget, instead of using batch_size for every batch
 		
 	Yields:
-	    One row at a time as a dictionary
+	    One row at a time as a dictionary (or a compact record)
 		"""
 	try:
 		cursor = connection.cursor(dictionary=True)
 
 		# Get total number of rows for progress tracking
 		cursor.execute(f"SELECT COUNT(*) as count FROM {table_name}")
-		total_rows = cursor.fetchnone()['count']
+		total_rows = cursor.fetchone()['count']
 		print(f"Total rows to stream: {total_rows}")
 
-		# Stream in batches for efficiency, but yield one by one
-		offset = 0
-		while True:
-			cursor.execute(f"SELECT * FROM {table_name} LIMIT {batch_size} OFFSET {offset}")
-			batch = cursor.fetchall()
+		if streaming:
+			# The server hands rows over as they are fetched, so client
+			# memory is bounded by batch_size rather than the table size
+			cursor.close()
+			processed = 0
+			for row in stream_rows(connection, f"SELECT * FROM {table_name}",
+					arraysize=batch_size, dictionary=True, compact=compact):
+				yield row
 
-			if not batch: # No more rows
-				break
+				processed += 1
+				if processed % batch_size == 0 or processed == total_rows:
+					print(f"Progress: {min(processed, total_rows)}/{total_rows} rows processed")
+			return
 
+		if compact:
+			# Records are built from plain tuples
+			cursor.close()
+			cursor = connection.cursor()
+
+		# Stream in batches for efficiency, but yield one by one.
+		# Batches are fetched with keyset pagination on user_id, so each
+		# one seeks through the primary key instead of rescanning the
+		# rows before it the way OFFSET does
+		processed = 0
+		for batch in keyset_batches(connection, batch_size, table_name,
+				cursor=cursor, compact=compact, sizer=adaptive):
 			# Yield rows one by one
 			for row in batch:
 				yield row
 
-			offset += len(batch)
-			print(f"Progress: {min(offset, total_rows)}/{total_rows} rows processed")
+			processed += len(batch)
+			print(f"Progress: {min(processed, total_rows)}/{total_rows} rows processed")
 
 	except Error as e:
 		print(f"Error in row generator: {e}")
-		raise StopIteration
+		return
 	
+def process_rows_resumable(connection, consumer, checkpoint_path, table_name="user_data", batch_size=100, every=1, committed=None):
+	"""
+	Hands every row of a table to a consumer, batch by batch, in a job that
+	resumes after the last finished batch if it is interrupted
+
+	Args:
+	    connection: MySQL database connection
+	    consumer: Callable receiving each batch (a list of row dictionaries)
+	    checkpoint_path: JSON file where the last processed user_id is saved
+	    table_name: Name of the table to stream from
+	    batch_size: Number of rows per batch
+	    every: Number of batches between two checkpoint saves (batches are
+	        handed over at least once: a crash may replay up to every of them)
+	    committed: Callable returning the last user_id the consumer stored
+	        with its writes, for exactly once delivery (see run_checkpointed)
+
+	Returns:
+	    Checkpoint: The final checkpoint of the job
+	"""
+	cursor = connection.cursor(dictionary=True)
+	try:
+		return run_checkpointed(
+			lambda after: keyset_batches(connection, batch_size, table_name, after=after, cursor=cursor),
+			consumer, checkpoint_path, every, committed=committed)
+	finally:
+		cursor.close()
+
 def demonstrate_generator(connection):
 	"""Demonstrates the row generator functionality"""
 	print("\nDemonstrating row generator:")
@@ -174,8 +694,12 @@ def demonstrate_generator(connection):
 	except Exception as e:
 		print(f"Error during generator demonstration: {e}")
 
-def main():
-	"""Tie everything together"""
+def main(incremental=False):
+	"""Tie everything together
+
+	Args:
+	    incremental: Re-seed with sync_csv_data, sending only the rows
+	        that are new or changed since the previous incremental run"""
 	# Connect to MySQL server
 	connection = connect_db()
 	if connection:
@@ -192,22 +716,28 @@ def main():
 			# Check if CSV file exists
 			csv_file = 'user_data.csv'
 			if os.path.exists(csv_file):
-				# Load and insert data
-				data = load_csv_data(csv_file)
-				if data:
-					insert_data(db_connection, data)
+				if incremental:
+					sync_csv_data(db_connection, csv_file)
+				else:
+					# Stream the file into the table chunk by chunk
+					stream_csv_data(db_connection, csv_file)
 
-					# Demonstrate the row generator
-					demonstrate_generator(db_connection)
+				# Demonstrate the row generator
+				demonstrate_generator(db_connection)
 
 			else:
 				print(f"CSV file '{csv_file}' not found. Please provide a CSV file with user data.")
 
+			# Keep count/sum/histogram of the ages up to date on every change.
+			# Installed after the first load, which then does not pay for the
+			# triggers row by row, and only rebuilt when missing
+			create_age_aggregates(db_connection)
+
 			# Close the connection
 			if db_connection.is_connected():
 				db_connection.close()
 				print("MySQL connection closed")
 
 if __name__ == "__main__":
-	main()
+	main(incremental='--incremental' in sys.argv[1:])
 	
\ No newline at end of file
@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+"""
+Single-pass streaming statistics.
+
+Every statistic here is computed from one pass over a stream of numbers
+and keeps a small, mergeable state: partial results computed over
+separate parts of a table (e.g. by parallel workers) can be combined into
+the result of the whole table with merge(). States are plain objects, so
+they can be pickled between processes.
+
+    - Summary: count, sum, mean, variance (Welford), min and max
+    - Histogram: counts over fixed bucket edges
+    - QuantileSketch: approximate percentiles (KLL sketch)
+    - StreamStats: all of the above at once
+"""
+
+import math
+import random
+from bisect import bisect_right
+
+
+class Summary:
+	"""
+	Count, sum, mean, variance, min and max of a stream.
+
+	The variance uses Welford's online algorithm, which stays numerically
+	stable where the naive sum-of-squares formula does not, and Chan's
+	formula to merge two partial states.
+	"""
+
+	def __init__(self):
+		self.count = 0
+		self.total = 0.0
+		self.mean = 0.0
+		self.m2 = 0.0  # Sum of squared distances to the mean
+		self.min = None
+		self.max = None
+
+	def update(self, value):
+		"""Adds one value to the summary"""
+		value = float(value)
+		self.count += 1
+		self.total += value
+		delta = value - self.mean
+		self.mean += delta / self.count
+		self.m2 += delta * (value - self.mean)
+		if self.min is None or value < self.min:
+			self.min = value
+		if self.max is None or value > self.max:
+			self.max = value
+
+	def merge(self, other):
+		"""Folds another summary into this one"""
+		if other.count == 0:
+			return self
+		if self.count == 0:
+			self.__dict__.update(other.__dict__)
+			return self
+
+		count = self.count + other.count
+		delta = other.mean - self.mean
+		self.mean += delta * other.count / count
+		self.m2 += other.m2 + delta * delta * self.count * other.count / count
+		self.count = count
+		self.total += other.total
+		self.min = min(self.min, other.min)
+		self.max = max(self.max, other.max)
+		return self
+
+	@property
+	def variance(self):
+		"""Population variance (0 for fewer than two values)"""
+		return self.m2 / self.count if self.count > 1 else 0.0
+
+	@property
+	def stddev(self):
+		"""Population standard deviation"""
+		return math.sqrt(self.variance)
+
+
+class Histogram:
+	"""
+	Counts of a stream over fixed buckets.
+
+	With edges e0 < e1 < ... < en, bucket i counts the values in
+	[e(i-1), e(i)); the first and last buckets catch the values below e0
+	and from en upwards.
+	"""
+
+	def __init__(self, edges):
+		self.edges = sorted(edges)
+		self.counts = [0] * (len(self.edges) + 1)
+
+	def update(self, value):
+		"""Adds one value to its bucket"""
+		self.counts[bisect_right(self.edges, value)] += 1
+
+	def merge(self, other):
+		"""Folds another histogram with the same edges into this one"""
+		if other.edges != self.edges:
+			raise ValueError("Cannot merge histograms with different bucket edges")
+		self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+		return self
+
+	def buckets(self):
+		"""
+		Returns:
+		    list: ((low, high), count) per bucket, None for an open end
+		"""
+		edges = [None] + self.edges + [None]
+		return [
+			((low, high), count)
+			for low, high, count in zip(edges[:-1], edges[1:], self.counts)
+		]
+
+
+class QuantileSketch:
+	"""
+	Approximate quantiles of a stream (KLL sketch).
+
+	Values are kept in a hierarchy of compactors. When a level is full it
+	is sorted and every other value is promoted to the next level, where
+	each value stands for twice as many original values. Memory stays
+	around 3k values whatever the length of the stream, and the rank error
+	shrinks as k grows (roughly 1.7/k for the default settings).
+	"""
+
+	def __init__(self, k=200, seed=None):
+		self.k = k
+		self.count = 0
+		self.compactors = []
+		self.size = 0
+		self.max_size = 0
+		self._random = random.Random(seed)
+		self._grow()
+
+	def _grow(self):
+		self.compactors.append([])
+		self.max_size = sum(self._capacity(h) for h in range(len(self.compactors)))
+
+	def _capacity(self, height):
+		# Lower levels get smaller, geometrically decreasing capacities
+		depth = len(self.compactors) - height - 1
+		return int(math.ceil(self.k * (2 / 3) ** depth)) + 1
+
+	def _compress(self):
+		for height, compactor in enumerate(self.compactors):
+			if len(compactor) >= self._capacity(height):
+				if height + 1 >= len(self.compactors):
+					self._grow()
+				compactor.sort()
+				# With an odd count the smallest value stays behind, then
+				# one value of each pair is promoted: odd or even positions,
+				# at random, to keep the estimate unbiased
+				keep = len(compactor) % 2
+				offset = self._random.randint(0, 1)
+				self.compactors[height + 1].extend(compactor[keep + offset::2])
+				self.compactors[height] = compactor[:keep]
+				break
+		self.size = sum(len(c) for c in self.compactors)
+
+	def update(self, value):
+		"""Adds one value to the sketch"""
+		self.compactors[0].append(value)
+		self.count += 1
+		self.size += 1
+		if self.size >= self.max_size:
+			self._compress()
+
+	def merge(self, other):
+		"""Folds another sketch into this one"""
+		while len(self.compactors) < len(other.compactors):
+			self._grow()
+		for height, compactor in enumerate(other.compactors):
+			self.compactors[height].extend(compactor)
+		self.count += other.count
+		self.size = sum(len(c) for c in self.compactors)
+		while self.size >= self.max_size:
+			self._compress()
+		return self
+
+	def quantile(self, q):
+		"""
+		Returns the approximate q-quantile (0 <= q <= 1) of the stream,
+		or None if it is empty.
+		"""
+		if not 0 <= q <= 1:
+			raise ValueError("Quantile must be between 0 and 1")
+
+		weighted = sorted(
+			(value, 2 ** height)
+			for height, compactor in enumerate(self.compactors)
+			for value in compactor
+		)
+		if not weighted:
+			return None
+
+		total = sum(weight for _, weight in weighted)
+		target = q * total
+		seen = 0
+		for value, weight in weighted:
+			seen += weight
+			if seen >= target:
+				return value
+		return weighted[-1][0]
+
+
+class StreamStats:
+	"""
+	Every statistic above, computed together in a single pass.
+
+	Args:
+	    histogram_edges: Optional bucket edges for a Histogram
+	    sketch_size(int): k of the QuantileSketch
+	"""
+
+	def __init__(self, histogram_edges=None, sketch_size=200):
+		self.summary = Summary()
+		self.histogram = Histogram(histogram_edges) if histogram_edges else None
+		self.sketch = QuantileSketch(sketch_size)
+
+	def update(self, value):
+		"""Adds one value to every statistic"""
+		self.summary.update(value)
+		if self.histogram is not None:
+			self.histogram.update(value)
+		self.sketch.update(value)
+
+	def update_many(self, values):
+		"""Adds every value of an iterable"""
+		for value in values:
+			self.update(value)
+		return self
+
+	def merge(self, other):
+		"""Folds the statistics of another part of the stream into these"""
+		self.summary.merge(other.summary)
+		if self.histogram is not None:
+			self.histogram.merge(other.histogram)
+		self.sketch.merge(other.sketch)
+		return self
+
+	def percentile(self, p):
+		"""Approximate p-th percentile (0 to 100)"""
+		return self.sketch.quantile(p / 100)
+
+	def result(self, percentiles=(25, 50, 75, 90, 99)):
+		"""
+		Returns:
+		    dict: Every statistic, by name
+		"""
+		summary = self.summary
+		result = {
+			'count': summary.count,
+			'sum': summary.total,
+			'mean': summary.mean if summary.count else 0,
+			'variance': summary.variance,
+			'stddev': summary.stddev,
+			'min': summary.min,
+			'max': summary.max,
+			'percentiles': {p: self.percentile(p) for p in percentiles},
+		}
+		if self.histogram is not None:
+			result['histogram'] = self.histogram.buckets()
+		return result
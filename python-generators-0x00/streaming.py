@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""
+Shared streaming helpers used by the user_data generators.
+
+Pages are fetched with keyset (seek) pagination instead of LIMIT/OFFSET:
+every page starts right after the last key seen on the previous page
+(WHERE key > ? ORDER BY key LIMIT ?), so the database can jump straight to
+it through the primary key index. A late page costs the same as the first
+one and a full scan stays linear in the size of the table.
+
+For full-table exports, stream_rows() runs a single query on a cursor
+that hands rows over incrementally (an unbuffered cursor on MySQL, plain
+statement stepping on SQLite) and reads them with fetchmany(), so client
+memory is bounded by the fetch size rather than the size of the table.
+
+prefetch() runs any of these generators in a background thread that reads
+a few items ahead into a bounded queue, so database round trips overlap
+with the work done by the consumer.
+
+Works with both sqlite3 and mysql.connector connections.
+"""
+
+import queue
+import sqlite3
+import threading
+import time
+
+from rows import compact_rows, record_maker
+
+# Defaults shared by the generators in this project
+DATABASE_PATH = 'user_data.db'
+TABLE_NAME = 'user_data'
+KEY_COLUMN = 'user_id'
+DEFAULT_ARRAYSIZE = 1000
+
+# Marks the end of a prefetched stream
+_DONE = object()
+
+
+def connect(database_path=DATABASE_PATH, row_factory=None):
+	"""
+	Opens a SQLite connection to the user_data database.
+
+	Args:
+	    database_path(str): Path to the SQLite database file
+	    row_factory: Optional sqlite3 row factory (e.g. sqlite3.Row)
+
+	Returns:
+	    sqlite3.Connection: The open connection
+	"""
+	connection = sqlite3.connect(database_path)
+	# REPLACE must fire the DELETE trigger of the row it replaces for the
+	# age aggregates to drop it (see aggregates.enable_replace_triggers)
+	connection.execute("PRAGMA recursive_triggers = ON")
+	if row_factory is not None:
+		connection.row_factory = row_factory
+	return connection
+
+
+def connect_readonly(database_path=DATABASE_PATH):
+	"""
+	Opens a read-only SQLite connection to the user_data database.
+
+	Args:
+	    database_path(str): Path to the SQLite database file
+
+	Returns:
+	    sqlite3.Connection: The open connection
+	"""
+	return sqlite3.connect(f"file:{database_path}?mode=ro", uri=True)
+
+
+def is_sqlite(connection):
+	"""Tells whether a connection comes from the sqlite3 driver"""
+	return isinstance(connection, sqlite3.Connection)
+
+
+def dict_factory(cursor, row):
+	"""sqlite3 row factory that builds dicts, like MySQL's dictionary cursor"""
+	return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def placeholder(connection):
+	"""
+	Returns the parameter marker understood by the connection's driver.
+
+	sqlite3 uses the 'qmark' style (?) while mysql.connector uses the
+	'format' style (%s).
+	"""
+	if is_sqlite(connection):
+		return '?'
+	return '%s'
+
+
+def row_key(row, key, description):
+	"""
+	Extracts the value of the key column from a fetched row.
+
+	Args:
+	    row: A row as returned by the cursor (tuple, dict or sqlite3.Row)
+	    key(str): Name of the key column
+	    description: The cursor description the row was fetched with
+
+	Returns:
+	    The value of the key column for that row
+	"""
+	if isinstance(row, dict):
+		return row[key]
+	columns = [column[0] for column in description]
+	return row[columns.index(key)]
+
+
+def describe(connection, table_name=TABLE_NAME, columns='*'):
+	"""
+	Returns the cursor description of a query without fetching any row.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    table_name(str): Table to describe
+	    columns(str): Columns to select
+
+	Returns:
+	    tuple: DB-API cursor description, one entry per column
+	"""
+	cursor = connection.cursor()
+	try:
+		cursor.execute(f"SELECT {columns} FROM {table_name} LIMIT 0")
+		cursor.fetchall()
+		return cursor.description
+	finally:
+		cursor.close()
+
+
+def page_query(mark, page_size, after=None, table_name=TABLE_NAME,
+		key=KEY_COLUMN, columns='*', until=None, where=None):
+	"""
+	Builds the keyset query of one page.
+
+	Args:
+	    mark(str): Parameter marker of the driver ('?' or '%s')
+	    page_size(int): Maximum number of rows to fetch
+	    after: Last key seen on the previous page (None for the first page)
+	    table_name(str): Table to read from
+	    key(str): Unique, indexed column used to order and seek the pages
+	    columns(str): Columns to select, must include the key column
+	    until: Optional last key to include (None reads to the end)
+	    where: Optional extra (condition, params) rows must match, e.g.
+	        ("age > ?", (25,)), see pushdown.py
+
+	Returns:
+	    tuple: (query, params)
+	"""
+	if page_size <= 0:
+		raise ValueError("Page size must be a positive integer")
+
+	conditions = []
+	params = []
+	if where is not None:
+		condition, condition_params = where
+		conditions.append(f"({condition})")
+		params.extend(condition_params)
+
+	# Seek past the previous page through the key index
+	if after is not None:
+		conditions.append(f"{key} > {mark}")
+		params.append(after)
+	if until is not None:
+		conditions.append(f"{key} <= {mark}")
+		params.append(until)
+
+	query = f"SELECT {columns} FROM {table_name}"
+	if conditions:
+		query += " WHERE " + " AND ".join(conditions)
+	query += f" ORDER BY {key} LIMIT {mark}"
+	params.append(page_size)
+	return query, tuple(params)
+
+
+def fetch_page(connection, page_size, after=None, table_name=TABLE_NAME,
+		key=KEY_COLUMN, columns='*', cursor=None, until=None, compact=False,
+		where=None):
+	"""
+	Fetches one page of rows that come right after a given key.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    page_size(int): Maximum number of rows to fetch
+	    after: Last key seen on the previous page (None for the first page)
+	    table_name(str): Table to read from
+	    key(str): Unique, indexed column used to order and seek the pages
+	    columns(str): Columns to select, must include the key column
+	    cursor: Optional cursor to reuse (e.g. a MySQL dictionary cursor)
+	    until: Optional last key to include (None reads to the end)
+	    compact(bool): Return rows as compact records (see rows.py)
+	        instead of the cursor's own row type
+	    where: Optional extra (condition, params) rows must match
+
+	Returns:
+	    tuple: (rows, last_key) where last_key is None for an empty page
+	"""
+	query, params = page_query(placeholder(connection), page_size, after,
+			table_name, key, columns, until, where)
+
+	own_cursor = cursor is None
+	if own_cursor:
+		cursor = connection.cursor()
+	try:
+		cursor.execute(query, params)
+		rows = cursor.fetchall()
+		if not rows:
+			return rows, None
+		if compact:
+			rows = compact_rows(rows, cursor.description)
+		return rows, row_key(rows[-1], key, cursor.description)
+	finally:
+		if own_cursor:
+			cursor.close()
+
+
+def keyset_batches(connection, batch_size, table_name=TABLE_NAME,
+		key=KEY_COLUMN, columns='*', after=None, cursor=None, until=None,
+		compact=False, sizer=None, where=None):
+	"""
+	Generator that walks a whole table page by page using keyset pagination.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    batch_size(int): Number of rows to fetch per page
+	    table_name(str): Table to read from
+	    key(str): Unique, indexed column used to order and seek the pages
+	    columns(str): Columns to select, must include the key column
+	    after: Optional key to start after (None starts from the beginning)
+	    cursor: Optional cursor to reuse for every page
+	    until: Optional last key to include (None reads to the end)
+	    compact(bool): Yield rows as compact records (see rows.py)
+	    sizer: Optional adaptive.AdaptiveBatchSize choosing the size of
+	        each page from the time the previous ones took (batch_size is
+	        then ignored)
+	    where: Optional extra (condition, params) rows must match; pages
+	        then hold only matching rows
+
+	Yields:
+	    list: One page of rows at a time
+	"""
+	while True:
+		if sizer is not None:
+			batch_size = sizer.size
+			start = time.perf_counter()
+		batch, last_key = fetch_page(connection, batch_size, after,
+				table_name, key, columns, cursor, until, compact, where)
+		if sizer is not None:
+			sizer.record(batch_size, batch, time.perf_counter() - start)
+
+		# If no more records, stop the iteration
+		if not batch:
+			break
+
+		yield batch
+
+		# A short page means we just read the end of the table
+		if len(batch) < batch_size:
+			break
+
+		# Continue right after the last key of this page
+		after = last_key
+
+
+def stream_cursor(connection, dictionary=False):
+	"""
+	Opens a cursor that streams results instead of buffering them.
+
+	On MySQL this is an unbuffered cursor, so rows stay on the server until
+	they are fetched. SQLite cursors always step through the statement
+	incrementally; dictionary rows are built with dict_factory.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    dictionary(bool): Return rows as dicts instead of tuples
+
+	Returns:
+	    A DB-API cursor
+	"""
+	if is_sqlite(connection):
+		cursor = connection.cursor()
+		if dictionary:
+			cursor.row_factory = dict_factory
+		return cursor
+	return connection.cursor(buffered=False, dictionary=dictionary)
+
+
+def stream_rows(connection, query, params=(), arraysize=DEFAULT_ARRAYSIZE,
+		dictionary=False, close_connection=False, compact=False):
+	"""
+	Generator that streams the rows of one query with a single cursor.
+
+	Rows are pulled from the driver arraysize at a time with fetchmany(),
+	so at most one fetch worth of rows is held in client memory.
+
+	The connection stays open for the whole scan. When the consumer stops
+	early (break, close() or garbage collection of the generator) the
+	cursor is released right away:
+	    - with close_connection=True the connection is closed as well,
+	      which also discards any rows the server still has queued;
+	    - otherwise unread MySQL rows are consumed so the caller's
+	      connection can be used again.
+	Use contextlib.closing() to make an early stop fully deterministic.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    query(str): SELECT statement to run
+	    params(tuple): Query parameters
+	    arraysize(int): Number of rows fetched from the driver at a time
+	    dictionary(bool): Yield rows as dicts instead of tuples
+	    close_connection(bool): Close the connection once the scan ends
+	    compact(bool): Yield compact records (see rows.py), which keep key
+	        and attribute access at the memory cost of a tuple. Takes
+	        precedence over dictionary
+
+	Yields:
+	    One row at a time
+	"""
+	cursor = None
+	finished = False
+	try:
+		if arraysize <= 0:
+			raise ValueError("Array size must be a positive integer")
+
+		cursor = stream_cursor(connection, dictionary and not compact)
+		cursor.arraysize = arraysize
+		cursor.execute(query, params)
+		make = record_maker(cursor.description) if compact else None
+		while True:
+			rows = cursor.fetchmany(arraysize)
+			if not rows:
+				break
+			if make is not None:
+				rows = [make(row) for row in rows]
+			for row in rows:
+				yield row
+		finished = True
+	finally:
+		if close_connection:
+			connection.close()
+		elif cursor is not None:
+			# An unbuffered MySQL cursor cannot be closed while the
+			# server still has rows queued for it
+			if not finished and not is_sqlite(connection):
+				connection.consume_results()
+			cursor.close()
+
+
+def prefetch(make_source, depth=2):
+	"""
+	Generator that reads ahead from another iterable in a background thread.
+
+	The thread pulls items from the source into a queue of at most depth
+	items while the consumer works on the current one. When the queue is
+	full the thread waits (backpressure), so a slow consumer never causes
+	more than depth items to be buffered. Exceptions raised by the source
+	are re-raised in the consumer.
+
+	The source is built by calling make_source() inside the thread, so it
+	can open its own connection there (sqlite3 connections may only be
+	used by the thread that created them). It is closed in that thread too,
+	including when the consumer stops early.
+
+	Args:
+	    make_source: Callable returning the iterable to read ahead from
+	    depth(int): Maximum number of items read ahead
+
+	Yields:
+	    The items of the source, in order
+	"""
+	if depth <= 0:
+		raise ValueError("Prefetch depth must be a positive integer")
+
+	buffer = queue.Queue(maxsize=depth)
+	stop = threading.Event()
+
+	def put(item):
+		# Wait for room in the buffer, unless the consumer has gone away
+		while not stop.is_set():
+			try:
+				buffer.put(item, timeout=0.1)
+				return True
+			except queue.Full:
+				continue
+		return False
+
+	def produce():
+		try:
+			source = make_source()
+			try:
+				for item in source:
+					if not put((item, None)):
+						return
+			finally:
+				if hasattr(source, 'close'):
+					source.close()
+		except Exception as e:
+			put((_DONE, e))
+			return
+		put((_DONE, None))
+
+	thread = threading.Thread(target=produce, name='prefetch', daemon=True)
+	thread.start()
+	try:
+		while True:
+			item, error = buffer.get()
+			if item is _DONE:
+				if error is not None:
+					raise error
+				break
+			yield item
+	finally:
+		stop.set()
+		thread.join()
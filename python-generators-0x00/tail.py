@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""
+Change-data tail mode for the user_data generators, like `tail -f`.
+
+follow_rows() streams every row of a table, then keeps polling for rows
+inserted after the last one it yielded. Progress is tracked with a
+watermark: the highest value of an increasing column seen so far (the
+rowid on SQLite, an AUTO_INCREMENT column on MySQL). Each poll only asks
+the database for MAX(watermark), a single index lookup, and new rows are
+read with one range query (WHERE watermark > last AND watermark <= max),
+so a quiet table costs almost nothing to follow.
+
+The polling interval adapts: it starts at min_interval and doubles while
+nothing new arrives, up to max_interval, then drops back as soon as new
+rows show up.
+
+Python's sqlite3 module does not expose SQLite's update hook, so a writer
+in the same process can instead wake the follower up through a
+threading.Event, either by setting it itself or with watch_inserts(),
+which sets it whenever the writer's connection runs an INSERT or COMMIT.
+"""
+
+import time
+
+from streaming import is_sqlite, placeholder, stream_rows, DEFAULT_ARRAYSIZE, TABLE_NAME
+
+
+def high_watermark(connection, table_name=TABLE_NAME, watermark='rowid'):
+	"""Returns the highest watermark in the table (None if it is empty)"""
+	cursor = connection.cursor()
+	try:
+		cursor.execute(f"SELECT MAX({watermark}) FROM {table_name}")
+		return cursor.fetchone()[0]
+	finally:
+		cursor.close()
+
+
+def watch_inserts(connection, event, table_name=TABLE_NAME):
+	"""
+	Sets event whenever a sqlite3 connection inserts into the table or
+	commits, so that a follower sharing the event polls right away.
+
+	Uses the connection's trace callback, replacing any other one. The
+	callback runs as a statement starts, so the follower may poll before
+	the commit is done; it then polls again after min_interval.
+
+	Args:
+	    connection: The sqlite3 connection of the writer
+	    event(threading.Event): Event the follower waits on
+	    table_name(str): Table whose inserts are watched
+	"""
+	table = table_name.lower()
+
+	def trace(statement):
+		words = statement.lstrip().lower()
+		if words.startswith('commit') or (words.startswith('insert') and table in words):
+			event.set()
+
+	connection.set_trace_callback(trace)
+
+
+def follow_rows(connection, table_name=TABLE_NAME, watermark=None, after=None,
+		arraysize=DEFAULT_ARRAYSIZE, dictionary=False, compact=False,
+		min_interval=0.1, max_interval=5.0, wakeup=None, stop=None,
+		close_connection=False):
+	"""
+	Generator that yields the rows of a table, then the rows inserted into
+	it afterwards, until it is closed or stop is set.
+
+	Rows only show up once they are committed. On MySQL, rows committed
+	out of watermark order (a transaction holding a lower AUTO_INCREMENT
+	value committing after a higher one) can be missed; on SQLite writes
+	are serialized so this cannot happen. SQLite may reuse the rowid of the
+	last row if it is deleted, unless the key is INTEGER PRIMARY KEY
+	AUTOINCREMENT.
+
+	Args:
+	    connection: sqlite3 or mysql.connector connection
+	    table_name(str): Table to follow
+	    watermark(str): Increasing, indexed column; defaults to rowid on
+	        SQLite and is required on MySQL
+	    after: Watermark to start after (None starts with the existing rows)
+	    arraysize(int): Number of rows fetched from the driver at a time
+	    dictionary(bool): Yield rows as dicts instead of tuples
+	    compact(bool): Yield compact records (see rows.py)
+	    min_interval(float): Shortest time between two polls, in seconds
+	    max_interval(float): Longest time between two polls, in seconds
+	    wakeup(threading.Event): Optional event that triggers a poll as soon
+	        as it is set (see watch_inserts)
+	    stop(threading.Event): Optional event that ends the stream
+	    close_connection(bool): Close the connection once the stream ends
+
+	Yields:
+	    One row at a time, in watermark order for the new rows
+	"""
+	try:
+		if watermark is None:
+			if not is_sqlite(connection):
+				raise ValueError("Following a MySQL table needs an increasing "
+					"watermark column, e.g. an AUTO_INCREMENT id")
+			watermark = 'rowid'
+		if not 0 < min_interval <= max_interval:
+			raise ValueError("Poll intervals must satisfy 0 < min_interval <= max_interval")
+
+		mark = placeholder(connection)
+		interval = min_interval
+		while stop is None or not stop.is_set():
+			if not is_sqlite(connection):
+				# End the read transaction so the next query sees new commits
+				connection.commit()
+
+			high = high_watermark(connection, table_name, watermark)
+			if high is not None and (after is None or high > after):
+				query = f"SELECT * FROM {table_name} WHERE {watermark} <= {mark}"
+				params = (high,)
+				if after is not None:
+					query += f" AND {watermark} > {mark}"
+					params += (after,)
+				query += f" ORDER BY {watermark}"
+				yield from stream_rows(connection, query, params, arraysize,
+					dictionary, compact=compact)
+				after = high
+				interval = min_interval
+				continue
+
+			# Nothing new: wait, a little longer every time
+			if wakeup is not None:
+				if wakeup.wait(interval):
+					wakeup.clear()
+					interval = min_interval
+					continue
+			elif stop is not None:
+				stop.wait(interval)
+			else:
+				time.sleep(interval)
+			interval = min(interval * 2, max_interval)
+	finally:
+		if close_connection:
+			connection.close()
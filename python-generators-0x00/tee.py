@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Fan-out of a single user_data scan to several consumers.
+
+Jobs that each need the whole table (the age statistics, the users above
+25, an export...) normally run one full scan each. StreamTee reads the
+batches of one scan and hands every batch to all of its registered
+consumers, so N jobs cost a single scan:
+
+    tee = StreamTee(stream_users_in_batches(1000))
+    stats = StreamStats()
+    tee.register(lambda batch: stats.update_many(user['age'] for user in batch))
+    tee.register(writer.write_rows, threaded=True, buffer=8)
+    tee.run()
+
+A consumer is a callable receiving each batch. It runs either inline, in
+the thread driving the scan, or in a worker thread of its own that takes
+batches from a bounded queue. When a worker's queue is full the scan waits
+for it (backpressure), so a slow consumer slows the scan down instead of
+making the batches pile up in memory; at most `buffer` batches are queued
+per consumer. Batches are shared between consumers and must not be
+modified.
+
+A consumer that needs no more batches raises StopIteration: it is dropped
+and the others go on. Once every consumer is done the scan stops early.
+"""
+
+import queue
+import threading
+
+# Marks the end of the stream in the consumers' queues
+_DONE = object()
+
+
+class _Consumer:
+	"""A registered consumer and, when threaded, its queue and thread"""
+
+	def __init__(self, function, name, threaded, buffer):
+		self.function = function
+		self.name = name
+		self.threaded = threaded
+		self.queue = queue.Queue(maxsize=buffer) if threaded else None
+		self.thread = None
+		self.batches = 0
+		self.waits = 0
+		self.closed = False
+
+
+class StreamTee:
+	"""
+	Broadcasts the batches of one stream to several consumers.
+
+	Args:
+	    source: Iterable of batches, e.g. stream_users_in_batches(1000)
+	"""
+
+	def __init__(self, source):
+		self.source = source
+		self.consumers = []
+		self.batches = 0
+		self.rows = 0
+		self.failed = None
+		self._stop = threading.Event()
+		self._errors = []
+		self._lock = threading.Lock()
+
+	def register(self, consumer, threaded=False, buffer=4, name=None):
+		"""
+		Adds a consumer of the batches.
+
+		Args:
+		    consumer: Callable receiving each batch
+		    threaded(bool): Run the consumer in its own worker thread
+		    buffer(int): With threaded, the number of batches that can wait
+		        in its queue before the scan waits for it
+
+		Returns:
+		    StreamTee: self, so registrations can be chained
+		"""
+		if buffer <= 0:
+			raise ValueError("Consumer buffer must be a positive integer")
+		if name is None:
+			name = getattr(consumer, '__name__', '<lambda>')
+			if name == '<lambda>':
+				name = f"consumer-{len(self.consumers)}"
+		self.consumers.append(_Consumer(consumer, name, threaded, buffer))
+		return self
+
+	def _fail(self, consumer, error):
+		with self._lock:
+			self._errors.append((consumer.name, error))
+		self._stop.set()
+
+	def _work(self, consumer):
+		"""Worker thread of a threaded consumer"""
+		while not self._stop.is_set():
+			try:
+				batch = consumer.queue.get(timeout=0.1)
+			except queue.Empty:
+				continue
+			if batch is _DONE:
+				return
+			try:
+				consumer.function(batch)
+				consumer.batches += 1
+			except StopIteration:
+				consumer.closed = True
+				return
+			except Exception as e:
+				self._fail(consumer, e)
+				return
+
+	def _put(self, consumer, item):
+		# Wait for room in the consumer's queue unless the tee is stopping
+		# or the consumer has closed
+		if consumer.queue.full():
+			consumer.waits += 1
+		while not self._stop.is_set() and not consumer.closed:
+			try:
+				consumer.queue.put(item, timeout=0.1)
+				return
+			except queue.Full:
+				continue
+
+	def run(self):
+		"""
+		Reads the whole source and feeds every batch to every consumer.
+
+		If a consumer raises, the scan stops, the other consumers are
+		stopped and the first error is re-raised once every worker thread
+		has ended (its consumer's name is in self.failed). A consumer
+		raising StopIteration only closes itself.
+
+		Returns:
+		    dict: batches and rows read, and per consumer name the batches
+		        it processed, how many times the scan waited for it and
+		        whether it closed early
+		"""
+		if not self.consumers:
+			raise ValueError("No consumer registered")
+
+		for consumer in self.consumers:
+			if consumer.threaded:
+				consumer.thread = threading.Thread(target=self._work,
+					args=(consumer,), name=f"tee-{consumer.name}", daemon=True)
+				consumer.thread.start()
+
+		try:
+			for batch in self.source:
+				if self._stop.is_set():
+					break
+				if all(consumer.closed for consumer in self.consumers):
+					break
+				self.batches += 1
+				self.rows += len(batch)
+				for consumer in self.consumers:
+					if consumer.closed:
+						continue
+					if consumer.threaded:
+						self._put(consumer, batch)
+						continue
+					try:
+						consumer.function(batch)
+						consumer.batches += 1
+					except StopIteration:
+						consumer.closed = True
+					except Exception as e:
+						self._fail(consumer, e)
+						break
+		finally:
+			for consumer in self.consumers:
+				if consumer.threaded:
+					self._put(consumer, _DONE)
+			for consumer in self.consumers:
+				if consumer.thread is not None:
+					consumer.thread.join()
+			if hasattr(self.source, 'close'):
+				self.source.close()
+
+		if self._errors:
+			self.failed, error = self._errors[0]
+			raise error
+
+		return {
+			'batches': self.batches,
+			'rows': self.rows,
+			'consumers': {
+				consumer.name: {'batches': consumer.batches, 'waits': consumer.waits,
+					'closed': consumer.closed}
+				for consumer in self.consumers
+			},
+		}
+
+
+if __name__ == "__main__":
+	import sys
+
+	from stats import StreamStats
+	from streaming import connect, describe
+
+	stream_users_in_batches = __import__('1-batch_processing').stream_users_in_batches
+
+	# One scan computes the age statistics, counts the users above 25 and,
+	# given a path, exports the table
+	ages = StreamStats()
+	above_25 = []
+
+	def age_statistics(batch):
+		ages.update_many(user['age'] for user in batch)
+
+	def batch_processing(batch):
+		above_25.append(sum(1 for user in batch if user['age'] > 25))
+
+	tee = StreamTee(stream_users_in_batches(1000))
+	tee.register(age_statistics)
+	tee.register(batch_processing, threaded=True)
+
+	writer = None
+	if len(sys.argv) > 1:
+		from export import column_types, ColumnarWriter
+
+		connection = connect()
+		columns = [column[0] for column in describe(connection)]
+		types = column_types(connection, columns)
+		connection.close()
+		writer = ColumnarWriter(sys.argv[1], columns, types=types)
+		tee.register(writer.write_rows, threaded=True, buffer=8, name='export')
+
+	try:
+		report = tee.run()
+	finally:
+		if writer is not None:
+			writer.close()
+	print(f"Scanned {report['rows']} users once")
+	print(f"Average age: {ages.result()['mean']:.2f}")
+	print(f"Users above 25: {sum(above_25)}")
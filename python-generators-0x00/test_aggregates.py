@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""test cases for the maintained age aggregates of the aggregates module"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from aggregates import (age_statistics, enable_replace_triggers, ensure_age_aggregates,
+		read_age_aggregates, verify_age_aggregates)
+from streaming import connect
+
+
+class TestAgeAggregates(unittest.TestCase):
+	"""Test cases for the triggers keeping the aggregates up to date"""
+
+	def setUp(self):
+		"""Creates a user_data table of three users with the aggregates installed"""
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'user_data.db')
+		self.connection = connect(self.path)
+		self.connection.execute(
+			"CREATE TABLE user_data (user_id TEXT PRIMARY KEY, name TEXT, age INTEGER)")
+		self.connection.executemany("INSERT INTO user_data VALUES (?, ?, ?)",
+			[('a', 'A', 20), ('b', 'B', 30), ('c', 'C', 40)])
+		self.assertTrue(ensure_age_aggregates(self.connection))
+
+	def tearDown(self):
+		"""Closes the connection and removes the database"""
+		self.connection.close()
+		shutil.rmtree(self.directory)
+
+	def assertAggregates(self, count, mean):
+		"""The maintained aggregates verify and hold count users of the given mean"""
+		self.connection.commit()
+		ok, maintained, recomputed = verify_age_aggregates(self.connection)
+		self.assertTrue(ok, (maintained, recomputed))
+		statistics = age_statistics(maintained)
+		self.assertEqual(statistics['count'], count)
+		self.assertAlmostEqual(statistics['mean'], mean)
+
+	def test_insert_delete(self):
+		"""Inserted and deleted rows are added and removed"""
+		self.connection.execute("INSERT INTO user_data VALUES ('d', 'D', 50)")
+		self.connection.execute("DELETE FROM user_data WHERE user_id = 'a'")
+		self.assertAggregates(3, 40)
+
+	def test_update_age(self):
+		"""An updated age moves the user to its new bucket"""
+		self.connection.execute("UPDATE user_data SET age = 65 WHERE user_id = 'a'")
+		self.assertAggregates(3, 45)
+		self.assertEqual(read_age_aggregates(self.connection)['buckets'], {3: 1, 4: 1, 6: 1})
+
+	def test_replace(self):
+		"""REPLACE counts the new row instead of both"""
+		self.connection.execute("INSERT OR REPLACE INTO user_data VALUES ('a', 'A', 50)")
+		self.connection.execute("REPLACE INTO user_data VALUES ('e', 'E', 60)")
+		self.assertAggregates(4, 45)
+
+	def test_upsert(self):
+		"""An upsert of an existing user is an update"""
+		self.connection.execute(
+			"INSERT INTO user_data VALUES ('b', 'B', 70) "
+			"ON CONFLICT(user_id) DO UPDATE SET age = excluded.age")
+		self.assertAggregates(3, 130 / 3)
+
+	def test_other_connections(self):
+		"""REPLACE from a new connection is counted once once prepared"""
+		self.connection.commit()
+		writer = sqlite3.connect(self.path)
+		self.addCleanup(writer.close)
+		enable_replace_triggers(writer)
+		writer.execute("REPLACE INTO user_data VALUES ('c', 'C', 10)")
+		writer.commit()
+		self.assertAggregates(3, 20)
+
+		writer = connect(self.path)
+		self.addCleanup(writer.close)
+		writer.execute("REPLACE INTO user_data VALUES ('c', 'C', 40)")
+		writer.commit()
+		self.assertAggregates(3, 30)
+
+	def test_already_installed(self):
+		"""ensure_age_aggregates() leaves installed aggregates alone"""
+		self.connection.commit()
+		self.assertFalse(ensure_age_aggregates(self.connection))
+		self.assertFalse(ensure_age_aggregates(self.connection, verify=True))
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+"""test cases for the async_streaming module"""
+
+import asyncio
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from contextlib import aclosing
+from unittest.mock import patch
+
+import async_streaming
+from async_streaming import (async_connect, async_lazy_paginate_users, async_stream_user_ages,
+		async_stream_users, async_stream_users_in_batches, read_ahead)
+
+
+class AsyncStreamingTestCase(unittest.IsolatedAsyncioTestCase):
+	"""Creates a user_data table of 10 users; generators open connections to it"""
+
+	def setUp(self):
+		"""Creates the database and records the connections opened on it"""
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'user_data.db')
+		self.keys = [f"user-{i:02d}" for i in range(10)]
+		with sqlite3.connect(self.path) as connection:
+			connection.execute("CREATE TABLE user_data (user_id TEXT PRIMARY KEY, age INTEGER)")
+			connection.executemany("INSERT INTO user_data VALUES (?, ?)",
+				[(key, 20 + i) for i, key in enumerate(self.keys)])
+		self.opened = []
+
+		async def connect(database_path=None, row_factory=None):
+			connection = await async_connect(self.path, row_factory)
+			self.opened.append(connection)
+			return connection
+
+		opener = patch.object(async_streaming, 'async_connect', connect)
+		opener.start()
+		self.addCleanup(opener.stop)
+
+	def tearDown(self):
+		"""Removes the database"""
+		shutil.rmtree(self.directory)
+
+	def assertClosed(self, connection):
+		"""The aiosqlite connection has been closed"""
+		self.assertIsNone(connection._connection)
+
+	async def collect(self, stream):
+		"""Returns every item of an async generator"""
+		return [item async for item in stream]
+
+
+class TestStreams(AsyncStreamingTestCase):
+	"""Test cases for whole scans"""
+
+	async def test_stream_users(self):
+		"""Every user comes once, with or without read-ahead"""
+		for depth in (0, 2):
+			rows = await self.collect(async_stream_users(arraysize=3, read_ahead_chunks=depth))
+			self.assertEqual(sorted(row[0] for row in rows), self.keys)
+		for connection in self.opened:
+			self.assertClosed(connection)
+
+	async def test_batches(self):
+		"""Keyset batches in key order, resuming after a key"""
+		batches = await self.collect(async_stream_users_in_batches(4, read_ahead_batches=1))
+		self.assertEqual([len(batch) for batch in batches], [4, 4, 2])
+		self.assertEqual([user['user_id'] for batch in batches for user in batch], self.keys)
+		batches = await self.collect(async_stream_users_in_batches(4, after='user-07'))
+		self.assertEqual([user['user_id'] for batch in batches for user in batch],
+			['user-08', 'user-09'])
+
+	async def test_lazy_pages_and_ages(self):
+		"""Users and ages one at a time"""
+		users = await self.collect(async_lazy_paginate_users(3, read_ahead_pages=2))
+		self.assertEqual([user['user_id'] for user in users], self.keys)
+		self.assertEqual(await self.collect(async_stream_user_ages(batch_size=3)),
+			list(range(20, 30)))
+
+
+class TestEarlyClose(AsyncStreamingTestCase):
+	"""Test cases for generators closed or cancelled before the end"""
+
+	async def test_break(self):
+		"""Breaking out of aclosing() closes the generator's own connection"""
+		for depth in (0, 2):
+			async with aclosing(async_stream_users(arraysize=2, read_ahead_chunks=depth)) as rows:
+				async for _ in rows:
+					break
+			self.assertClosed(self.opened[-1])
+
+	async def test_shared_connection_kept(self):
+		"""A connection passed in stays open when the generator is closed"""
+		connection = await async_connect(self.path, sqlite3.Row)
+		self.addAsyncCleanup(connection.close)
+		async with aclosing(async_lazy_paginate_users(2, connection, read_ahead_pages=1)) as users:
+			async for _ in users:
+				break
+		self.assertEqual(self.opened, [])
+		async with connection.execute("SELECT COUNT(*) FROM user_data") as cursor:
+			self.assertEqual((await cursor.fetchone())[0], 10)
+
+	async def test_cancel(self):
+		"""Cancelling the consuming task closes the connection and the read-ahead task"""
+		started = asyncio.Event()
+
+		async def consume():
+			stream = async_stream_users_in_batches(1, read_ahead_batches=2)
+			async with aclosing(stream) as batches:
+				async for _ in batches:
+					started.set()
+					await asyncio.sleep(10)
+
+		tasks = asyncio.all_tasks()
+		task = asyncio.create_task(consume())
+		await started.wait()
+		task.cancel()
+		with self.assertRaises(asyncio.CancelledError):
+			await task
+		self.assertClosed(self.opened[-1])
+		self.assertEqual(asyncio.all_tasks() - tasks, set())
+
+	async def test_cancel_during_query(self):
+		"""A task cancelled while the generator awaits a fetch closes it"""
+		fetching = asyncio.Event()
+		fetchmany = async_streaming.aiosqlite.Cursor.fetchmany
+
+		async def slow_fetchmany(cursor, size=None):
+			fetching.set()
+			await asyncio.sleep(10)
+			return await fetchmany(cursor, size)
+
+		async def consume():
+			async for _ in async_stream_users(arraysize=2):
+				pass
+
+		with patch.object(async_streaming.aiosqlite.Cursor, 'fetchmany', slow_fetchmany):
+			task = asyncio.create_task(consume())
+			await fetching.wait()
+			task.cancel()
+			with self.assertRaises(asyncio.CancelledError):
+				await task
+		self.assertClosed(self.opened[-1])
+
+
+class TestReadAhead(unittest.IsolatedAsyncioTestCase):
+	"""Test cases for read_ahead"""
+
+	async def test_bounded(self):
+		"""At most depth items are read ahead of the consumer"""
+		produced = []
+		consumed = []
+		lead = 0
+
+		async def source():
+			nonlocal lead
+			for i in range(20):
+				produced.append(i)
+				lead = max(lead, len(produced) - len(consumed))
+				yield i
+
+		async for item in read_ahead(source(), depth=3):
+			await asyncio.sleep(0)
+			consumed.append(item)
+		self.assertEqual(consumed, list(range(20)))
+		# The queued items, the one consumed and the one being put
+		self.assertLessEqual(lead, 3 + 2)
+
+	async def test_error(self):
+		"""An error of the source is raised in the consumer"""
+		async def source():
+			yield 1
+			raise RuntimeError("source failed")
+
+		items = []
+		with self.assertRaises(RuntimeError):
+			async for item in read_ahead(source()):
+				items.append(item)
+		self.assertEqual(items, [1])
+
+	async def test_early_close(self):
+		"""Closing the consumer closes the source"""
+		closed = asyncio.Event()
+
+		async def source():
+			try:
+				for i in range(100):
+					yield i
+			finally:
+				closed.set()
+
+		async with aclosing(read_ahead(source(), depth=1)) as items:
+			async for _ in items:
+				break
+		self.assertTrue(closed.is_set())
+
+	async def test_invalid_depth(self):
+		"""The depth must be positive"""
+		with self.assertRaises(ValueError):
+			await anext(read_ahead(None, depth=0))
+
+
+if __name__ == "__main__":
+	unittest.main()
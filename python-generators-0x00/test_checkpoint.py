@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""test cases for the checkpoint module"""
+
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import unittest
+from collections import Counter
+from contextlib import redirect_stdout
+from io import StringIO
+
+from checkpoint import run_checkpointed, Checkpoint
+from streaming import connect, keyset_batches
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Job run in a child process: each batch goes to the seen table of the
+# output database, and the process dies right after the consumer commits
+# its batch number crash_after, before the checkpoint is saved
+JOB = """
+import os, sqlite3
+from checkpoint import run_checkpointed
+from streaming import connect, keyset_batches
+
+source = connect({source!r}, row_factory=sqlite3.Row)
+output = sqlite3.connect({output!r})
+consumed = []
+
+def consume(batch, *last_key):
+	output.executemany("INSERT INTO seen VALUES (?)", [(row['user_id'],) for row in batch])
+	if last_key:
+		output.execute("UPDATE watermark SET last_key = ?", last_key)
+	output.commit()
+	consumed.append(batch)
+	if len(consumed) == {crash_after}:
+		os._exit(3)
+
+def committed():
+	return output.execute("SELECT last_key FROM watermark").fetchone()[0]
+
+run_checkpointed(lambda after: keyset_batches(source, 2, after=after), consume,
+	{checkpoint!r}, every={every}, committed=committed if {exactly} else None)
+"""
+
+
+class CheckpointTestCase(unittest.TestCase):
+	"""Creates a user_data table of 10 users and an output database"""
+
+	def setUp(self):
+		"""Creates the databases in a temporary directory"""
+		self.directory = tempfile.mkdtemp()
+		self.source = os.path.join(self.directory, 'user_data.db')
+		self.output = os.path.join(self.directory, 'output.db')
+		self.checkpoint = os.path.join(self.directory, 'job.json')
+		self.keys = [f"user-{i:02d}" for i in range(10)]
+		with sqlite3.connect(self.source) as connection:
+			connection.execute("CREATE TABLE user_data (user_id TEXT PRIMARY KEY, age INTEGER)")
+			connection.executemany("INSERT INTO user_data VALUES (?, 30)",
+				[(key,) for key in self.keys])
+		with sqlite3.connect(self.output) as connection:
+			connection.execute("CREATE TABLE seen (user_id TEXT)")
+			connection.execute("CREATE TABLE watermark (last_key TEXT)")
+			connection.execute("INSERT INTO watermark VALUES (NULL)")
+
+	def tearDown(self):
+		"""Removes the temporary directory"""
+		shutil.rmtree(self.directory)
+
+	def run_job(self, crash_after=0, every=1, exactly=False):
+		"""Runs the job in a child process and returns its exit code"""
+		code = JOB.format(source=self.source, output=self.output,
+			checkpoint=self.checkpoint, crash_after=crash_after, every=every,
+			exactly=exactly)
+		return subprocess.run([sys.executable, '-c', code], cwd=HERE,
+			stdout=subprocess.DEVNULL).returncode
+
+	def seen(self):
+		"""Returns how many times the consumer stored each key"""
+		with sqlite3.connect(self.output) as connection:
+			return Counter(key for key, in connection.execute("SELECT user_id FROM seen"))
+
+
+class TestResume(CheckpointTestCase):
+	"""Test cases for a job killed in the middle of a run"""
+
+	def test_at_least_once(self):
+		"""A resumed job skips nothing and replays only the unsaved batch"""
+		self.assertEqual(self.run_job(crash_after=3), 3)
+		self.assertEqual(Checkpoint(self.checkpoint).last_key, 'user-03')
+		self.assertEqual(self.run_job(), 0)
+
+		seen = self.seen()
+		self.assertEqual(sorted(seen), self.keys)
+		self.assertEqual(sorted(key for key, count in seen.items() if count > 1),
+			['user-04', 'user-05'])
+		self.assertTrue(Checkpoint(self.checkpoint).done)
+
+	def test_interval_replay(self):
+		"""With every=3, up to three finished batches are replayed"""
+		self.assertEqual(self.run_job(crash_after=2, every=3), 3)
+		self.assertIsNone(Checkpoint(self.checkpoint).last_key)
+		self.assertEqual(self.run_job(every=3), 0)
+
+		seen = self.seen()
+		self.assertEqual(sorted(seen), self.keys)
+		self.assertEqual(sum(seen.values()), len(self.keys) + 4)
+
+	def test_exactly_once(self):
+		"""With committed, the consumer's own watermark is resumed from"""
+		self.assertEqual(self.run_job(crash_after=3, exactly=True), 3)
+		self.assertEqual(self.run_job(crash_after=1, exactly=True), 3)
+		self.assertEqual(self.run_job(exactly=True), 0)
+
+		self.assertEqual(self.seen(), Counter(self.keys))
+		checkpoint = Checkpoint(self.checkpoint)
+		self.assertTrue(checkpoint.done)
+		self.assertEqual(checkpoint.last_key, self.keys[-1])
+
+
+class TestRunCheckpointed(CheckpointTestCase):
+	"""Test cases for run_checkpointed within one process"""
+
+	def setUp(self):
+		"""Opens the user_data table"""
+		super().setUp()
+		self.connection = connect(self.source, row_factory=sqlite3.Row)
+		self.addCleanup(self.connection.close)
+
+	def run_checkpointed(self, consumer, **options):
+		"""Runs a job over batches of 3 users, silently"""
+		with redirect_stdout(StringIO()):
+			return run_checkpointed(
+				lambda after: keyset_batches(self.connection, 3, after=after),
+				consumer, self.checkpoint, **options)
+
+	def test_consumer_error(self):
+		"""A failed batch is saved as unfinished and handed over on resume"""
+		batches = []
+
+		def fail_second(batch):
+			if len(batches) == 1:
+				raise RuntimeError("consumer failed")
+			batches.append([row['user_id'] for row in batch])
+
+		with self.assertRaises(RuntimeError):
+			self.run_checkpointed(fail_second)
+		self.assertEqual(Checkpoint(self.checkpoint).rows, 3)
+		checkpoint = self.run_checkpointed(lambda batch: batches.append(
+			[row['user_id'] for row in batch]))
+		self.assertEqual(sum(batches, []), self.keys)
+		self.assertEqual((checkpoint.rows, checkpoint.batches), (10, 4))
+
+	def test_completed(self):
+		"""A completed job starts over, unless skip_completed is set"""
+		rows = []
+		self.run_checkpointed(rows.extend)
+		self.run_checkpointed(rows.extend, skip_completed=True)
+		self.assertEqual(len(rows), 10)
+		self.run_checkpointed(rows.extend)
+		self.assertEqual(len(rows), 20)
+
+	def test_invalid_interval(self):
+		"""The checkpoint interval must be positive"""
+		with self.assertRaises(ValueError):
+			self.run_checkpointed(print, every=0)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""test cases for the export module"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+import pyarrow as pa
+
+from export import (arrow_type, column_array, column_types, declared_types,
+		export_batches, export_users, read_export, storage_type, ColumnarWriter)
+
+FORMATS = ('parquet', 'arrow')
+
+
+class ExportTestCase(unittest.TestCase):
+	"""Creates a temporary directory and a user_data table for each test"""
+
+	def setUp(self):
+		"""Creates the directory and an empty user_data table"""
+		self.directory = tempfile.mkdtemp()
+		self.connection = sqlite3.connect(':memory:')
+		self.connection.execute("""
+			CREATE TABLE user_data (
+				user_id CHAR(36) PRIMARY KEY,
+				name VARCHAR(255) NOT NULL,
+				email VARCHAR(255),
+				age DECIMAL(5,2) NOT NULL
+			)""")
+
+	def tearDown(self):
+		"""Closes the connection and removes the directory"""
+		self.connection.close()
+		shutil.rmtree(self.directory)
+
+	def path(self, file_format):
+		"""Returns the path of an export file in the directory"""
+		return os.path.join(self.directory, f"users.{file_format}")
+
+	def insert(self, rows):
+		"""Inserts (user_id, name, email, age) rows"""
+		self.connection.executemany("INSERT INTO user_data VALUES (?, ?, ?, ?)", rows)
+
+	def export(self, file_format, row_group_size=2):
+		"""Exports the table and reads it back"""
+		path = self.path(file_format)
+		written = export_users(path, file_format, row_group_size=row_group_size,
+			batch_size=2, connection=self.connection)
+		table = read_export(path)
+		self.assertEqual(written, table.num_rows)
+		return table
+
+
+class TestTypes(ExportTestCase):
+	"""Test cases for the column types of an export"""
+
+	def test_arrow_type(self):
+		"""Declared SQL types map to Arrow types"""
+		self.assertEqual(arrow_type('INTEGER'), pa.int64())
+		self.assertEqual(arrow_type('int(11)'), pa.int64())
+		self.assertEqual(arrow_type('CHAR(36)'), pa.string())
+		self.assertEqual(arrow_type('decimal(5,2)'), pa.float64())
+		self.assertEqual(arrow_type('BLOB'), pa.binary())
+		self.assertIsNone(arrow_type(''))
+		self.assertIsNone(arrow_type(None))
+
+	def test_declared_types(self):
+		"""The declared types are read from the table"""
+		self.assertEqual(declared_types(self.connection)['age'], 'DECIMAL(5,2)')
+
+	def test_storage_type(self):
+		"""SQLite storage classes are widened to one Arrow type"""
+		self.assertEqual(storage_type({'integer', 'null'}), pa.int64())
+		self.assertEqual(storage_type({'integer', 'real'}), pa.float64())
+		self.assertEqual(storage_type({'integer', 'text'}), pa.string())
+		self.assertIsNone(storage_type({'null'}))
+
+	def test_column_types(self):
+		"""The values stored in SQLite win over the declared types"""
+		self.connection.execute("CREATE TABLE t (n INTEGER, s TEXT, e TEXT)")
+		self.connection.executemany("INSERT INTO t VALUES (?, ?, ?)",
+			[(1, 'a', None), (2.5, 3, None)])
+		self.assertEqual(column_types(self.connection, ['n', 's', 'e'], 't'),
+			[pa.float64(), pa.string(), pa.string()])
+
+	def test_lossy_cast_refused(self):
+		"""A fraction is never truncated to fit an integer column"""
+		with self.assertRaises(ValueError):
+			column_array([30, 30.5], pa.int64())
+		self.assertEqual(column_array([30, None], pa.float64()).to_pylist(), [30.0, None])
+
+
+class TestSchemaAcrossGroups(ExportTestCase):
+	"""Test cases for values whose type changes between row groups"""
+
+	def test_fraction_in_later_group(self):
+		"""A fraction after whole numbers is written as it is"""
+		self.insert([('a', 'A', 'a@x', 30), ('b', 'B', 'b@x', 31), ('c', 'C', 'c@x', 30.5)])
+		for file_format in FORMATS:
+			table = self.export(file_format)
+			self.assertEqual(table.schema.field('age').type, pa.float64())
+			self.assertEqual(table.column('age').to_pylist(), [30.0, 31.0, 30.5])
+
+	def test_fraction_in_integer_column(self):
+		"""SQLite keeps a fraction in an INTEGER column: it is exported too"""
+		self.connection.execute("CREATE TABLE t (user_id INTEGER PRIMARY KEY, age INTEGER)")
+		self.connection.executemany("INSERT INTO t VALUES (?, ?)", [(1, 30), (2, 31), (3, 30.5)])
+		path = self.path('parquet')
+		export_users(path, row_group_size=2, batch_size=2, connection=self.connection,
+			table_name='t')
+		self.assertEqual(read_export(path).column('age').to_pylist(), [30.0, 31.0, 30.5])
+
+	def test_nulls_in_first_group(self):
+		"""A column only NULL in the first group keeps its declared type"""
+		self.insert([('a', 'A', None, 30), ('b', 'B', None, 31), ('c', 'C', 'c@x', 32)])
+		for file_format in FORMATS:
+			table = self.export(file_format)
+			self.assertEqual(table.schema.field('email').type, pa.string())
+			self.assertEqual(table.column('email').to_pylist(), [None, None, 'c@x'])
+
+	def test_empty_table(self):
+		"""An empty table still gets a file, with its schema"""
+		for file_format in FORMATS:
+			table = self.export(file_format)
+			self.assertEqual(table.num_rows, 0)
+			self.assertEqual(table.schema.names, ['user_id', 'name', 'email', 'age'])
+			self.assertEqual(table.schema.field('age').type, pa.float64())
+
+	def test_inferred_types(self):
+		"""Without types, the first group fixes them and lossy rows are refused"""
+		path = self.path('parquet')
+		with self.assertRaises(ValueError):
+			export_batches([[(1, None)], [(2.5, None)]], path, ['n', 'note'],
+				row_group_size=1)
+		written = export_batches([[(1, None)], [(2, 'x')]], path, ['n', 'note'],
+			row_group_size=1)
+		self.assertEqual(written, 2)
+		self.assertEqual(read_export(path).to_pylist(),
+			[{'n': 1, 'note': None}, {'n': 2, 'note': 'x'}])
+
+	def test_writer_validates(self):
+		"""One type per column is required"""
+		with self.assertRaises(ValueError):
+			ColumnarWriter(self.path('arrow'), ['a', 'b'], 'arrow', types=[pa.int64()])
+
+
+if __name__ == "__main__":
+	unittest.main()
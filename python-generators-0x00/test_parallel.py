@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""test cases for the key-range partitioning of the parallel module"""
+
+import functools
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+import uuid
+
+from parallel import parallel_batch_processing, parallel_stats, partition_bounds
+from streaming import connect_readonly
+
+
+def make_table(keys, path=':memory:'):
+	"""Returns a user_data table holding keys, aged 30"""
+	connection = sqlite3.connect(path)
+	connection.execute("CREATE TABLE user_data (user_id TEXT PRIMARY KEY, age INTEGER)")
+	connection.executemany("INSERT INTO user_data VALUES (?, 30)", [(key,) for key in keys])
+	connection.commit()
+	return connection
+
+
+class TestPartitionBounds(unittest.TestCase):
+	"""Test cases for partition_bounds"""
+
+	def bounds(self, keys, partitions):
+		"""Returns the ranges of a table of keys and the statements run"""
+		connection = make_table(keys)
+		statements = []
+		connection.set_trace_callback(statements.append)
+		try:
+			return partition_bounds(connection, partitions), statements
+		finally:
+			connection.close()
+
+	def assertCovers(self, ranges, keys):
+		"""The ranges are contiguous, none is empty and together they hold every key"""
+		self.assertEqual(ranges[0][0], None)
+		self.assertEqual(ranges[-1][1], None)
+		for (_, until), (after, _) in zip(ranges, ranges[1:]):
+			self.assertEqual(until, after)
+		for after, until in ranges:
+			self.assertTrue(any((after is None or key > after)
+				and (until is None or key <= until) for key in keys))
+
+	def test_empty_table(self):
+		"""An empty table has no range"""
+		ranges, statements = self.bounds([], 4)
+		self.assertEqual(ranges, [])
+		self.assertFalse([sql for sql in statements if 'OFFSET' in sql])
+
+	def test_one_row(self):
+		"""A single row is a single unbounded range"""
+		ranges, statements = self.bounds(['a'], 4)
+		self.assertEqual(ranges, [(None, None)])
+		self.assertFalse([sql for sql in statements if 'OFFSET' in sql])
+
+	def test_fewer_rows_than_partitions(self):
+		"""No negative OFFSET is sent and no range is empty"""
+		keys = sorted(str(uuid.uuid4()) for _ in range(3))
+		ranges, statements = self.bounds(keys, 8)
+		offsets = [int(sql.rsplit('OFFSET', 1)[1]) for sql in statements if 'OFFSET' in sql]
+		self.assertEqual(offsets, [0, 1])
+		self.assertEqual(len(ranges), 3)
+		self.assertCovers(ranges, keys)
+
+	def test_balanced(self):
+		"""Sampled bounds split the rows evenly"""
+		keys = sorted(str(uuid.uuid4()) for _ in range(100))
+		ranges, _ = self.bounds(keys, 4)
+		self.assertEqual([until for _, until in ranges[:-1]],
+			[keys[24], keys[49], keys[74]])
+
+	def test_integer_keys(self):
+		"""Integer keys are split between MIN and MAX, never into empty ranges"""
+		connection = sqlite3.connect(':memory:')
+		self.addCleanup(connection.close)
+		connection.execute("CREATE TABLE t (id INTEGER PRIMARY KEY)")
+		connection.executemany("INSERT INTO t VALUES (?)", [(1,), (2,)])
+		self.assertEqual(partition_bounds(connection, 8, 't', 'id'), [(None, 1), (1, None)])
+
+	def test_invalid_partitions(self):
+		"""At least one partition is needed"""
+		connection = make_table([])
+		self.addCleanup(connection.close)
+		with self.assertRaises(ValueError):
+			partition_bounds(connection, 0)
+
+
+class TestParallelScan(unittest.TestCase):
+	"""Test cases for parallel scans of empty and tiny tables"""
+
+	def setUp(self):
+		"""Creates a directory for the database files"""
+		self.directory = tempfile.mkdtemp()
+
+	def tearDown(self):
+		"""Removes the directory"""
+		shutil.rmtree(self.directory)
+
+	def factory(self, keys):
+		"""Writes a user_data table of keys and returns a connection factory for it"""
+		path = os.path.join(self.directory, f"users{len(keys)}.db")
+		make_table(keys, path).close()
+		return functools.partial(connect_readonly, path)
+
+	def test_scan(self):
+		"""Empty and tiny tables are scanned whole, with more partitions than rows"""
+		for count in (0, 1, 3):
+			keys = [f"user-{i}" for i in range(count)]
+			factory = self.factory(keys)
+			for ordered in (True, False):
+				chunks = list(parallel_batch_processing(2, workers=2, ordered=ordered,
+					partitions=8, connection_factory=factory))
+				found = [user['user_id'] for chunk in chunks for user in chunk]
+				self.assertEqual(sorted(found), keys)
+
+	def test_stats(self):
+		"""Statistics of empty and tiny tables"""
+		for count in (0, 2):
+			factory = self.factory([f"user-{i}" for i in range(count)])
+			stats = parallel_stats('age', workers=2, partitions=8, connection_factory=factory)
+			self.assertEqual(stats.summary.count, count)
+
+
+if __name__ == "__main__":
+	unittest.main()
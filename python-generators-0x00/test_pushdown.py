@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""test cases for the pushdown module"""
+
+import sqlite3
+import unittest
+
+from pushdown import select_batches, Selection
+
+
+def make_table():
+	"""Returns an in-memory user_data table of 20 users, some without email"""
+	connection = sqlite3.connect(':memory:')
+	connection.execute(
+		"CREATE TABLE user_data (user_id TEXT PRIMARY KEY, name TEXT, email TEXT, age INTEGER)")
+	connection.executemany("INSERT INTO user_data VALUES (?, ?, ?, ?)", [
+		(f"user-{i:02d}", f"name{i}", None if i % 5 == 0 else f"u{i}@example.com", 15 + i)
+		for i in range(20)])
+	return connection
+
+
+class TestSelection(unittest.TestCase):
+	"""Test cases for compiling a Selection"""
+
+	def test_select(self):
+		"""The key and the columns of Python predicates are always fetched"""
+		self.assertEqual(Selection().select(), '*')
+		self.assertEqual(Selection(columns=('age',)).select(), 'user_id, age')
+		selection = Selection(columns=('age',), where=[('name', 'startswith', 'a')])
+		self.assertEqual(selection.select(), 'user_id, age, name')
+
+	def test_where(self):
+		"""SQL predicates become a parameterized condition, the others stay in Python"""
+		selection = Selection(where=[('age', '>', 25), ('email', 'is not null'),
+			('user_id', 'in', ['a', 'b']), ('name', 'contains', 'x')])
+		self.assertEqual(selection.where('%s'), (
+			"age > %s AND email IS NOT NULL AND user_id IN (%s, %s)", (25, 'a', 'b')))
+		self.assertEqual(selection.residual(), [('name', 'contains', 'x')])
+		self.assertIsNone(Selection(where=[('name', 'regex', 'x')]).where('?'))
+
+	def test_empty_in(self):
+		"""IN an empty list matches nothing, NOT IN it everything"""
+		self.assertEqual(Selection(where=[('age', 'in', [])]).where('?'), ('1 = 0', ()))
+		self.assertEqual(Selection(where=[('age', 'not in', [])]).where('?'), ('1 = 1', ()))
+
+	def test_invalid(self):
+		"""Column names and operators are checked before they reach SQL"""
+		for where in ([('age; DROP TABLE user_data', '>', 1)], [('age', 'like', 'x')],
+				[('age', 42, 1)]):
+			with self.assertRaises(ValueError):
+				Selection(where=where)
+		with self.assertRaises(ValueError):
+			Selection(columns=('age, email',))
+
+
+class TestSelectBatches(unittest.TestCase):
+	"""Test cases for select_batches against the same filters in Python"""
+
+	def setUp(self):
+		"""Creates the table and records the statements run on it"""
+		self.connection = make_table()
+		self.statements = []
+		self.connection.set_trace_callback(self.statements.append)
+		self.connection.row_factory = sqlite3.Row
+		self.users = [dict(row) for row in self.connection.execute(
+			"SELECT * FROM user_data ORDER BY user_id")]
+
+	def tearDown(self):
+		"""Closes the connection"""
+		self.connection.close()
+
+	def select(self, selection, batch_size=3):
+		"""Returns the rows of select_batches as dicts, and its batch sizes"""
+		self.statements.clear()
+		batches = list(select_batches(self.connection, batch_size, selection))
+		return [dict(row) for batch in batches for row in batch], [len(b) for b in batches]
+
+	def test_same_rows_as_python(self):
+		"""Pushed-down and Python predicates pick the rows matches() does"""
+		predicates = [
+			[('age', '>', 25)],
+			[('age', '<=', 20), ('email', 'is null')],
+			[('email', '!=', 'u3@example.com')],
+			[('user_id', 'in', ['user-03', 'user-11', 'nobody'])],
+			[('name', 'endswith', '1')],
+			[('age', '>=', 18), ('email', 'contains', '1'), ('age', lambda age: age % 2 == 0)],
+		]
+		for where in predicates:
+			selection = Selection(where=where)
+			rows, sizes = self.select(selection)
+			self.assertEqual(rows, [user for user in self.users if selection.matches(user)], where)
+			self.assertNotIn(0, sizes)
+
+	def test_pushed_into_sql(self):
+		"""Pushed-down predicates and the projection are in the queries"""
+		rows, _ = self.select(Selection(columns=('age',), where=[('age', '>', 30)]))
+		self.assertEqual([row['age'] for row in rows], [31, 32, 33, 34])
+		self.assertEqual(set(rows[0]), {'user_id', 'age'})
+		pages = [sql for sql in self.statements if 'ORDER BY' in sql]
+		self.assertTrue(pages)
+		for sql in pages:
+			self.assertIn('SELECT user_id, age FROM user_data', sql)
+			self.assertIn('age > 30', sql)
+
+	def test_residual_scans_every_page(self):
+		"""Pages emptied by a Python predicate are skipped, not taken for the end"""
+		rows, sizes = self.select(Selection(where=[('name', 'endswith', '19')]), batch_size=2)
+		self.assertEqual([row['user_id'] for row in rows], ['user-19'])
+		self.assertEqual(sizes, [1])
+		# 10 full pages, then an empty one past the last key
+		self.assertEqual(len([sql for sql in self.statements if 'ORDER BY' in sql]), 11)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""test cases for the incremental re-seed of the seed module"""
+
+import csv
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from contextlib import redirect_stdout
+from io import StringIO
+
+from seed import sync_csv_data, table_fingerprint, user_id_for
+
+
+class TestSyncCsvData(unittest.TestCase):
+	"""Test cases for sync_csv_data over a SQLite user_data table"""
+
+	def setUp(self):
+		"""Creates the table, the CSV file of 5 users and the index path"""
+		self.directory = tempfile.mkdtemp()
+		self.csv_path = os.path.join(self.directory, 'user_data.csv')
+		self.index_path = os.path.join(self.directory, 'user_data.hashes.db')
+		self.connection = sqlite3.connect(os.path.join(self.directory, 'user_data.db'))
+		self.connection.execute("""
+			CREATE TABLE user_data (
+				user_id CHAR(36) PRIMARY KEY,
+				name VARCHAR(255) NOT NULL,
+				email VARCHAR(255) NOT NULL,
+				age DECIMAL(5,2) NOT NULL
+			)""")
+		self.users = [[f"name{i}", f"user{i}@example.com", str(20 + i)] for i in range(5)]
+
+	def tearDown(self):
+		"""Closes the connection and removes the files"""
+		self.connection.close()
+		shutil.rmtree(self.directory)
+
+	def sync(self):
+		"""Writes the CSV file of self.users and syncs it, returning the report"""
+		with open(self.csv_path, 'w', newline='') as csv_file:
+			writer = csv.writer(csv_file)
+			writer.writerow(['name', 'email', 'age'])
+			writer.writerows(self.users)
+		with redirect_stdout(StringIO()):
+			return sync_csv_data(self.connection, self.csv_path, self.index_path, chunk_size=2)
+
+	def table(self):
+		"""Returns the rows of the table, as [name, email, age] sorted by email"""
+		return [[name, email, str(age)] for name, email, age in self.connection.execute(
+			"SELECT name, email, age FROM user_data ORDER BY email")]
+
+	def test_first_run(self):
+		"""Every row is new and gets the user_id derived from its email"""
+		self.assertEqual(self.sync(), {'new': 5, 'changed': 0, 'unchanged': 0})
+		self.assertEqual(self.table(), self.users)
+		user_id, = self.connection.execute(
+			"SELECT user_id FROM user_data WHERE email = 'user0@example.com'").fetchone()
+		self.assertEqual(user_id, user_id_for(['', 'name0', 'user0@example.com', '20']))
+
+	def test_unchanged(self):
+		"""A second run of the same file writes nothing"""
+		self.sync()
+		changes = self.connection.total_changes
+		self.assertEqual(self.sync(), {'new': 0, 'changed': 0, 'unchanged': 5})
+		self.assertEqual(self.connection.total_changes, changes)
+
+	def test_new_and_changed(self):
+		"""Only new and changed rows are sent"""
+		self.sync()
+		self.users[1][2] = '99'
+		self.users.append(['name5', 'user5@example.com', '25'])
+		self.assertEqual(self.sync(), {'new': 1, 'changed': 1, 'unchanged': 4})
+		self.assertEqual(self.table(), self.users)
+
+	def test_table_changed_elsewhere(self):
+		"""A change made outside the sync clears the index and resends every row"""
+		self.sync()
+		fingerprint = table_fingerprint(self.connection)
+		self.connection.execute("UPDATE user_data SET age = 1 WHERE email = 'user2@example.com'")
+		self.connection.commit()
+		self.assertNotEqual(table_fingerprint(self.connection), fingerprint)
+		self.assertEqual(self.sync(), {'new': 5, 'changed': 0, 'unchanged': 0})
+		self.assertEqual(self.table(), self.users)
+		self.assertEqual(self.sync()['unchanged'], 5)
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""test cases for the stats module"""
+
+import pickle
+import random
+import statistics
+import unittest
+from bisect import bisect_left
+
+from stats import Histogram, QuantileSketch, StreamStats, Summary
+
+
+def parts(values, count):
+	"""Splits values into count interleaved parts, like partitions would"""
+	return [values[i::count] for i in range(count)]
+
+
+class TestSummary(unittest.TestCase):
+	"""Test cases for Summary"""
+
+	def setUp(self):
+		"""Creates a stream with a large offset, hard on naive variance"""
+		rng = random.Random(1)
+		self.values = [1e9 + rng.gauss(0, 3) for _ in range(10000)]
+
+	def summarize(self, values):
+		"""Returns the summary of values"""
+		summary = Summary()
+		for value in values:
+			summary.update(value)
+		return summary
+
+	def test_single_pass(self):
+		"""The summary matches the statistics module"""
+		summary = self.summarize(self.values)
+		self.assertEqual(summary.count, len(self.values))
+		self.assertAlmostEqual(summary.mean, statistics.fmean(self.values), places=3)
+		self.assertAlmostEqual(summary.variance, statistics.pvariance(self.values), places=3)
+		self.assertEqual(summary.min, min(self.values))
+		self.assertEqual(summary.max, max(self.values))
+
+	def test_merge(self):
+		"""Merged partial summaries equal the summary of the whole stream"""
+		whole = self.summarize(self.values)
+		merged = Summary()
+		for part in parts(self.values, 7):
+			merged.merge(self.summarize(part))
+		self.assertEqual(merged.count, whole.count)
+		self.assertAlmostEqual(merged.mean, whole.mean, places=4)
+		self.assertAlmostEqual(merged.variance, whole.variance, places=4)
+		self.assertEqual((merged.min, merged.max), (whole.min, whole.max))
+
+	def test_merge_empty(self):
+		"""Empty summaries are neutral on either side"""
+		summary = self.summarize([1, 2, 3])
+		summary.merge(Summary())
+		self.assertEqual((summary.count, summary.mean), (3, 2.0))
+		empty = Summary().merge(summary)
+		self.assertEqual((empty.count, empty.mean, empty.min), (3, 2.0, 1.0))
+
+	def test_small_streams(self):
+		"""Variance is 0 below two values"""
+		self.assertEqual(Summary().variance, 0.0)
+		self.assertEqual(self.summarize([5]).variance, 0.0)
+
+
+class TestHistogram(unittest.TestCase):
+	"""Test cases for Histogram"""
+
+	def test_buckets(self):
+		"""Values fall in [low, high) buckets, open at both ends"""
+		histogram = Histogram([10, 20])
+		for value in (5, 10, 15, 20, 25):
+			histogram.update(value)
+		self.assertEqual(histogram.buckets(), [
+			((None, 10), 1), ((10, 20), 2), ((20, None), 2)])
+
+	def test_merge(self):
+		"""Counts add up; different edges cannot be merged"""
+		first, second = Histogram([10]), Histogram([10])
+		first.update(1)
+		second.update(11)
+		self.assertEqual(first.merge(second).counts, [1, 1])
+		with self.assertRaises(ValueError):
+			first.merge(Histogram([20]))
+
+
+class TestQuantileSketch(unittest.TestCase):
+	"""Test cases for QuantileSketch"""
+
+	# Largest rank error accepted, well above the ~1.7/k expected for k=200
+	TOLERANCE = 0.02
+
+	def setUp(self):
+		"""Creates a shuffled stream of 200,000 distinct values"""
+		self.values = list(range(200000))
+		random.Random(2).shuffle(self.values)
+		self.ordered = sorted(self.values)
+
+	def sketch(self, values, seed):
+		"""Returns the sketch of values"""
+		sketch = QuantileSketch(seed=seed)
+		for value in values:
+			sketch.update(value)
+		return sketch
+
+	def assertRanks(self, sketch):
+		"""Checks the rank error of a few quantiles"""
+		for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+			rank = bisect_left(self.ordered, sketch.quantile(q)) / len(self.ordered)
+			self.assertLess(abs(rank - q), self.TOLERANCE, f"quantile {q}")
+
+	def test_accuracy(self):
+		"""A sketch of the whole stream stays within its rank error"""
+		sketch = self.sketch(self.values, seed=3)
+		self.assertEqual(sketch.count, len(self.values))
+		self.assertRanks(sketch)
+
+	def test_bounded_size(self):
+		"""The sketch keeps a few k values, not the stream"""
+		sketch = self.sketch(self.values, seed=4)
+		self.assertLess(sketch.size, 3 * sketch.k + 50)
+
+	def test_merge_accuracy(self):
+		"""Merged partial sketches are as accurate as one sketch"""
+		merged = QuantileSketch(seed=5)
+		for seed, part in enumerate(parts(self.values, 8)):
+			merged.merge(self.sketch(part, seed))
+		self.assertEqual(merged.count, len(self.values))
+		self.assertLess(merged.size, 3 * merged.k + 50)
+		self.assertRanks(merged)
+
+	def test_empty_and_invalid(self):
+		"""An empty sketch has no quantile; q must be within [0, 1]"""
+		sketch = QuantileSketch()
+		self.assertIsNone(sketch.quantile(0.5))
+		with self.assertRaises(ValueError):
+			sketch.quantile(1.5)
+
+
+class TestStreamStats(unittest.TestCase):
+	"""Test cases for StreamStats"""
+
+	def test_merge_pickled(self):
+		"""Partial states survive pickling (between processes) and merge"""
+		values = [i % 97 for i in range(5000)]
+		whole = StreamStats([25, 50]).update_many(values)
+		merged = StreamStats([25, 50])
+		for part in parts(values, 4):
+			state = StreamStats([25, 50]).update_many(part)
+			merged.merge(pickle.loads(pickle.dumps(state)))
+
+		result, expected = merged.result(), whole.result()
+		for name in ('count', 'sum', 'min', 'max', 'histogram'):
+			self.assertEqual(result[name], expected[name])
+		self.assertAlmostEqual(result['mean'], expected['mean'])
+		self.assertAlmostEqual(result['variance'], expected['variance'])
+		self.assertAlmostEqual(result['percentiles'][50], 48, delta=3)
+
+
+if __name__ == "__main__":
+	unittest.main()
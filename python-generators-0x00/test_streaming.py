@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""test cases for the keyset pagination of the streaming module"""
+
+import sqlite3
+import unittest
+import uuid
+
+from streaming import fetch_page, keyset_batches, page_query
+
+
+def make_table(rows):
+	"""Returns an in-memory user_data table holding rows (user_id, age)"""
+	connection = sqlite3.connect(':memory:')
+	connection.execute(
+		"CREATE TABLE user_data (user_id TEXT PRIMARY KEY, age INTEGER)")
+	connection.executemany("INSERT INTO user_data VALUES (?, ?)", rows)
+	return connection
+
+
+class TestPageQuery(unittest.TestCase):
+	"""Test cases for page_query"""
+
+	def test_first_page(self):
+		"""The first page has no seek condition"""
+		query, params = page_query('?', 10)
+		self.assertEqual(
+			query, "SELECT * FROM user_data ORDER BY user_id LIMIT ?")
+		self.assertEqual(params, (10,))
+
+	def test_bounds(self):
+		"""after and until become a half-open key range"""
+		query, params = page_query('%s', 5, after='a', until='m')
+		self.assertIn("user_id > %s AND user_id <= %s", query)
+		self.assertEqual(params, ('a', 'm', 5))
+
+	def test_invalid_page_size(self):
+		"""A page must hold at least one row"""
+		for size in (0, -1):
+			with self.assertRaises(ValueError):
+				page_query('?', size)
+
+
+class TestKeysetBatches(unittest.TestCase):
+	"""Test cases for keyset_batches and fetch_page"""
+
+	def setUp(self):
+		"""Creates a table of 10 users with random UUID keys"""
+		self.keys = sorted(str(uuid.uuid4()) for _ in range(10))
+		self.connection = make_table([(key, 20 + i) for i, key in enumerate(self.keys)])
+
+	def tearDown(self):
+		"""Closes the connection"""
+		self.connection.close()
+
+	def scan(self, batch_size, **options):
+		"""Returns the batches of a scan, as lists of keys"""
+		return [[row[0] for row in batch] for batch in
+				keyset_batches(self.connection, batch_size, **options)]
+
+	def test_empty_table(self):
+		"""An empty table yields no batch"""
+		self.connection.execute("DELETE FROM user_data")
+		self.assertEqual(self.scan(3), [])
+		self.assertEqual(fetch_page(self.connection, 3), ([], None))
+
+	def test_short_last_page(self):
+		"""Every row is read once, in key order, the last page being short"""
+		batches = self.scan(3)
+		self.assertEqual([len(batch) for batch in batches], [3, 3, 3, 1])
+		self.assertEqual(sum(batches, []), self.keys)
+
+	def test_exact_multiple(self):
+		"""A table filling its last page exactly ends without an empty batch"""
+		batches = self.scan(5)
+		self.assertEqual([len(batch) for batch in batches], [5, 5])
+		self.assertEqual(sum(batches, []), self.keys)
+
+	def test_page_larger_than_table(self):
+		"""A single short page holds the whole table"""
+		self.assertEqual(self.scan(100), [self.keys])
+
+	def test_after_and_until(self):
+		"""A key range excludes after and includes until"""
+		batches = self.scan(2, after=self.keys[2], until=self.keys[6])
+		self.assertEqual(sum(batches, []), self.keys[3:7])
+
+	def test_after_last_key(self):
+		"""Seeking past the last key yields nothing"""
+		self.assertEqual(self.scan(4, after=self.keys[-1]), [])
+
+	def test_last_key(self):
+		"""fetch_page returns the key to resume from"""
+		rows, last_key = fetch_page(self.connection, 4)
+		self.assertEqual(last_key, self.keys[3])
+		rows, last_key = fetch_page(self.connection, 4, after=last_key)
+		self.assertEqual([row[0] for row in rows], self.keys[4:8])
+
+	def test_insert_during_scan(self):
+		"""Rows inserted before the current key do not shift later pages"""
+		batches = keyset_batches(self.connection, 3)
+		first = [row[0] for row in next(batches)]
+		self.connection.execute("INSERT INTO user_data VALUES ('', 1)")
+		rest = sum([[row[0] for row in batch] for batch in batches], [])
+		self.assertEqual(first + rest, self.keys)
+
+	def test_where(self):
+		"""Pages hold only the rows matching the extra condition"""
+		batches = self.scan(2, where=("age >= ?", (25,)))
+		self.assertEqual(sum(batches, []), self.keys[5:])
+
+
+if __name__ == "__main__":
+	unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""test cases for the watermark of the tail module"""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import unittest
+
+from tail import follow_rows, high_watermark, watch_inserts
+
+
+class TailTestCase(unittest.TestCase):
+	"""Creates a user_data table of three users in a database file"""
+
+	def setUp(self):
+		"""Creates the database and the stop event of the followers"""
+		self.directory = tempfile.mkdtemp()
+		self.path = os.path.join(self.directory, 'user_data.db')
+		self.connection = sqlite3.connect(self.path, isolation_level=None)
+		# Readers in the middle of a range must not block the writer
+		self.connection.execute("PRAGMA journal_mode = WAL")
+		self.connection.execute("CREATE TABLE user_data (name TEXT, age INTEGER)")
+		self.insert('a', 'b', 'c')
+		self.stop = threading.Event()
+
+	def tearDown(self):
+		"""Closes the connection and removes the database"""
+		self.connection.close()
+		shutil.rmtree(self.directory)
+
+	def insert(self, *names):
+		"""Inserts users of age 30"""
+		self.connection.executemany("INSERT INTO user_data VALUES (?, 30)",
+			[(name,) for name in names])
+
+	def follow(self, **options):
+		"""Returns a follower of user_data yielding names"""
+		options.setdefault('stop', self.stop)
+		rows = follow_rows(sqlite3.connect(self.path), close_connection=True, **options)
+		self.addCleanup(rows.close)
+		return (row[0] for row in rows)
+
+	def take(self, rows, count):
+		"""Returns the next count names"""
+		return [next(rows) for _ in range(count)]
+
+
+class TestWatermark(TailTestCase):
+	"""Test cases for the watermark of follow_rows"""
+
+	def test_high_watermark(self):
+		"""The highest rowid, or None for an empty table"""
+		self.assertEqual(high_watermark(self.connection), 3)
+		self.connection.execute("DELETE FROM user_data")
+		self.assertIsNone(high_watermark(self.connection))
+
+	def test_existing_then_new(self):
+		"""Existing rows come first, then each new row exactly once"""
+		rows = self.follow()
+		self.assertEqual(self.take(rows, 3), ['a', 'b', 'c'])
+		self.insert('d')
+		self.assertEqual(next(rows), 'd')
+		self.insert('e', 'f')
+		self.assertEqual(self.take(rows, 2), ['e', 'f'])
+
+	def test_insert_during_read(self):
+		"""A row inserted while a range is read comes with the next poll"""
+		rows = self.follow(arraysize=1)
+		self.assertEqual(next(rows), 'a')
+		self.insert('d')
+		self.assertEqual(self.take(rows, 3), ['b', 'c', 'd'])
+
+	def test_after(self):
+		"""after skips the rows up to that watermark"""
+		rows = self.follow(after=2)
+		self.assertEqual(next(rows), 'c')
+		self.insert('d')
+		self.assertEqual(next(rows), 'd')
+
+	def test_stop(self):
+		"""Setting stop ends the stream once the rows read so far are yielded"""
+		rows = self.follow(min_interval=0.01, max_interval=0.01)
+		self.assertEqual(self.take(rows, 3), ['a', 'b', 'c'])
+		self.stop.set()
+		self.insert('d')
+		self.assertEqual(list(rows), [])
+
+	def test_wakeup(self):
+		"""A watched insert wakes the follower long before its next poll"""
+		wakeup = threading.Event()
+		rows = self.follow(min_interval=0.05, max_interval=30, wakeup=wakeup)
+		self.assertEqual(self.take(rows, 3), ['a', 'b', 'c'])
+		committed = []
+
+		def write():
+			writer = sqlite3.connect(self.path)
+			watch_inserts(writer, wakeup)
+			writer.execute("INSERT INTO user_data VALUES ('d', 30)")
+			writer.commit()
+			writer.close()
+			committed.append(time.monotonic())
+
+		# By then the follower sleeps 3.2s between two polls, until 6.35s
+		timer = threading.Timer(3.3, write)
+		timer.start()
+		self.assertEqual(next(rows), 'd')
+		timer.join()
+		self.assertLess(time.monotonic() - committed[0], 1)
+
+	def test_invalid_intervals(self):
+		"""Poll intervals must be positive and ordered"""
+		with self.assertRaises(ValueError):
+			next(self.follow(min_interval=1, max_interval=0.5))
+
+
+if __name__ == "__main__":
+	unittest.main()
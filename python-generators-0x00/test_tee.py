@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""test cases for the tee module"""
+
+import time
+import unittest
+
+from tee import StreamTee
+
+
+class Source:
+	"""Batches of one row counting how far the scan is ahead of a consumer"""
+
+	def __init__(self, count):
+		self.count = count
+		self.produced = 0
+		self.consumed = 0
+		self.lead = 0
+		self.closed = False
+
+	def __iter__(self):
+		for i in range(self.count):
+			self.produced += 1
+			self.lead = max(self.lead, self.produced - self.consumed)
+			yield [i]
+
+	def close(self):
+		self.closed = True
+
+
+class TestStreamTee(unittest.TestCase):
+	"""Test cases for StreamTee"""
+
+	def test_every_consumer_gets_every_batch(self):
+		"""Inline and threaded consumers all see the whole stream once"""
+		inline, threaded = [], []
+		report = (StreamTee(Source(20))
+			.register(inline.extend)
+			.register(threaded.extend, threaded=True, name='threaded')
+			.run())
+		self.assertEqual(inline, list(range(20)))
+		self.assertEqual(threaded, list(range(20)))
+		self.assertEqual((report['batches'], report['rows']), (20, 20))
+		self.assertEqual(report['consumers']['threaded']['batches'], 20)
+
+	def test_backpressure(self):
+		"""The scan waits for a slow consumer instead of running ahead"""
+		source = Source(30)
+
+		def slow(batch):
+			time.sleep(0.002)
+			source.consumed += 1
+
+		report = StreamTee(source).register(slow, threaded=True, buffer=2).run()
+		self.assertEqual(source.consumed, 30)
+		self.assertGreater(report['consumers']['slow']['waits'], 0)
+		# The buffered batches, the one being processed and the one being put
+		self.assertLessEqual(source.lead, 2 + 2)
+
+	def test_early_close(self):
+		"""A consumer raising StopIteration is dropped, the others go on"""
+		for threaded in (False, True):
+			first, everything = [], []
+
+			def two_batches(batch):
+				if len(first) == 2:
+					raise StopIteration
+				first.extend(batch)
+
+			source = Source(50)
+			report = (StreamTee(source)
+				.register(two_batches, threaded=threaded, buffer=1)
+				.register(everything.extend)
+				.run())
+			self.assertEqual(first, [0, 1])
+			self.assertEqual(everything, list(range(50)))
+			self.assertTrue(report['consumers']['two_batches']['closed'])
+			self.assertEqual(report['batches'], 50)
+
+	def test_all_closed(self):
+		"""The scan stops once every consumer has closed"""
+		def one_batch(batch):
+			raise StopIteration
+
+		source = Source(1000)
+		report = StreamTee(source).register(one_batch).register(one_batch).run()
+		self.assertLess(report['batches'], 1000)
+		self.assertTrue(source.closed)
+
+	def test_error_stops_everything(self):
+		"""The first error is re-raised and the other consumers are stopped"""
+		def fail(batch):
+			raise RuntimeError("consumer failed")
+
+		def slow(batch):
+			time.sleep(0.01)
+
+		source = Source(1000)
+		tee = StreamTee(source).register(slow, threaded=True, buffer=1).register(fail)
+		with self.assertRaises(RuntimeError):
+			tee.run()
+		self.assertEqual(tee.failed, 'fail')
+		self.assertEqual(tee.batches, 1)
+		self.assertTrue(source.closed)
+
+	def test_no_consumer(self):
+		"""A tee needs a consumer and positive buffers"""
+		with self.assertRaises(ValueError):
+			StreamTee([]).run()
+		with self.assertRaises(ValueError):
+			StreamTee([]).register(print, threaded=True, buffer=0)
+
+
+if __name__ == "__main__":
+	unittest.main()